@@ -0,0 +1,57 @@
+import mmap
+import os
+import threading
+from typing import Optional
+
+
+class ArchivoMapeado:
+    """
+    Acceso de solo lectura a un archivo a través de mmap. El archivo se mapea
+    una vez y solo se vuelve a mapear cuando se pide un rango que queda fuera
+    de lo mapeado porque el archivo ha crecido desde entonces.
+
+    Al volver a mapear no se cierra el mapa anterior: puede que otro hilo
+    esté leyendo de él, y se libera solo cuando nadie lo usa.
+    """
+
+    def __init__(self, ruta: str):
+        self.ruta = ruta
+        self.fd: Optional[int] = None
+        self.mapa: Optional[mmap.mmap] = None
+        self.tamano = 0
+        self.cerrojo = threading.Lock()
+
+    def _remapear(self, hasta: int) -> None:
+        with self.cerrojo:
+            # Puede que otro hilo lo haya vuelto a mapear mientras esperábamos
+            if hasta <= self.tamano:
+                return
+            if self.fd is None:
+                self.fd = os.open(self.ruta, os.O_RDONLY)
+            tamano = os.fstat(self.fd).st_size
+            if tamano > 0:
+                mapa = mmap.mmap(self.fd, tamano, access=mmap.ACCESS_READ)
+                # Primero el mapa y después el tamaño, para que quien lea el
+                # tamaño nuevo encuentre ya el mapa que lo cubre
+                self.mapa = mapa
+                self.tamano = tamano
+
+    def leer(self, offset: int, longitud: int) -> str:
+        """
+        Devuelve el valor de "longitud" bytes que empieza en "offset",
+        decodificado directamente desde la memoria mapeada
+        """
+        if offset + longitud > self.tamano:
+            self._remapear(offset + longitud)
+        with memoryview(self.mapa)[offset:offset + longitud] as vista:
+            return str(vista, 'utf-8')
+
+    def cerrar(self) -> None:
+        with self.cerrojo:
+            if self.mapa is not None:
+                self.mapa.close()
+                self.mapa = None
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
+            self.tamano = 0
@@ -0,0 +1,245 @@
+import bisect
+import io
+import itertools
+import lzma
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from formato_registro import BORRADO, FormatoRegistro
+from cache_descriptores import CacheDescriptores, CACHE_DESCRIPTORES
+from durabilidad import archivo_atomico
+
+# Bytes de registros sin comprimir que se agrupan en cada bloque
+TAMANO_BLOQUE = 1 << 14
+
+# Nombre -> (compresión, descompresión)
+COMPRESORES: Dict[str, Tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]] = {
+    "zlib": (lambda datos: zlib.compress(datos, 6), zlib.decompress),
+    "lzma": (lambda datos: lzma.compress(datos, preset=6), lzma.decompress),
+}
+
+IDENTIFICADOR = b"BLOQUES1"
+# identificador, compresión (rellena con ceros), número de registros y de bloques
+CABECERA = struct.Struct("<8s8sQI")
+# primera clave del bloque, offset y longitud comprimida del bloque en el archivo
+ENTRADA = struct.Struct("<qQI")
+
+# Cada ArchivoBloques tiene un número distinto con el que se guardan sus bloques
+# en la caché, así que un archivo nuevo con la misma ruta nunca ve bloques antiguos
+_numeros = itertools.count()
+
+
+def obtener_compresor(nombre: str) -> Tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]:
+    if nombre not in COMPRESORES:
+        raise ValueError(f"Compresión desconocida: {nombre}")
+    return COMPRESORES[nombre]
+
+
+def ruta_indice(ruta: str) -> str:
+    return os.path.splitext(ruta)[0] + ".bloques"
+
+
+class CacheBloques:
+    """
+    Caché LRU compartida de bloques ya descomprimidos, con la capacidad medida
+    en bytes sin comprimir. Cada bloque se guarda ya separado en registros
+    (claves ordenadas y sus valores), así que una lectura que acierta no
+    descomprime ni interpreta nada.
+    """
+
+    def __init__(self, capacidad: int = 32 << 20):
+        self.capacidad = capacidad
+        self.bloques: "OrderedDict[Tuple[int, int], Tuple[List[int], List[Optional[str]], int]]" = OrderedDict()
+        self.ocupado = 0
+        self.cerrojo = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, clave: Tuple[int, int]) -> Optional[Tuple[List[int], List[Optional[str]]]]:
+        with self.cerrojo:
+            bloque = self.bloques.get(clave)
+            if bloque is None:
+                self.fallos += 1
+                return None
+            self.aciertos += 1
+            self.bloques.move_to_end(clave)
+            return bloque[0], bloque[1]
+
+    def guardar(self, clave: Tuple[int, int], claves: List[int], valores: List[Optional[str]],
+                tamano: int) -> None:
+        if tamano > self.capacidad:
+            return
+        with self.cerrojo:
+            anterior = self.bloques.pop(clave, None)
+            if anterior is not None:
+                self.ocupado -= anterior[2]
+            while self.ocupado + tamano > self.capacidad:
+                _, (_, _, tamano_antiguo) = self.bloques.popitem(last=False)
+                self.ocupado -= tamano_antiguo
+            self.bloques[clave] = (claves, valores, tamano)
+            self.ocupado += tamano
+
+    def descartar(self, numero: int) -> None:
+        """
+        Quita de la caché los bloques del archivo "numero"
+        """
+        with self.cerrojo:
+            for clave in [clave for clave in self.bloques if clave[0] == numero]:
+                self.ocupado -= self.bloques.pop(clave)[2]
+
+    def estadisticas(self) -> Dict[str, int]:
+        return {"aciertos": self.aciertos, "fallos": self.fallos,
+                "bloques": len(self.bloques), "ocupado": self.ocupado}
+
+
+# Caché que comparten por defecto todos los archivos de bloques
+CACHE_BLOQUES = CacheBloques()
+
+
+def escribir_bloques(ruta: str, registros: Iterable[Tuple[int, Optional[str]]], formato: FormatoRegistro,
+                     compresion: str, tamano_bloque: int = TAMANO_BLOQUE) -> int:
+    """
+    Escribe en "ruta" los registros, que deben venir ordenados por clave y sin
+    claves repetidas, en bloques de unos "tamano_bloque" bytes (sin comprimir)
+    codificados con "formato" y comprimidos por separado. El índice de bloques
+    (primera clave, offset y longitud de cada uno) se guarda aparte, en el
+    archivo ".bloques". Los registros con valor None se escriben como lápidas.
+    Los dos archivos quedan forzados a disco, el de datos antes que el índice.
+    Devuelve el número de registros escritos.
+    """
+    comprimir = obtener_compresor(compresion)[0]
+    indice: List[Tuple[int, int, int]] = []
+    num_registros = 0
+    offset = 0
+    with open(ruta, 'wb') as f:
+        pendientes: List[bytes] = []
+        ocupado = 0
+        primera = 0
+
+        def cerrar_bloque() -> None:
+            nonlocal offset
+            datos = comprimir(b"".join(pendientes))
+            f.write(datos)
+            indice.append((primera, offset, len(datos)))
+            offset += len(datos)
+
+        for clave, valor in registros:
+            if not pendientes:
+                primera = clave
+            registro = formato.codificar_borrado(clave) if valor is None else formato.codificar(clave, valor)[0]
+            pendientes.append(registro)
+            ocupado += len(registro)
+            num_registros += 1
+            if ocupado >= tamano_bloque:
+                cerrar_bloque()
+                pendientes = []
+                ocupado = 0
+        if pendientes:
+            cerrar_bloque()
+        f.flush()
+        os.fsync(f.fileno())
+
+    with archivo_atomico(ruta_indice(ruta), 'wb') as f:
+        f.write(CABECERA.pack(IDENTIFICADOR, compresion.encode(), num_registros, len(indice)))
+        f.write(b"".join(ENTRADA.pack(*entrada) for entrada in indice))
+    return num_registros
+
+
+class ArchivoBloques:
+    """
+    Lectura de un archivo escrito con "escribir_bloques". Solo se guarda en
+    memoria el índice de bloques: para leer una clave se busca el único bloque
+    que puede contenerla, se lee con un pread y se descomprime, y el bloque
+    descomprimido se queda en la caché "cache" para las siguientes lecturas.
+    """
+
+    def __init__(self, ruta: str, formato: FormatoRegistro, descriptores: Optional[CacheDescriptores] = None,
+                 cache: Optional[CacheBloques] = None):
+        self.ruta = ruta
+        self.formato = formato
+        self.descriptores = descriptores if descriptores is not None else CACHE_DESCRIPTORES
+        self.cache = cache if cache is not None else CACHE_BLOQUES
+        self.numero = next(_numeros)
+        with open(ruta_indice(ruta), 'rb') as f:
+            identificador, compresion, self.num_registros, num_bloques = CABECERA.unpack(f.read(CABECERA.size))
+            if identificador != IDENTIFICADOR:
+                raise ValueError(f"{ruta_indice(ruta)} no es un índice de bloques")
+            entradas = f.read(ENTRADA.size * num_bloques)
+        self.compresion = compresion.rstrip(b"\0").decode()
+        self.descomprimir = obtener_compresor(self.compresion)[1]
+        indice = list(ENTRADA.iter_unpack(entradas))
+        self.primeras_claves = [primera for primera, _, _ in indice]
+        self.posiciones = [(offset, longitud) for _, offset, longitud in indice]
+        # Bytes que ocupan en disco los bloques comprimidos
+        self.bytes_comprimidos = sum(longitud for _, longitud in self.posiciones)
+
+    def _descomprimir(self, bloque: int) -> Tuple[List[int], List[Optional[str]], int]:
+        offset, longitud = self.posiciones[bloque]
+        with self.descriptores.usar(self.ruta) as fd:
+            datos = self.descomprimir(os.pread(fd, longitud, offset))
+        claves = []
+        valores = []
+        for clave, valor, flags in self.formato.registros(io.BytesIO(datos)):
+            claves.append(clave)
+            valores.append(None if flags & BORRADO else valor)
+        return claves, valores, len(datos)
+
+    def _bloque(self, bloque: int) -> Tuple[List[int], List[Optional[str]]]:
+        en_cache = self.cache.obtener((self.numero, bloque))
+        if en_cache is not None:
+            return en_cache
+        claves, valores, tamano = self._descomprimir(bloque)
+        self.cache.guardar((self.numero, bloque), claves, valores, tamano)
+        return claves, valores
+
+    def _bloque_de(self, clave: int) -> int:
+        # Último bloque cuya primera clave es <= clave, o -1 si no hay ninguno
+        return bisect.bisect_right(self.primeras_claves, clave) - 1
+
+    def buscar(self, clave: int) -> Tuple[bool, Optional[str]]:
+        """
+        Devuelve (<encontrada>, <valor>), con valor None si es una lápida
+        """
+        bloque = self._bloque_de(clave)
+        if bloque < 0:
+            return False, None
+        claves, valores = self._bloque(bloque)
+        i = bisect.bisect_left(claves, clave)
+        if i < len(claves) and claves[i] == clave:
+            return True, valores[i]
+        return False, None
+
+    def buscar_muchos(self, claves: Iterable[int]) -> Dict[int, Optional[str]]:
+        """
+        Busca las claves en orden, así que cada bloque se obtiene una sola vez
+        """
+        encontradas = {}
+        for clave in sorted(claves):
+            encontrada, valor = self.buscar(clave)
+            if encontrada:
+                encontradas[clave] = valor
+        return encontradas
+
+    def registros(self, desde: Optional[int] = None, hasta: Optional[int] = None,
+                  usar_cache: bool = True) -> Iterator[Tuple[int, Optional[str]]]:
+        """
+        Recorre en orden los registros con desde <= clave <= hasta (None en las
+        lápidas), bloque a bloque. Con "usar_cache" a False los bloques no se
+        guardan en la caché, para que un recorrido completo (por ejemplo el
+        de la consolidación) no desaloje los bloques que usan las lecturas.
+        """
+        primero = 0 if desde is None else max(self._bloque_de(desde), 0)
+        for bloque in range(primero, len(self.posiciones)):
+            if hasta is not None and self.primeras_claves[bloque] > hasta:
+                break
+            claves, valores = self._bloque(bloque) if usar_cache else self._descomprimir(bloque)[:2]
+            inicio = 0 if desde is None else bisect.bisect_left(claves, desde)
+            fin = len(claves) if hasta is None else bisect.bisect_right(claves, hasta)
+            yield from zip(claves[inicio:fin], valores[inicio:fin])
+
+    def cerrar(self) -> None:
+        self.cache.descartar(self.numero)
+        self.descriptores.cerrar(self.ruta)
@@ -0,0 +1,110 @@
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterator, Set
+
+
+class CacheDescriptores:
+    """
+    Conjunto compartido de descriptores de archivo abiertos. Evita abrir y
+    cerrar el archivo en cada lectura y escritura: si se supera "max_abiertos"
+    se cierra el descriptor usado hace más tiempo (LRU).
+
+    Los descriptores se abren en modo lectura/escritura con O_APPEND, así que
+    sirven tanto para añadir registros al final como para leer con pread.
+
+    Con "usar" el descriptor queda reservado mientras dura el bloque: si otro
+    hilo lo desaloja o lo cierra entretanto, se cierra al terminar el último
+    que lo usa. Así nunca se cierra (y se reutiliza su número para otro
+    archivo) un descriptor con el que alguien está leyendo o escribiendo.
+    """
+    FLAGS = os.O_RDWR | os.O_CREAT | os.O_APPEND | getattr(os, "O_BINARY", 0)
+
+    def __init__(self, max_abiertos: int = 128):
+        if max_abiertos < 1:
+            raise ValueError("max_abiertos debe ser al menos 1")
+        self.max_abiertos = max_abiertos
+        self.descriptores: "OrderedDict[str, int]" = OrderedDict()
+        self.cerrojo = threading.Lock()
+        # descriptor -> número de bloques "usar" que lo tienen reservado
+        self.en_uso: Dict[int, int] = {}
+        # descriptores ya fuera de la caché que se cerrarán al dejar de usarse
+        self.pendientes_cierre: Set[int] = set()
+        self.aciertos = 0
+        self.fallos = 0
+        self.desalojos = 0
+
+    def _obtener(self, ruta: str) -> int:
+        # Se llama con el cerrojo adquirido
+        fd = self.descriptores.get(ruta)
+        if fd is not None:
+            self.aciertos += 1
+            self.descriptores.move_to_end(ruta)
+            return fd
+
+        self.fallos += 1
+        while len(self.descriptores) >= self.max_abiertos:
+            _, antiguo = self.descriptores.popitem(last=False)
+            self._cerrar_fd(antiguo)
+            self.desalojos += 1
+        fd = os.open(ruta, self.FLAGS, 0o644)
+        self.descriptores[ruta] = fd
+        return fd
+
+    def _cerrar_fd(self, fd: int) -> None:
+        if fd in self.en_uso:
+            self.pendientes_cierre.add(fd)
+        else:
+            os.close(fd)
+
+    def obtener(self, ruta: str) -> int:
+        """
+        Devuelve un descriptor abierto para "ruta", abriéndolo si no lo estaba.
+        Si otros hilos usan la caché a la vez, es mejor usar "usar".
+        """
+        with self.cerrojo:
+            return self._obtener(ruta)
+
+    @contextmanager
+    def usar(self, ruta: str) -> Iterator[int]:
+        """
+        Devuelve un descriptor abierto para "ruta" que no se cierra
+        mientras dura el bloque
+        """
+        with self.cerrojo:
+            fd = self._obtener(ruta)
+            self.en_uso[fd] = self.en_uso.get(fd, 0) + 1
+        try:
+            yield fd
+        finally:
+            with self.cerrojo:
+                self.en_uso[fd] -= 1
+                if self.en_uso[fd] == 0:
+                    del self.en_uso[fd]
+                    if fd in self.pendientes_cierre:
+                        self.pendientes_cierre.discard(fd)
+                        os.close(fd)
+
+    def cerrar(self, ruta: str) -> None:
+        """
+        Cierra el descriptor de "ruta", por ejemplo antes de borrar el archivo
+        """
+        with self.cerrojo:
+            fd = self.descriptores.pop(ruta, None)
+            if fd is not None:
+                self._cerrar_fd(fd)
+
+    def cerrar_todos(self) -> None:
+        with self.cerrojo:
+            for fd in self.descriptores.values():
+                self._cerrar_fd(fd)
+            self.descriptores.clear()
+
+    def estadisticas(self) -> Dict[str, int]:
+        return {"aciertos": self.aciertos, "fallos": self.fallos,
+                "desalojos": self.desalojos, "abiertos": len(self.descriptores)}
+
+
+# Conjunto que comparten por defecto todas las tablas
+CACHE_DESCRIPTORES = CacheDescriptores()
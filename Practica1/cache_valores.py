@@ -0,0 +1,305 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional, Tuple
+from tabla_base import TablaBase
+from metricas import Metricas
+from salida import SalidaResultados
+
+
+class CacheLRU:
+    """
+    Caché de valores que, cuando se llena, desaloja la clave usada hace
+    más tiempo. El tamaño de cada entrada lo da "coste", de forma que la
+    capacidad puede medirse en entradas o en bytes.
+    """
+
+    def __init__(self, capacidad: int):
+        self.capacidad = capacidad
+        self.entradas: "OrderedDict[int, Tuple[Optional[str], int]]" = OrderedDict()
+        self.ocupado = 0
+        self.desalojos = 0
+
+    def obtener(self, clave: int) -> Tuple[bool, Optional[str]]:
+        entrada = self.entradas.get(clave)
+        if entrada is None:
+            return False, None
+        self.entradas.move_to_end(clave)
+        return True, entrada[0]
+
+    def guardar(self, clave: int, valor: Optional[str], coste: int) -> None:
+        self.invalidar(clave)
+        if coste > self.capacidad:
+            return
+        while self.ocupado + coste > self.capacidad:
+            _, (_, coste_antiguo) = self.entradas.popitem(last=False)
+            self.ocupado -= coste_antiguo
+            self.desalojos += 1
+        self.entradas[clave] = (valor, coste)
+        self.ocupado += coste
+
+    def invalidar(self, clave: int) -> None:
+        entrada = self.entradas.pop(clave, None)
+        if entrada is not None:
+            self.ocupado -= entrada[1]
+
+    def __len__(self) -> int:
+        return len(self.entradas)
+
+
+class CacheARC:
+    """
+    Caché de reemplazo adaptativo (ARC). Reparte la capacidad entre las claves
+    vistas una sola vez (t1) y las vistas varias veces (t2), y recuerda las
+    claves desalojadas de cada lista (b1 y b2, solo las claves) para mover el
+    reparto hacia la lista que habría acertado. Así un recorrido de claves
+    que no se repiten no expulsa a las claves calientes como en LRU.
+
+    Se admite que las entradas tengan distinto coste (por ejemplo en bytes):
+    el objetivo "p" y los tamaños de las listas se miden en esa unidad.
+    """
+
+    def __init__(self, capacidad: int):
+        self.capacidad = capacidad
+        self.t1: "OrderedDict[int, Tuple[Optional[str], int]]" = OrderedDict()
+        self.t2: "OrderedDict[int, Tuple[Optional[str], int]]" = OrderedDict()
+        self.b1: "OrderedDict[int, int]" = OrderedDict()
+        self.b2: "OrderedDict[int, int]" = OrderedDict()
+        self.tamano = {"t1": 0, "t2": 0, "b1": 0, "b2": 0}
+        # Parte de la capacidad que se intenta dedicar a t1
+        self.p = 0.0
+        self.desalojos = 0
+
+    @property
+    def ocupado(self) -> int:
+        return self.tamano["t1"] + self.tamano["t2"]
+
+    def _sacar(self, lista: str, clave: Optional[int] = None) -> Tuple[int, object]:
+        """
+        Saca de la lista "lista" la clave "clave" (o la menos reciente)
+        y devuelve la clave y su entrada
+        """
+        entradas = getattr(self, lista)
+        if clave is None:
+            clave, entrada = entradas.popitem(last=False)
+        else:
+            entrada = entradas.pop(clave)
+        self.tamano[lista] -= entrada if lista in ("b1", "b2") else entrada[1]
+        return clave, entrada
+
+    def _reemplazar(self, coste: int, en_b2: bool) -> None:
+        # Desaloja de t1 o de t2 según el objetivo "p" hasta que quepa la nueva entrada
+        while self.t1 or self.t2:
+            if self.ocupado + coste <= self.capacidad:
+                break
+            if self.t1 and (self.tamano["t1"] > self.p or (en_b2 and self.tamano["t1"] >= self.p) or not self.t2):
+                clave, (_, coste_antiguo) = self._sacar("t1")
+                self.b1[clave] = coste_antiguo
+                self.tamano["b1"] += coste_antiguo
+            else:
+                clave, (_, coste_antiguo) = self._sacar("t2")
+                self.b2[clave] = coste_antiguo
+                self.tamano["b2"] += coste_antiguo
+            self.desalojos += 1
+
+    def obtener(self, clave: int) -> Tuple[bool, Optional[str]]:
+        for lista in ("t1", "t2"):
+            if clave in getattr(self, lista):
+                # Un acierto pasa la clave a la parte más reciente de t2
+                _, entrada = self._sacar(lista, clave)
+                self.t2[clave] = entrada
+                self.tamano["t2"] += entrada[1]
+                return True, entrada[0]
+        return False, None
+
+    def guardar(self, clave: int, valor: Optional[str], coste: int) -> None:
+        self.invalidar(clave)
+        if coste > self.capacidad:
+            return
+
+        if clave in self.b1:
+            # Se habría acertado con un t1 más grande
+            self.p = min(self.capacidad, self.p + max(self.tamano["b2"] / max(self.tamano["b1"], 1), 1) * coste)
+            self._sacar("b1", clave)
+            self._reemplazar(coste, False)
+            self.t2[clave] = (valor, coste)
+            self.tamano["t2"] += coste
+        elif clave in self.b2:
+            # Se habría acertado con un t2 más grande
+            self.p = max(0.0, self.p - max(self.tamano["b1"] / max(self.tamano["b2"], 1), 1) * coste)
+            self._sacar("b2", clave)
+            self._reemplazar(coste, True)
+            self.t2[clave] = (valor, coste)
+            self.tamano["t2"] += coste
+        else:
+            self._reemplazar(coste, False)
+            self.t1[clave] = (valor, coste)
+            self.tamano["t1"] += coste
+
+        # Las listas de claves desalojadas no pueden crecer sin límite
+        while self.b1 and self.tamano["t1"] + self.tamano["b1"] > self.capacidad:
+            self._sacar("b1")
+        while self.b2 and sum(self.tamano.values()) > 2 * self.capacidad:
+            self._sacar("b2")
+
+    def invalidar(self, clave: int) -> None:
+        for lista in ("t1", "t2"):
+            if clave in getattr(self, lista):
+                self._sacar(lista, clave)
+
+    def __len__(self) -> int:
+        return len(self.t1) + len(self.t2)
+
+
+POLITICAS = {"lru": CacheLRU, "arc": CacheARC}
+
+
+class TablaCacheada(TablaBase):
+    """
+    Caché de valores delante de cualquier TablaBase. Las lecturas que aciertan
+    no llegan a la tabla; las escrituras y borrados van directamente a la tabla
+    e invalidan la clave en la caché. También se guarda que una clave no existe,
+    para que leer repetidamente una clave ausente no vaya a disco.
+
+    - "capacidad": máximo de entradas o de bytes de los valores, según "unidad".
+    - "unidad": "entradas" o "bytes".
+    - "politica": "lru" o "arc" (ver CacheLRU y CacheARC).
+    """
+    UNIDADES = ("entradas", "bytes")
+
+    def __init__(self, tabla: TablaBase, capacidad: int = 10000,
+                 unidad: str = "entradas", politica: str = "lru"):
+        if unidad not in self.UNIDADES:
+            raise ValueError(f"Unidad de capacidad desconocida: {unidad}")
+        if politica not in POLITICAS:
+            raise ValueError(f"Política de caché desconocida: {politica}")
+        if capacidad < 1:
+            raise ValueError("La capacidad debe ser al menos 1")
+        self.tabla = tabla
+        self.unidad = unidad
+        self.cache = POLITICAS[politica](capacidad)
+        self.cerrojo = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        # Aumenta con cada invalidación: un valor leído de la tabla solo se guarda
+        # si no ha habido escrituras mientras tanto, porque podría estar desfasado
+        self.generacion = 0
+        self.metricas = Metricas()
+
+    def _coste(self, valor: Optional[str]) -> int:
+        if self.unidad == "entradas" or valor is None:
+            return 1
+        return max(len(valor.encode()), 1)
+
+    def _guardar(self, clave: int, valor: Optional[str], generacion: int) -> None:
+        with self.cerrojo:
+            if generacion == self.generacion:
+                self.cache.guardar(clave, valor, self._coste(valor))
+
+    def _invalidar(self, claves: List[int]) -> None:
+        with self.cerrojo:
+            self.generacion += 1
+            for clave in claves:
+                self.cache.invalidar(clave)
+
+    def leer(self, clave: int) -> Optional[str]:
+        inicio = time.perf_counter_ns()
+        clave = int(clave)
+        with self.cerrojo:
+            encontrada, valor = self.cache.obtener(clave)
+            if encontrada:
+                self.aciertos += 1
+            else:
+                self.fallos += 1
+            generacion = self.generacion
+        if not encontrada:
+            valor = self.tabla.leer(clave)
+            self._guardar(clave, valor, generacion)
+        self.metricas.registrar("l", time.perf_counter_ns() - inicio)
+        return valor
+
+    def escribir(self, clave: int, valor: str) -> bool:
+        inicio = time.perf_counter_ns()
+        clave = int(clave)
+        resultado = self.tabla.escribir(clave, valor)
+        self._invalidar([clave])
+        self.metricas.registrar("e", time.perf_counter_ns() - inicio)
+        return resultado
+
+    def borrar(self, clave: int) -> bool:
+        inicio = time.perf_counter_ns()
+        clave = int(clave)
+        resultado = self.tabla.borrar(clave)
+        self._invalidar([clave])
+        self.metricas.registrar("e", time.perf_counter_ns() - inicio)
+        return resultado
+
+    def leer_muchos(self, claves: List[int]) -> List[Optional[str]]:
+        if not claves:
+            return []
+        inicio = time.perf_counter_ns()
+        claves = [int(clave) for clave in claves]
+        valores = {}
+        with self.cerrojo:
+            for clave in dict.fromkeys(claves):
+                encontrada, valor = self.cache.obtener(clave)
+                if encontrada:
+                    valores[clave] = valor
+            self.aciertos += len(valores)
+            generacion = self.generacion
+        # Las claves que fallan se piden a la tabla en un solo lote
+        pendientes = [clave for clave in dict.fromkeys(claves) if clave not in valores]
+        if pendientes:
+            with self.cerrojo:
+                self.fallos += len(pendientes)
+            for clave, valor in zip(pendientes, self.tabla.leer_muchos(pendientes)):
+                valores[clave] = valor
+                self._guardar(clave, valor, generacion)
+        self.metricas.registrar("l", time.perf_counter_ns() - inicio, len(claves))
+        return [valores[clave] for clave in claves]
+
+    def escribir_muchos(self, pares: List[Tuple[int, str]]) -> bool:
+        if not pares:
+            return True
+        inicio = time.perf_counter_ns()
+        pares = [(int(clave), valor) for clave, valor in pares]
+        resultado = self.tabla.escribir_muchos(pares)
+        self._invalidar([clave for clave, _ in pares])
+        self.metricas.registrar("e", time.perf_counter_ns() - inicio, len(pares))
+        return resultado
+
+    def rango(self, desde: Optional[int] = None, hasta: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+        # Los recorridos no pasan por la caché para no desalojar las claves calientes
+        return self.tabla.rango(desde, hasta)
+
+    def cerrar(self) -> None:
+        cerrar = getattr(self.tabla, "cerrar", None)
+        if cerrar is not None:
+            cerrar()
+
+    def estadisticas(self) -> Dict[str, float]:
+        with self.cerrojo:
+            total = self.aciertos + self.fallos
+            return {"aciertos": self.aciertos, "fallos": self.fallos,
+                    "tasa_aciertos": self.aciertos / total if total else 0.0,
+                    "desalojos": self.cache.desalojos, "entradas": len(self.cache),
+                    "ocupado": self.cache.ocupado}
+
+    def procesar_operaciones(self, archivo: str, salida: Optional[SalidaResultados] = None) -> None:
+        if salida is None:
+            salida = SalidaResultados()
+        with open(archivo, 'r') as f:
+            for linea in f:
+                partes = linea.strip().split(" ", 2)
+                if partes[0] == "l":
+                    clave = int(partes[1])
+                    salida.escribir(clave, self.leer(clave))
+                elif partes[0] == "e":
+                    clave, valor = int(partes[1]), partes[2]
+                    self.escribir(clave, valor)
+                elif partes[0] == "b":
+                    self.borrar(int(partes[1]))
+        salida.vaciar()
+
+    def tiempos(self) -> List[Tuple[str, float]]:
+        return self.metricas.tiempos()
@@ -0,0 +1,67 @@
+import threading
+from contextlib import contextmanager, nullcontext
+from typing import Iterator
+
+
+class CerrojoLectoresEscritor:
+    """
+    Cerrojo que deja entrar a la vez a varios lectores o a un solo escritor.
+
+    Los escritores tienen preferencia: en cuanto uno espera, los lectores
+    nuevos esperan también, para que un flujo continuo de lecturas no deje
+    a las escrituras sin turno. No es reentrante: un hilo que ya lo tiene
+    no debe volver a pedirlo.
+    """
+
+    def __init__(self):
+        self.condicion = threading.Condition(threading.Lock())
+        self.lectores = 0
+        self.escribiendo = False
+        self.escritores_esperando = 0
+
+    @contextmanager
+    def lectura(self) -> Iterator[None]:
+        with self.condicion:
+            while self.escribiendo or self.escritores_esperando:
+                self.condicion.wait()
+            self.lectores += 1
+        try:
+            yield
+        finally:
+            with self.condicion:
+                self.lectores -= 1
+                if self.lectores == 0:
+                    self.condicion.notify_all()
+
+    @contextmanager
+    def escritura(self) -> Iterator[None]:
+        with self.condicion:
+            self.escritores_esperando += 1
+            while self.escribiendo or self.lectores:
+                self.condicion.wait()
+            self.escritores_esperando -= 1
+            self.escribiendo = True
+        try:
+            yield
+        finally:
+            with self.condicion:
+                self.escribiendo = False
+                self.condicion.notify_all()
+
+
+class CerrojoNulo:
+    """
+    Mismo interfaz que CerrojoLectoresEscritor pero sin sincronizar nada,
+    para las tablas que solo se usan desde un hilo
+    """
+    NULO = nullcontext()
+
+    def lectura(self) -> nullcontext:
+        return self.NULO
+
+    def escritura(self) -> nullcontext:
+        return self.NULO
+
+
+def crear_cerrojo(concurrente: bool):
+    return CerrojoLectoresEscritor() if concurrente else CerrojoNulo()
@@ -0,0 +1,263 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import IO, Callable, Iterator, Optional, Tuple
+from cache_descriptores import CacheDescriptores, CACHE_DESCRIPTORES
+
+
+def sincronizar_directorio(ruta: str) -> None:
+    """
+    Fuerza a disco las entradas de la carpeta "ruta", de forma que un archivo
+    recién creado o renombrado en ella sobrevive a una caída. En Windows las
+    carpetas no se pueden abrir y no hace falta.
+    """
+    if os.name == "nt":
+        return
+    fd = os.open(ruta or ".", os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def archivo_atomico(ruta: str, modo: str = 'w') -> Iterator[IO]:
+    """
+    Abre para escribir un archivo temporal que, al terminar el bloque, se
+    fuerza a disco y se renombra a "ruta" (forzando también la carpeta). Tras
+    una caída "ruta" es el archivo anterior o el nuevo completo, nunca uno a
+    medias. Si el bloque falla, "ruta" no cambia.
+    """
+    temporal = f"{ruta}.tmp"
+    with open(temporal, modo) as f:
+        yield f
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporal, ruta)
+    sincronizar_directorio(os.path.dirname(os.path.abspath(ruta)))
+
+
+class PoliticaDurabilidad:
+    """
+    Cuándo se fuerza a disco (fsync) lo que se escribe en una tabla:
+
+    - "siempre": cada escritura espera a estar en disco. Las escrituras
+      concurrentes se agrupan en un único write + fsync.
+    - "intervalo": se hace write + fsync como mucho cada "intervalo_ms" milisegundos.
+    - "bytes": se hace write + fsync cada vez que se acumulan "umbral_bytes" bytes.
+    - "so": cada escritura se pasa al sistema operativo y él decide cuándo
+      llega a disco (el comportamiento original).
+
+    Con "intervalo" y "bytes" las escrituras se acumulan en memoria hasta el
+    siguiente volcado, así que una caída del proceso puede perder como mucho
+    ese intervalo o esos bytes.
+    """
+    MODOS = ("siempre", "intervalo", "bytes", "so")
+
+    def __init__(self, modo: str = "so", intervalo_ms: float = 100, umbral_bytes: int = 1 << 20):
+        if modo not in self.MODOS:
+            raise ValueError(f"Política de durabilidad desconocida: {modo}")
+        self.modo = modo
+        self.intervalo_ms = intervalo_ms
+        self.umbral_bytes = umbral_bytes
+
+    @classmethod
+    def siempre(cls) -> "PoliticaDurabilidad":
+        return cls("siempre")
+
+    @classmethod
+    def cada_ms(cls, intervalo_ms: float) -> "PoliticaDurabilidad":
+        return cls("intervalo", intervalo_ms=intervalo_ms)
+
+    @classmethod
+    def cada_bytes(cls, umbral_bytes: int) -> "PoliticaDurabilidad":
+        return cls("bytes", umbral_bytes=umbral_bytes)
+
+    @classmethod
+    def sistema(cls) -> "PoliticaDurabilidad":
+        return cls("so")
+
+
+class EscritorLog:
+    """
+    Añade registros al final de un archivo siguiendo una política de
+    durabilidad. Hace de "group commit": mientras un hilo está escribiendo y
+    sincronizando un lote, los demás acumulan sus registros en el siguiente,
+    que se escribe con un solo write + fsync.
+    """
+
+    def __init__(self, ruta: str, politica: Optional[PoliticaDurabilidad] = None,
+                 descriptores: Optional[CacheDescriptores] = None):
+        self.ruta = ruta
+        self.politica = politica if politica is not None else PoliticaDurabilidad()
+        self.descriptores = descriptores if descriptores is not None else CACHE_DESCRIPTORES
+
+        self.cerrojo = threading.Lock()
+        self.condicion = threading.Condition(self.cerrojo)
+        self.pendiente = bytearray()
+        # Tamaño lógico del archivo, contando lo que aún está pendiente
+        self.tamano = os.path.getsize(ruta) if os.path.exists(ruta) else 0
+        # Bytes del archivo ya escritos por completo
+        self.tamano_escrito = self.tamano
+        # Número de registros añadidos, escritos al SO y forzados a disco
+        self.secuencia = 0
+        self.escrito = 0
+        self.duradero = 0
+        self.escribiendo = False
+        self.bytes_sin_sincronizar = 0
+        self.ultima_sincronizacion = time.monotonic()
+        self.temporizador: Optional[threading.Timer] = None
+        # Primer error de escritura o de fsync. No se sabe qué parte del lote
+        # llegó al archivo, así que los offsets reservados después ya no son
+        # fiables: a partir de ahí el log no admite más escrituras
+        self.error: Optional[BaseException] = None
+
+    def _comprobar_error(self) -> None:
+        if self.error is not None:
+            raise OSError(f"El log {self.ruta} no admite más escrituras tras un error: {self.error}") \
+                from self.error
+
+    def anyadir(self, datos: bytes, al_reservar: Optional[Callable[[int], None]] = None) -> int:
+        """
+        Añade "datos" al final del archivo y devuelve el offset en el que empiezan
+        """
+        mia, offset = self.reservar(datos, al_reservar)
+        self.esperar(mia)
+        return offset
+
+    def reservar(self, datos: bytes, al_reservar: Optional[Callable[[int], None]] = None) -> Tuple[int, int]:
+        """
+        Reserva el sitio de "datos" al final del archivo sin esperar a que se
+        escriban. Devuelve el número de secuencia de la escritura (para
+        "esperar") y el offset en el que empiezan los datos.
+
+        "al_reservar" se llama con el offset mientras se tiene el cerrojo, de
+        modo que las tablas actualizan su índice en el mismo orden en que
+        quedan los registros en el archivo, aunque escriban varios hilos.
+        """
+        with self.cerrojo:
+            self._comprobar_error()
+            offset = self.tamano
+            self.tamano += len(datos)
+            self.pendiente += datos
+            self.secuencia += 1
+            if al_reservar is not None:
+                al_reservar(offset)
+            return self.secuencia, offset
+
+    def esperar(self, mia: int) -> None:
+        """
+        Aplica la política de durabilidad a la escritura con número de secuencia "mia".
+        Si el lote con la escritura (o uno anterior) ha fallado, lanza el error.
+        """
+        with self.cerrojo:
+            modo = self.politica.modo
+            if modo == "siempre":
+                # Si otro hilo está escribiendo un lote esperamos a que termine:
+                # puede que ya incluya nuestro registro o, si no, lo llevará el siguiente
+                while self.duradero < mia:
+                    self._comprobar_error()
+                    if self.escribiendo:
+                        self.condicion.wait()
+                    else:
+                        self._vaciar(True)
+            elif self.error is not None:
+                # Solo fallan las escrituras que no llegaron al archivo antes del error
+                if self.escrito < mia:
+                    self._comprobar_error()
+            elif modo == "so":
+                self._vaciar(False)
+            elif modo == "bytes":
+                if len(self.pendiente) + self.bytes_sin_sincronizar >= self.politica.umbral_bytes:
+                    self._vaciar(True)
+            elif time.monotonic() - self.ultima_sincronizacion >= self.politica.intervalo_ms / 1000:
+                self._vaciar(True)
+            elif self.temporizador is None:
+                # Si no llegan más escrituras, el temporizador hace el volcado a tiempo
+                self.temporizador = threading.Timer(self.politica.intervalo_ms / 1000, self._volcado_programado)
+                self.temporizador.daemon = True
+                self.temporizador.start()
+
+    def _volcado_programado(self) -> None:
+        with self.cerrojo:
+            self.temporizador = None
+            try:
+                self._vaciar(True)
+            except OSError:
+                # Queda guardado en "error" y lo verá la siguiente operación
+                pass
+
+    def _vaciar(self, sincronizar: bool) -> None:
+        """
+        Escribe en el archivo todo lo pendiente (y hace fsync si "sincronizar").
+        Se llama con el cerrojo adquirido, que se suelta mientras dura la E/S
+        para que otros hilos puedan ir llenando el siguiente lote.
+
+        Si la escritura o el fsync fallan no se da nada por escrito: el error se
+        guarda, se lanza aquí y también a quienes esperan por ese lote o los
+        siguientes.
+        """
+        while self.escribiendo:
+            self.condicion.wait()
+        self._comprobar_error()
+        if not self.pendiente and not (sincronizar and self.bytes_sin_sincronizar):
+            return
+
+        lote = self.pendiente
+        hasta = self.secuencia
+        self.pendiente = bytearray()
+        self.escribiendo = True
+        self.cerrojo.release()
+        try:
+            with self.descriptores.usar(self.ruta) as fd:
+                vista = memoryview(lote)
+                while vista:
+                    vista = vista[os.write(fd, vista):]
+                if sincronizar:
+                    os.fsync(fd)
+        except BaseException as e:
+            self.cerrojo.acquire()
+            self.escribiendo = False
+            self.error = e
+            self.condicion.notify_all()
+            raise
+        self.cerrojo.acquire()
+        self.escribiendo = False
+        # Primero los bytes y después la secuencia: quien vea la secuencia
+        # nueva ve también los bytes que la cubren
+        self.tamano_escrito += len(lote)
+        self.escrito = hasta
+        if sincronizar:
+            self.duradero = hasta
+            self.bytes_sin_sincronizar = 0
+            self.ultima_sincronizacion = time.monotonic()
+        else:
+            self.bytes_sin_sincronizar += len(lote)
+        self.condicion.notify_all()
+
+    def asegurar_legible(self) -> int:
+        """
+        Pasa al archivo lo que esté pendiente para que las lecturas lo vean.
+        Devuelve hasta qué byte está escrito el archivo por completo: lo que
+        haya detrás puede ser un registro que otro hilo está escribiendo.
+        """
+        # Si todo lo reservado ya se ha escrito no hace falta el cerrojo
+        if self.escrito != self.secuencia:
+            with self.cerrojo:
+                self._vaciar(False)
+        return self.tamano_escrito
+
+    def sincronizar(self) -> None:
+        """
+        Escribe lo pendiente y lo fuerza a disco, salvo con la política "so"
+        """
+        with self.cerrojo:
+            self._vaciar(self.politica.modo != "so")
+
+    def cerrar(self) -> None:
+        with self.cerrojo:
+            if self.temporizador is not None:
+                self.temporizador.cancel()
+                self.temporizador = None
+        self.sincronizar()
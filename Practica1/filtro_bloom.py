@@ -0,0 +1,67 @@
+import hashlib
+import math
+import struct
+from typing import Iterable, Iterator, Optional
+from durabilidad import archivo_atomico
+
+
+class FiltroBloom:
+    """
+    Filtro de Bloom sobre las claves de un segmento. Si el filtro dice que
+    una clave no está, seguro que no está; si dice que puede estar, se
+    equivoca con una probabilidad cercana a "tasa_falsos_positivos".
+    """
+    # número de funciones hash (uint32), número de bits (uint64)
+    CABECERA = struct.Struct("<IQ")
+
+    def __init__(self, num_bits: int, num_hashes: int, bits: Optional[bytearray] = None):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = bits if bits is not None else bytearray((num_bits + 7) // 8)
+
+    @classmethod
+    def crear(cls, claves: Iterable[int], tasa_falsos_positivos: float = 0.01,
+              num_elementos: Optional[int] = None) -> "FiltroBloom":
+        """
+        Crea un filtro dimensionado para las claves dadas y la tasa de falsos
+        positivos deseada. Si se indica "num_elementos" las claves se recorren
+        una sola vez sin guardarlas en memoria.
+        """
+        if num_elementos is None:
+            claves = set(claves)
+            num_elementos = len(claves)
+        n = max(num_elementos, 1)
+        num_bits = max(math.ceil(-n * math.log(tasa_falsos_positivos) / math.log(2) ** 2), 8)
+        num_hashes = max(round(num_bits / n * math.log(2)), 1)
+        filtro = cls(num_bits, num_hashes)
+        for clave in claves:
+            filtro.anyadir(clave)
+        return filtro
+
+    def _posiciones(self, clave: int) -> Iterator[int]:
+        # Doble hashing: las k posiciones salen de combinar dos hashes de 64 bits
+        resumen = hashlib.blake2b(str(clave).encode(), digest_size=16).digest()
+        h1 = int.from_bytes(resumen[:8], 'little')
+        h2 = int.from_bytes(resumen[8:], 'little') | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def anyadir(self, clave: int) -> None:
+        for posicion in self._posiciones(clave):
+            self.bits[posicion >> 3] |= 1 << (posicion & 7)
+
+    def __contains__(self, clave: int) -> bool:
+        return all(self.bits[posicion >> 3] & (1 << (posicion & 7)) for posicion in self._posiciones(clave))
+
+    def guardar(self, ruta: str) -> None:
+        # Un filtro a medias tras una caída haría fallar todas las lecturas
+        with archivo_atomico(ruta, 'wb') as f:
+            f.write(self.CABECERA.pack(self.num_hashes, self.num_bits))
+            f.write(self.bits)
+
+    @classmethod
+    def cargar(cls, ruta: str) -> "FiltroBloom":
+        with open(ruta, 'rb') as f:
+            num_hashes, num_bits = cls.CABECERA.unpack(f.read(cls.CABECERA.size))
+            bits = bytearray(f.read())
+        return cls(num_bits, num_hashes, bits)
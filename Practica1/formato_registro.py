@@ -0,0 +1,266 @@
+import os
+import struct
+import zlib
+from abc import ABC, abstractmethod
+from typing import BinaryIO, Dict, Iterator, Optional, Tuple
+
+# Flag de los registros que marcan una clave como borrada (lápidas)
+BORRADO = 0x01
+
+
+class FormatoRegistro(ABC):
+    """
+    Formato con el que se guardan los registros (clave, valor) en los
+    archivos de las tablas de los apartados 1.2, 1.3 y 1.4.
+
+    Los índices guardan, para cada clave, la posición y la longitud en bytes
+    del valor dentro del archivo, de forma que una lectura es un único
+    `pread` del tamaño conocido sin tener que interpretar el registro.
+    """
+    nombre: str
+
+    @abstractmethod
+    def codificar(self, clave: int, valor: str) -> Tuple[bytes, int, int]:
+        """
+        Devuelve los bytes del registro, la posición del valor dentro del
+        registro y la longitud en bytes del valor
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def codificar_borrado(self, clave: int) -> bytes:
+        """
+        Devuelve los bytes de una lápida: un registro sin valor que indica
+        que la clave se ha borrado
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def iterar(self, f: BinaryIO, desde: int = 0, hasta: Optional[int] = None) -> Iterator[Tuple[int, int, int, int]]:
+        """
+        Recorre los registros del archivo "f" a partir del byte "desde" y, si se
+        indica, sin pasar del byte "hasta" (por ejemplo para no leer un registro
+        que otro hilo está escribiendo).
+        Cada elemento es de la forma (<clave>, <offset valor>, <longitud valor>, <flags>),
+        donde las lápidas llevan el flag BORRADO
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def registros(self, f: BinaryIO, desde: int = 0) -> Iterator[Tuple[int, str, int]]:
+        """
+        Lee secuencialmente los registros del archivo "f" a partir del byte "desde".
+        Cada elemento es de la forma (<clave>, <valor>, <flags>); el valor de
+        las lápidas es la cadena vacía
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def recuperar(self, f: BinaryIO, desde: int = 0) -> Tuple[int, int]:
+        """
+        Comprueba los registros del archivo "f" a partir del byte "desde".
+        Devuelve el número de registros válidos y el offset en el que termina
+        el último de ellos: solo el último registro del archivo puede haber
+        quedado a medias (una escritura interrumpida) y quedar fuera. Un
+        registro dañado seguido de otros no es una escritura interrumpida
+        sino un archivo corrupto, y lanza ValueError.
+        """
+        raise NotImplementedError
+
+    def leer_valor(self, fd: int, offset: int, longitud: int) -> str:
+        """
+        Lee el valor que ocupa "longitud" bytes a partir de "offset"
+        en el descriptor "fd"
+        """
+        return os.pread(fd, longitud, offset).decode()
+
+
+class FormatoTexto(FormatoRegistro):
+    """
+    Formato de texto: una línea `#<crc> <clave>,<valor>` por registro, donde
+    <crc> es el CRC32 en hexadecimal (8 cifras) de `<clave>,<valor>`. Las
+    lápidas son líneas con la clave y sin coma (`#<crc> <clave>`).
+
+    No admite valores que contengan saltos de línea (se rechazan con
+    ValueError). Las líneas sin "#" son del formato original, sin CRC: se
+    siguen leyendo, pero de ellas solo se puede comprobar que la clave es
+    un número.
+    """
+    nombre = "texto"
+    # "#", el CRC en hexadecimal y un espacio
+    LONGITUD_CRC = 10
+
+    @classmethod
+    def _con_crc(cls, cuerpo: bytes) -> bytes:
+        return b"#%08x " % zlib.crc32(cuerpo) + cuerpo + b"\n"
+
+    def codificar(self, clave: int, valor: str) -> Tuple[bytes, int, int]:
+        if "\n" in valor or "\r" in valor:
+            raise ValueError(f"El formato texto no admite saltos de línea en los valores (clave {clave})")
+        prefijo = f"{clave},".encode()
+        datos = valor.encode()
+        return self._con_crc(prefijo + datos), self.LONGITUD_CRC + len(prefijo), len(datos)
+
+    def codificar_borrado(self, clave: int) -> bytes:
+        return self._con_crc(f"{clave}".encode())
+
+    def _cuerpo(self, registro: bytes) -> Tuple[bytes, int]:
+        """
+        Devuelve la línea sin el CRC ni el salto de línea y cuántos bytes
+        ocupa el CRC al principio (0 en las líneas del formato original)
+        """
+        if registro.endswith(b'\n'):
+            registro = registro[:-1]
+        if registro.startswith(b'#'):
+            return registro[self.LONGITUD_CRC:], self.LONGITUD_CRC
+        return registro, 0
+
+    def iterar(self, f: BinaryIO, desde: int = 0, hasta: Optional[int] = None) -> Iterator[Tuple[int, int, int, int]]:
+        f.seek(desde)
+        offset = desde
+        for registro in f:
+            if hasta is not None and offset + len(registro) > hasta:
+                break
+            # Lo mismo que _cuerpo, sin la llamada: se ejecuta en cada registro
+            desplazamiento = self.LONGITUD_CRC if registro[:1] == b'#' else 0
+            clave, coma, valor = registro[desplazamiento:].partition(b',')
+            if coma:
+                inicio_valor = offset + desplazamiento + len(clave) + 1
+                yield int(clave), inicio_valor, len(valor.rstrip(b'\n')), 0
+            else:
+                yield int(clave), offset + len(registro), 0, BORRADO
+            offset += len(registro)
+
+    def registros(self, f: BinaryIO, desde: int = 0) -> Iterator[Tuple[int, str, int]]:
+        f.seek(desde)
+        for registro in f:
+            clave, coma, valor = self._cuerpo(registro)[0].partition(b',')
+            yield int(clave), valor.decode(), 0 if coma else BORRADO
+
+    def _comprobar(self, registro: bytes) -> None:
+        """
+        Lanza ValueError si la línea completa "registro" no es un registro válido
+        """
+        cuerpo, desplazamiento = self._cuerpo(registro)
+        if desplazamiento and (registro[desplazamiento - 1:desplazamiento] != b" "
+                               or int(registro[1:desplazamiento - 1], 16) != zlib.crc32(cuerpo)):
+            raise ValueError("CRC incorrecto")
+        int(cuerpo.partition(b',')[0])
+
+    def recuperar(self, f: BinaryIO, desde: int = 0) -> Tuple[int, int]:
+        # Una escritura interrumpida solo puede afectar a la última línea: puede
+        # quedar sin salto de línea o, si se escribió desordenada, con el CRC mal
+        f.seek(desde)
+        validos = 0
+        fin = desde
+        for registro in f:
+            if not registro.endswith(b'\n'):
+                break
+            try:
+                self._comprobar(registro)
+            except ValueError:
+                if f.read(1):
+                    raise ValueError(f"Registro dañado en el byte {fin} de {getattr(f, 'name', 'la tabla')}") from None
+                break
+            validos += 1
+            fin += len(registro)
+        return validos, fin
+
+
+class FormatoBinario(FormatoRegistro):
+    """
+    Formato binario: una cabecera de tamaño fijo con la clave, la longitud
+    del valor, los flags y el CRC32 del registro, seguida de los bytes del valor.
+    Las lápidas son registros sin valor con el flag BORRADO.
+    """
+    nombre = "binario"
+    # clave (int64), longitud del valor (uint32), flags (uint8)
+    CAMPOS = struct.Struct("<qIB")
+    # los campos anteriores seguidos del CRC32 (uint32) de los campos y el valor
+    CABECERA = struct.Struct("<qIBI")
+
+    @classmethod
+    def empaquetar(cls, clave: int, datos: bytes, flags: int = 0) -> bytes:
+        campos = cls.CAMPOS.pack(clave, len(datos), flags)
+        return campos + struct.pack("<I", zlib.crc32(datos, zlib.crc32(campos))) + datos
+
+    def codificar(self, clave: int, valor: str) -> Tuple[bytes, int, int]:
+        datos = valor.encode()
+        return self.empaquetar(int(clave), datos), self.CABECERA.size, len(datos)
+
+    def codificar_borrado(self, clave: int) -> bytes:
+        return self.empaquetar(int(clave), b"", BORRADO)
+
+    def iterar(self, f: BinaryIO, desde: int = 0, hasta: Optional[int] = None) -> Iterator[Tuple[int, int, int, int]]:
+        f.seek(desde)
+        offset = desde
+        while True:
+            cabecera = f.read(self.CABECERA.size)
+            if len(cabecera) < self.CABECERA.size:
+                break
+            clave, longitud, flags, crc = self.CABECERA.unpack(cabecera)
+            if hasta is not None and offset + self.CABECERA.size + longitud > hasta:
+                break
+            offset += self.CABECERA.size
+            yield clave, offset, longitud, flags
+            offset += longitud
+            f.seek(offset)
+
+    def registros(self, f: BinaryIO, desde: int = 0) -> Iterator[Tuple[int, str, int]]:
+        f.seek(desde)
+        while True:
+            cabecera = f.read(self.CABECERA.size)
+            if len(cabecera) < self.CABECERA.size:
+                break
+            clave, longitud, flags, crc = self.CABECERA.unpack(cabecera)
+            yield clave, f.read(longitud).decode(), flags
+
+    def recuperar(self, f: BinaryIO, desde: int = 0) -> Tuple[int, int]:
+        f.seek(desde)
+        validos = 0
+        fin = desde
+        while True:
+            cabecera = f.read(self.CABECERA.size)
+            if len(cabecera) < self.CABECERA.size:
+                break
+            clave, longitud, flags, crc = self.CABECERA.unpack(cabecera)
+            datos = f.read(longitud)
+            if len(datos) < longitud:
+                break
+            if zlib.crc32(datos, zlib.crc32(cabecera[:self.CAMPOS.size])) != crc:
+                # Un registro completo con el CRC mal solo puede ser una
+                # escritura interrumpida si es el último del archivo
+                if f.read(1):
+                    raise ValueError(f"Registro dañado en el byte {fin} de {getattr(f, 'name', 'la tabla')}")
+                break
+            validos += 1
+            fin += self.CABECERA.size + longitud
+        return validos, fin
+
+
+FORMATOS: Dict[str, FormatoRegistro] = {
+    FormatoTexto.nombre: FormatoTexto(),
+    FormatoBinario.nombre: FormatoBinario(),
+}
+
+
+def obtener_formato(nombre: str) -> FormatoRegistro:
+    if nombre not in FORMATOS:
+        raise ValueError(f"Formato de registro desconocido: {nombre}")
+    return FORMATOS[nombre]
+
+
+def recuperar_archivo(ruta: str, formato: FormatoRegistro, desde: int = 0) -> Tuple[int, int]:
+    """
+    Comprueba la cola del archivo "ruta" a partir del byte "desde" y trunca el
+    último registro si quedó a medias (por ejemplo tras una caída en mitad de
+    una escritura). Devuelve el número de registros válidos comprobados y el
+    número de bytes descartados. Si hay un registro dañado antes del último
+    lanza ValueError sin tocar el archivo.
+    """
+    with open(ruta, 'r+b') as f:
+        validos, fin = formato.recuperar(f, desde)
+        tamano = f.seek(0, os.SEEK_END)
+        if fin < tamano:
+            f.truncate(fin)
+    return validos, tamano - fin
@@ -1,40 +1,214 @@
-import sys
-import random
+import argparse
+import math
+from typing import Iterator, Optional
 import numpy as np
 
 # Valores por defecto
 NUM_COMMANDS = 2000
 MAX_CLAVES = 50
 MAX_SIZE_VALOR = 10
-READ_PROB = 0.01
+# Proporción de lecturas (el resto son escrituras)
+READ_PROB = 0.99
+# Comandos que se generan de una vez con NumPy
+TAMANO_LOTE = 1 << 20
+
+DISTRIBUCIONES_CLAVES = ("uniforme", "zipf", "caliente", "secuencial", "reciente")
+DISTRIBUCIONES_VALORES = ("fijo", "uniforme", "normal", "zipf")
+# Caracteres de los valores: nunca saltos de línea, que romperían el formato
+ALFABETO = np.frombuffer(b"abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789", dtype=np.uint8)
+
+
+class GeneradorComandos:
+    """
+    Genera archivos de comandos (`l <clave>` y `e <clave> <valor>`) por lotes:
+    cada lote se construye entero con operaciones de NumPy, directamente como
+    los bytes del archivo, sin crear una cadena por comando. Con la misma
+    "semilla" se genera siempre el mismo archivo.
+
+    Distribuciones de las claves (entre 0 y max_claves - 1):
+    - "uniforme": todas igual de probables.
+    - "zipf": la clave de rango r con probabilidad proporcional a 1 / r^theta; las
+      claves más frecuentes se reparten por todo el espacio de claves.
+    - "caliente": una "fraccion_caliente" de las claves recibe "prob_caliente"
+      de los accesos.
+    - "secuencial": claves consecutivas, volviendo a 0 al llegar al final.
+    - "reciente": cada escritura usa la clave siguiente a la anterior y las
+      lecturas prefieren (según zipf) las últimas escritas. Al llegar a
+      max_claves se vuelve a 0, así que se reescriben las más antiguas.
+
+    Distribuciones del tamaño de los valores (entre 1 y max_tamano_valor bytes):
+    "fijo", "uniforme", "normal" (centrada en la mitad) y "zipf" (casi todos
+    pequeños y unos pocos grandes).
+    """
+
+    def __init__(self, max_claves: int = MAX_CLAVES, max_tamano_valor: int = MAX_SIZE_VALOR,
+                 prob_lectura: float = READ_PROB, claves: str = "uniforme", valores: str = "uniforme",
+                 theta: float = 0.99, fraccion_caliente: float = 0.2, prob_caliente: float = 0.8,
+                 semilla: Optional[int] = None):
+        if claves not in DISTRIBUCIONES_CLAVES:
+            raise ValueError(f"Distribución de claves desconocida: {claves}")
+        if valores not in DISTRIBUCIONES_VALORES:
+            raise ValueError(f"Distribución de valores desconocida: {valores}")
+        self.max_claves = max_claves
+        self.max_tamano_valor = max_tamano_valor
+        self.prob_lectura = prob_lectura
+        self.claves = claves
+        self.valores = valores
+        self.fraccion_caliente = fraccion_caliente
+        self.prob_caliente = prob_caliente
+        self.rng = np.random.default_rng(semilla)
+        # Siguiente clave de "secuencial" y número de escrituras (menos una) de "reciente"
+        self.siguiente_secuencial = 0
+        self.ultima_escrita = -1
+
+        if claves in ("zipf", "reciente"):
+            self.acumulada_claves = self._acumulada_zipf(max_claves, theta)
+            # Multiplicar por un número primo con el número de claves es una
+            # permutación, que reparte las claves frecuentes sin guardar una tabla
+            self.multiplicador = 2654435761
+            while math.gcd(self.multiplicador, max_claves) != 1:
+                self.multiplicador += 2
+        if valores == "zipf":
+            self.acumulada_valores = self._acumulada_zipf(max_tamano_valor, theta)
+
+    @staticmethod
+    def _acumulada_zipf(n: int, theta: float) -> np.ndarray:
+        acumulada = np.cumsum(1.0 / np.arange(1, n + 1, dtype=np.float64) ** theta)
+        return acumulada / acumulada[-1]
+
+    def _rangos_zipf(self, acumulada: np.ndarray, n: int) -> np.ndarray:
+        # Rangos 0..len-1, el 0 el más probable
+        return np.searchsorted(acumulada, self.rng.random(n), side="right").clip(max=len(acumulada) - 1)
+
+    def _claves(self, escrituras: np.ndarray) -> np.ndarray:
+        n = len(escrituras)
+        if self.claves == "uniforme":
+            return self.rng.integers(0, self.max_claves, n, dtype=np.int64)
+        if self.claves == "zipf":
+            rangos = self._rangos_zipf(self.acumulada_claves, n).astype(np.int64)
+            return rangos * (self.multiplicador % self.max_claves) % self.max_claves
+        if self.claves == "caliente":
+            calientes = min(max(1, int(self.max_claves * self.fraccion_caliente)), self.max_claves)
+            if calientes == self.max_claves:
+                # No quedan claves frías: todas son calientes e igual de probables
+                return self.rng.integers(0, self.max_claves, n, dtype=np.int64)
+            en_caliente = self.rng.random(n) < self.prob_caliente
+            claves = self.rng.integers(calientes, self.max_claves, n, dtype=np.int64)
+            claves[en_caliente] = self.rng.integers(0, calientes, int(en_caliente.sum()), dtype=np.int64)
+            return claves
+        if self.claves == "secuencial":
+            claves = (self.siguiente_secuencial + np.arange(n, dtype=np.int64)) % self.max_claves
+            self.siguiente_secuencial = int(claves[-1] + 1) % self.max_claves if n else self.siguiente_secuencial
+            return claves
+        # "reciente": cuántas escrituras se han hecho (menos una) en cada posición
+        # del lote; la escritura número i usa la clave i % max_claves
+        ultimas = self.ultima_escrita + np.cumsum(escrituras, dtype=np.int64)
+        self.ultima_escrita = int(ultimas[-1]) if n else self.ultima_escrita
+        rangos = self._rangos_zipf(self.acumulada_claves, n).astype(np.int64)
+        return np.where(escrituras, ultimas, np.maximum(ultimas - rangos, 0)) % self.max_claves
+
+    def _tamanos(self, n: int) -> np.ndarray:
+        maximo = self.max_tamano_valor
+        if self.valores == "fijo":
+            return np.full(n, maximo, dtype=np.int64)
+        if self.valores == "uniforme":
+            return self.rng.integers(1, maximo + 1, n, dtype=np.int64)
+        if self.valores == "normal":
+            tamanos = self.rng.normal(maximo / 2, maximo / 6, n).round()
+            return tamanos.clip(1, maximo).astype(np.int64)
+        return self._rangos_zipf(self.acumulada_valores, n).astype(np.int64) + 1
+
+    def lote(self, n: int) -> bytes:
+        """
+        Devuelve los bytes de "n" comandos, uno por línea
+        """
+        escrituras = self.rng.random(n) >= self.prob_lectura
+        claves = self._claves(escrituras)
+        tamanos = np.where(escrituras, self._tamanos(n), 0)
+
+        # Dígitos de cada clave (el 0 tiene uno)
+        digitos = np.ones(n, dtype=np.int64)
+        potencia = 10
+        while True:
+            mayores = claves >= potencia
+            if not mayores.any():
+                break
+            digitos += mayores
+            potencia *= 10
+        max_digitos = int(digitos.max()) if n else 1
+
+        # "<op> <clave>" + " <valor>" en las escrituras + "\n"
+        longitudes = 2 + digitos + np.where(escrituras, 1 + tamanos, 0) + 1
+        finales = np.cumsum(longitudes)
+        inicios = finales - longitudes
+        datos = np.empty(int(finales[-1]) if n else 0, dtype=np.uint8)
+
+        datos[inicios] = np.where(escrituras, ord("e"), ord("l"))
+        datos[inicios + 1] = ord(" ")
+        datos[finales - 1] = ord("\n")
+
+        # Cada columna j es el dígito j de la clave empezando por el más significativo,
+        # con max_digitos columnas; de cada clave se escriben solo las últimas "digitos"
+        columnas = np.arange(max_digitos)
+        divisores = 10 ** (max_digitos - 1 - columnas)
+        matriz = (claves[:, None] // divisores[None, :]) % 10 + ord("0")
+        validas = columnas[None, :] >= (max_digitos - digitos)[:, None]
+        posiciones = inicios[:, None] + 2 + columnas[None, :] - (max_digitos - digitos)[:, None]
+        datos[posiciones[validas]] = matriz[validas]
+
+        # Los valores: un espacio tras la clave y "tamano" caracteres del alfabeto
+        inicios_valor = inicios + 3 + digitos
+        datos[(inicios_valor - 1)[escrituras]] = ord(" ")
+        total_valores = int(tamanos.sum())
+        if total_valores:
+            desplazamientos = np.arange(total_valores) - np.repeat(np.cumsum(tamanos) - tamanos, tamanos)
+            datos[np.repeat(inicios_valor, tamanos) + desplazamientos] = \
+                ALFABETO[self.rng.integers(0, len(ALFABETO), total_valores)]
+        return datos.tobytes()
+
+    def escribir_archivo(self, ruta: str, num_comandos: int, tamano_lote: int = TAMANO_LOTE) -> None:
+        """
+        Escribe "num_comandos" comandos en "ruta" lote a lote, así que la memoria
+        usada depende del tamaño del lote y no del número de comandos
+        """
+        with open(ruta, 'wb') as f:
+            for inicio in range(0, num_comandos, tamano_lote):
+                f.write(self.lote(min(tamano_lote, num_comandos - inicio)))
 
 
 def comandos_aleatorios(num_commands: int = NUM_COMMANDS, max_claves: int = MAX_CLAVES,
-                        max_size_valor: int = MAX_SIZE_VALOR, read_prob: float = READ_PROB):
+                        max_size_valor: int = MAX_SIZE_VALOR, read_prob: float = READ_PROB,
+                        semilla: Optional[int] = None) -> Iterator[str]:
     """
     Generador que produce datos aleatorios en función de nuestro formato de ejecución de comandos
     """
-    for i in range(num_commands):
-        c = np.random.choice(["l", "e"], p=[1-read_prob, read_prob])
-        clave = random.randint(0, max_claves)
-        if c == "e":
-            random_data = random.randbytes(random.randint(1, max_size_valor))
-            yield f"{c} {clave} {random_data}"
-        else:
-            yield f"{c} {clave}"
+    generador = GeneradorComandos(max_claves, max_size_valor, read_prob, semilla=semilla)
+    for inicio in range(0, num_commands, TAMANO_LOTE):
+        yield from generador.lote(min(TAMANO_LOTE, num_commands - inicio)).decode().splitlines()
 
 
-def escribir_comandos_aleatorios_archivo(filename: str) -> None:
-    with open(filename, 'w') as f:
-        for random_command in comandos_aleatorios():
-            # Es mejor escribirlos uno a uno para así
-            # evitar cargar todos los comandos directamente en memoria
-            f.write(random_command + '\n')
+def escribir_comandos_aleatorios_archivo(filename: str, num_commands: int = NUM_COMMANDS,
+                                         semilla: Optional[int] = None, **opciones) -> None:
+    GeneradorComandos(semilla=semilla, **opciones).escribir_archivo(filename, num_commands)
 
 
 if __name__ == "__main__":
     # Este script nos permite generar archivos
     # para probar las distintas implementaciones
-    # sys.argv[1] devuelve el primer string leído por
-    # consola, sys.argv[2] el segundo y así sucesivamente
-    escribir_comandos_aleatorios_archivo(sys.argv[1])
+    parser = argparse.ArgumentParser(description="Genera un archivo de comandos aleatorios")
+    parser.add_argument("archivo")
+    parser.add_argument("--comandos", type=int, default=NUM_COMMANDS)
+    parser.add_argument("--claves", type=int, default=MAX_CLAVES, help="número de claves distintas")
+    parser.add_argument("--tamano-valor", type=int, default=MAX_SIZE_VALOR, help="tamaño máximo de los valores")
+    parser.add_argument("--prob-lectura", type=float, default=READ_PROB)
+    parser.add_argument("--distribucion", choices=DISTRIBUCIONES_CLAVES, default="uniforme",
+                        help="distribución de las claves")
+    parser.add_argument("--valores", choices=DISTRIBUCIONES_VALORES, default="uniforme",
+                        help="distribución del tamaño de los valores")
+    parser.add_argument("--theta", type=float, default=0.99)
+    parser.add_argument("--semilla", type=int, default=None)
+    args = parser.parse_args()
+    escribir_comandos_aleatorios_archivo(args.archivo, args.comandos, args.semilla,
+                                         max_claves=args.claves, max_tamano_valor=args.tamano_valor,
+                                         prob_lectura=args.prob_lectura, claves=args.distribucion,
+                                         valores=args.valores, theta=args.theta)
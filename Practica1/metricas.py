@@ -0,0 +1,189 @@
+import random
+import threading
+from typing import Dict, List, Optional, Tuple
+
+# Subcubetas por cada potencia de 2: con 3 bits el error relativo es como mucho 1/8
+BITS_SUBCUBETA = 3
+SUBCUBETAS = 1 << BITS_SUBCUBETA
+# Suficientes cubetas para cualquier duración que quepa en 64 bits de nanosegundos
+NUM_CUBETAS = (64 - BITS_SUBCUBETA) * SUBCUBETAS + 2 * SUBCUBETAS
+
+
+def cubeta(ns: int) -> int:
+    """
+    Cubeta de la duración "ns": las duraciones menores que 2 * SUBCUBETAS tienen
+    una cubeta cada una y a partir de ahí cada potencia de 2 se divide en
+    SUBCUBETAS cubetas del mismo ancho
+    """
+    if ns < 2 * SUBCUBETAS:
+        return max(ns, 0)
+    desplazamiento = ns.bit_length() - BITS_SUBCUBETA - 1
+    return desplazamiento * SUBCUBETAS + (ns >> desplazamiento)
+
+
+class Histograma:
+    """
+    Histograma de duraciones en nanosegundos con cubetas logarítmicas de tamaño
+    fijo: ocupa lo mismo tras mil operaciones que tras mil millones. Además de
+    cuántas duraciones caen en cada cubeta guarda su suma, así que los totales
+    y las medias son exactos y solo los percentiles son aproximados.
+    """
+
+    def __init__(self):
+        self.cuentas = [0] * NUM_CUBETAS
+        self.sumas = [0] * NUM_CUBETAS
+        self.total = 0
+        self.suma_ns = 0
+        self.maximo_ns = 0
+
+    def registrar(self, ns: int, veces: int = 1) -> None:
+        """
+        Registra "veces" operaciones que han tardado en total "ns" nanosegundos
+        (cada una la parte proporcional)
+        """
+        cada_una = ns if veces == 1 else ns // veces
+        # Lo mismo que cubeta(cada_una), sin la llamada: se ejecuta en cada operación
+        if cada_una < 2 * SUBCUBETAS:
+            indice = cada_una if cada_una > 0 else 0
+        else:
+            desplazamiento = cada_una.bit_length() - BITS_SUBCUBETA - 1
+            indice = desplazamiento * SUBCUBETAS + (cada_una >> desplazamiento)
+        self.cuentas[indice] += veces
+        self.sumas[indice] += ns
+        self.total += veces
+        self.suma_ns += ns
+        if cada_una > self.maximo_ns:
+            self.maximo_ns = cada_una
+
+    def percentil(self, p: float) -> int:
+        """
+        Duración aproximada (en ns) por debajo de la cual queda el "p" % de las operaciones
+        """
+        if self.total == 0:
+            return 0
+        objetivo = max(1, round(p / 100 * self.total))
+        acumulado = 0
+        for indice, cuenta in enumerate(self.cuentas):
+            acumulado += cuenta
+            if acumulado >= objetivo:
+                # La media de la cubeta es mejor estimación que cualquiera de sus límites
+                return min(self.sumas[indice] // cuenta, self.maximo_ns)
+        return self.maximo_ns
+
+    def sumar(self, otro: "Histograma") -> None:
+        for indice, cuenta in enumerate(otro.cuentas):
+            if cuenta:
+                self.cuentas[indice] += cuenta
+                self.sumas[indice] += otro.sumas[indice]
+        self.total += otro.total
+        self.suma_ns += otro.suma_ns
+        self.maximo_ns = max(self.maximo_ns, otro.maximo_ns)
+
+    def media(self) -> float:
+        return self.suma_ns / self.total if self.total else 0.0
+
+
+class Metricas:
+    """
+    Tiempos de las operaciones de una tabla, medidos con time.perf_counter_ns,
+    en un Histograma por tipo de operación ("l" o "e", que incluye los borrados).
+
+    Opcionalmente se guarda una traza de "tamano_traza" operaciones (tipo,
+    segundos) elegidas al azar con muestreo de reservorio, de forma que
+    también tiene tamaño fijo. Para activarla basta con sustituir las métricas
+    de la tabla: `tabla.metricas = Metricas(tamano_traza=10000)`.
+
+    Se puede usar desde varios hilos: cada hilo registra en sus propios
+    histogramas, sin cerrojos, y se suman al consultarlos.
+    """
+
+    def __init__(self, tamano_traza: int = 0):
+        self.tamano_traza = tamano_traza
+        self.locales = threading.local()
+        # Histogramas de todos los hilos que han registrado algo
+        self.por_hilo: List[Dict[str, Histograma]] = []
+        self.muestras: List[Tuple[str, float]] = []
+        self.vistas = 0
+        self.cerrojo = threading.Lock()
+
+    def _histogramas_hilo(self) -> Dict[str, Histograma]:
+        histogramas = {"l": Histograma(), "e": Histograma()}
+        self.locales.histogramas = histogramas
+        with self.cerrojo:
+            self.por_hilo.append(histogramas)
+        return histogramas
+
+    def registrar(self, operacion: str, ns: int, veces: int = 1) -> None:
+        """
+        Registra "veces" operaciones del tipo "operacion" que han tardado en
+        total "ns" nanosegundos (por ejemplo una lectura por lotes)
+        """
+        if veces <= 0:
+            return
+        try:
+            histogramas = self.locales.histogramas
+        except AttributeError:
+            histogramas = self._histogramas_hilo()
+        histograma = histogramas.get(operacion)
+        if histograma is None:
+            histograma = histogramas[operacion] = Histograma()
+        histograma.registrar(ns, veces)
+        if self.tamano_traza:
+            with self.cerrojo:
+                self._muestrear(operacion, ns / veces / 1e9, veces)
+
+    def _muestrear(self, operacion: str, segundos: float, veces: int) -> None:
+        for _ in range(veces):
+            self.vistas += 1
+            if len(self.muestras) < self.tamano_traza:
+                self.muestras.append((operacion, segundos))
+            else:
+                posicion = random.randrange(self.vistas)
+                if posicion < self.tamano_traza:
+                    self.muestras[posicion] = (operacion, segundos)
+
+    def traza(self) -> List[Tuple[str, float]]:
+        """
+        Muestra de operaciones (tipo, segundos) guardada, vacía si "tamano_traza" es 0
+        """
+        with self.cerrojo:
+            return list(self.muestras)
+
+    def histogramas(self) -> Dict[str, Histograma]:
+        """
+        Histograma de cada tipo de operación con las operaciones de todos los hilos
+        """
+        with self.cerrojo:
+            por_hilo = list(self.por_hilo)
+        total: Dict[str, Histograma] = {}
+        for histogramas in por_hilo:
+            for operacion, histograma in list(histogramas.items()):
+                total.setdefault(operacion, Histograma()).sumar(histograma)
+        return total
+
+    def resumen(self) -> Dict[str, Dict[str, float]]:
+        """
+        Para cada tipo de operación, el número de operaciones, el tiempo total
+        y la media en segundos y los percentiles 50, 95 y 99 y el máximo en microsegundos
+        """
+        return {operacion: {"operaciones": h.total, "total_s": h.suma_ns / 1e9, "media_s": h.media() / 1e9,
+                            "p50_us": h.percentil(50) / 1e3, "p95_us": h.percentil(95) / 1e3,
+                            "p99_us": h.percentil(99) / 1e3, "max_us": h.maximo_ns / 1e3}
+                for operacion, h in self.histogramas().items() if h.total}
+
+    def tiempos(self, operacion: Optional[str] = None) -> List[Tuple[str, float]]:
+        """
+        Vista compatible con el antiguo "tiempos()": una tupla (tipo, segundos)
+        por operación. Las operaciones de una misma cubeta aparecen con su
+        tiempo medio, así que las sumas por tipo son exactas, pero no se
+        conserva el orden en que se hicieron. Si se indica "operacion" solo
+        se devuelven las de ese tipo.
+        """
+        resultado = []
+        for tipo, histograma in self.histogramas().items():
+            if operacion is not None and tipo != operacion:
+                continue
+            for cuenta, suma in zip(histograma.cuentas, histograma.sumas):
+                if cuenta:
+                    resultado.extend([(tipo, suma / cuenta / 1e9)] * cuenta)
+        return resultado
@@ -0,0 +1,22 @@
+import heapq
+from typing import Iterator, List, Optional, Tuple
+
+
+def mezclar(fuentes: List[Iterator[Tuple[int, Optional[str]]]]) -> Iterator[Tuple[int, Optional[str]]]:
+    """
+    Mezcla k fuentes de pares (clave, valor) ordenadas por clave y sin claves
+    repetidas, dadas de la más nueva a la más antigua. Devuelve los pares en
+    orden de clave quedándose, si una clave aparece en varias fuentes, con el
+    valor de la más nueva (que puede ser None si la clave está borrada en ella).
+    Solo mantiene en memoria un par por fuente.
+    """
+    def etiquetar(fuente: Iterator[Tuple[int, Optional[str]]], antiguedad: int) -> Iterator[Tuple[int, int, Optional[str]]]:
+        for clave, valor in fuente:
+            yield clave, antiguedad, valor
+
+    etiquetadas = [etiquetar(fuente, antiguedad) for antiguedad, fuente in enumerate(fuentes)]
+    ultima = None
+    for clave, _, valor in heapq.merge(*etiquetadas):
+        if clave != ultima:
+            ultima = clave
+            yield clave, valor
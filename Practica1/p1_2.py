@@ -1,84 +1,143 @@
 import os
 import time
-from typing import Optional, List, Tuple
+from typing import Optional, List, Tuple, Iterator
 from tabla_base import TablaBase
+from metricas import Metricas
+from salida import SalidaResultados
+from formato_registro import BORRADO, obtener_formato, recuperar_archivo
+from cache_descriptores import CacheDescriptores, CACHE_DESCRIPTORES
+from durabilidad import EscritorLog, PoliticaDurabilidad
 
 
 class Tabla1_2(TablaBase):
 
-    def __init__(self, nombre_tabla: str):
+    def __init__(self, nombre_tabla: str, formato: str = "texto",
+                 descriptores: Optional[CacheDescriptores] = None,
+                 durabilidad: Optional[PoliticaDurabilidad] = None):
         self.nombre_tabla = nombre_tabla
-        self.tiempos1_2: List[Tuple[str, float]] = []
+        self.formato = obtener_formato(formato)
+        self.descriptores = descriptores if descriptores is not None else CACHE_DESCRIPTORES
+        self.metricas = Metricas()
 
         # Verificamos si el archivo existe; si no, se crea vacío
         if not os.path.exists(self.nombre_tabla):
             with open(self.nombre_tabla, 'w') as f:
                 pass  # Crea el archivo vacío
 
+        # Esta tabla no tiene punto de control, así que se comprueba el archivo
+        # entero (lo mismo que recorre cualquier lectura) y se trunca el último
+        # registro si quedó a medias
+        self.registros_recuperados, self.bytes_truncados = recuperar_archivo(self.nombre_tabla, self.formato)
+        self.escritor = EscritorLog(nombre_tabla, durabilidad, self.descriptores)
 
     def leer(self, clave: int) -> Optional[str]:
-        inicio = time.time()
-        with open(self.nombre_tabla, 'r') as f:
-            registros = f.readlines()
-            valor = None
-
-            # Iteramos sobre los registros desde el final para encontrar el último con la clave
-            if len(registros) > 0:
-                i = len(registros) - 1
-                comas = registros[i].strip().split(',')
-                while i >= 0 and comas[0] != clave:
-                    i -= 1
-                    comas = registros[i].strip().split(',')
-
-                if i >= 0:
-                    valor = comas[1]
-                    if len(comas) > 2:
-                        for val in comas[2:]:
-                            valor = valor + ',' + val
-
-
-            #for registro in reversed(registros):
-             #   comas = registro.strip().split(',')
-              #  clave_actual = comas[0]
-               # if int(clave_actual) == clave:
-                #    valor = comas[1]
-                 #   if len(comas) > 2:
-                  #      for val in comas[2:]:
-                   #         valor = valor + ',' + val
-
-                        
-        fin = time.time()
-        self.tiempos1_2.append(("l", fin - inicio))
+        inicio = time.perf_counter_ns()
+        clave = int(clave)
+        valor = None
+
+        # Recorremos los registros quedándonos con la posición del último con
+        # la clave; si el último es una lápida la clave está borrada
+        posicion = None
+        limite = self.escritor.asegurar_legible()
+        # Cada recorrido abre su propio archivo (el descriptor compartido tiene
+        # una sola posición y otro hilo podría estar recorriéndolo a la vez) y
+        # se detiene en lo ya escrito por completo al empezar
+        with open(self.nombre_tabla, 'rb') as f:
+            for clave_actual, offset, longitud, flags in self.formato.iterar(f, hasta=limite):
+                if clave_actual == clave:
+                    posicion = None if flags & BORRADO else (offset, longitud)
+
+            if posicion is not None:
+                valor = self.formato.leer_valor(f.fileno(), *posicion)
+
+        self.metricas.registrar("l", time.perf_counter_ns() - inicio)
         return valor
 
     def escribir(self, clave: int, valor: str) -> bool:
-        inicio = time.time()
-        with open(self.nombre_tabla, 'a') as f:
-            f.write(f"{clave},{valor}\n")
-        fin = time.time()
-        self.tiempos1_2.append(("e", fin - inicio))
+        inicio = time.perf_counter_ns()
+        registro, _, _ = self.formato.codificar(int(clave), valor)
+        self.escritor.anyadir(registro)
+        self.metricas.registrar("e", time.perf_counter_ns() - inicio)
         return True
 
-    def procesar_operaciones(self, archivo: str) -> None:
+    def borrar(self, clave: int) -> bool:
+        inicio = time.perf_counter_ns()
+        self.escritor.anyadir(self.formato.codificar_borrado(int(clave)))
+        self.metricas.registrar("e", time.perf_counter_ns() - inicio)
+        return True
 
+    def leer_muchos(self, claves: List[int]) -> List[Optional[str]]:
+        if not claves:
+            return []
+        inicio = time.perf_counter_ns()
+        claves = [int(clave) for clave in claves]
+        buscadas = set(claves)
+        valores = {}
+
+        # Una sola pasada por el archivo para todas las claves y después
+        # se leen los valores en orden de offset
+        posiciones = {}
+        limite = self.escritor.asegurar_legible()
+        with open(self.nombre_tabla, 'rb') as f:
+            for clave_actual, offset, longitud, flags in self.formato.iterar(f, hasta=limite):
+                if clave_actual in buscadas:
+                    if flags & BORRADO:
+                        posiciones.pop(clave_actual, None)
+                    else:
+                        posiciones[clave_actual] = (offset, longitud)
+            for clave, posicion in sorted(posiciones.items(), key=lambda par: par[1]):
+                valores[clave] = self.formato.leer_valor(f.fileno(), *posicion)
+
+        self.metricas.registrar("l", time.perf_counter_ns() - inicio, len(claves))
+        return [valores.get(clave) for clave in claves]
+
+    def escribir_muchos(self, pares: List[Tuple[int, str]]) -> bool:
+        if not pares:
+            return True
+        inicio = time.perf_counter_ns()
+        # Todos los registros se añaden al archivo de una vez
+        self.escritor.anyadir(b"".join(self.formato.codificar(int(clave), valor)[0] for clave, valor in pares))
+        self.metricas.registrar("e", time.perf_counter_ns() - inicio, len(pares))
+        return True
+
+    def rango(self, desde: Optional[int] = None, hasta: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+        # Sin índice no queda otra que recorrer el archivo entero, pero solo se
+        # guarda la posición de las claves del rango y se leen al final en orden
+        posiciones = {}
+        limite = self.escritor.asegurar_legible()
+        with open(self.nombre_tabla, 'rb') as f:
+            for clave, offset, longitud, flags in self.formato.iterar(f, hasta=limite):
+                if (desde is None or clave >= desde) and (hasta is None or clave <= hasta):
+                    if flags & BORRADO:
+                        posiciones.pop(clave, None)
+                    else:
+                        posiciones[clave] = (offset, longitud)
+            for clave in sorted(posiciones):
+                yield clave, self.formato.leer_valor(f.fileno(), *posiciones[clave])
+
+    def cerrar(self) -> None:
+        self.escritor.cerrar()
+
+    def procesar_operaciones(self, archivo: str, salida: Optional[SalidaResultados] = None) -> None:
+        if salida is None:
+            salida = SalidaResultados()
         with open(archivo, 'r') as f:
             for linea in f:
                 partes = linea.strip().split(" ", 2)
                 if partes[0] == "l":
-                    clave = partes[1]
-                    valor = self.leer(clave)
-                    if valor is not None:
-                        print(valor)
-                    else:
-                        print(f"Valor de {clave} no encontrado")
+                    clave = int(partes[1])
+                    salida.escribir(clave, self.leer(clave))
                 elif partes[0] == "e":
-                    clave, valor = partes[1], partes[2]
+                    clave, valor = int(partes[1]), partes[2]
                     self.escribir(clave, valor)
-       
+                elif partes[0] == "b":
+                    self.borrar(int(partes[1]))
+        salida.vaciar()
+
     def tiempos(self) -> List[Tuple[str, float]]:
-        return self.tiempos1_2
+        return self.metricas.tiempos()
 
 
 if __name__ == "__main__":
     tabla1_2 = Tabla1_2("tabla1_2.txt")
-    tabla1_2.procesar_operaciones("archivo.txt")
\ No newline at end of file
+    tabla1_2.procesar_operaciones("archivo.txt")
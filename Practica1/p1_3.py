@@ -1,75 +1,304 @@
-import os.path
+import bisect
+import json
+import os
+import threading
 import time
-from typing import Optional, List, Tuple
+from typing import Optional, List, Tuple, Dict, Iterator
 from tabla_base import TablaBase
+from metricas import Metricas
+from salida import SalidaResultados
+from formato_registro import BORRADO, obtener_formato, recuperar_archivo
+from archivo_mapeado import ArchivoMapeado
+from cache_descriptores import CacheDescriptores, CACHE_DESCRIPTORES
+from durabilidad import EscritorLog, PoliticaDurabilidad, archivo_atomico
+from cerrojo_rw import crear_cerrojo
 
 
 class Tabla1_3(TablaBase):
+    # Número mínimo de escrituras entre dos puntos de control del índice
+    INTERVALO_PUNTO_CONTROL = 1000
+    # Además, entre dos puntos de control se escribe al menos una cuarta parte
+    # del número de claves: la copia del índice que hace cada uno cuesta lo
+    # que su tamaño, y así se reparte entre las escrituras
+    FRACCION_PUNTO_CONTROL = 4
 
-    def __init__(self, nombre_tabla: str):
+    def __init__(self, nombre_tabla: str, formato: str = "texto", modo_lectura: str = "pread",
+                 descriptores: Optional[CacheDescriptores] = None,
+                 durabilidad: Optional[PoliticaDurabilidad] = None, concurrente: bool = False):
+        """
+        - "modo_lectura": "pread" abre el archivo y lee el valor en cada lectura;
+          "mmap" mapea el archivo una vez y saca los valores de la memoria mapeada.
+        - "durabilidad": cuándo se fuerzan a disco las escrituras (ver PoliticaDurabilidad).
+        - "concurrente": si es True la tabla se puede usar desde varios hilos. Las
+          lecturas del índice se hacen en paralelo y las modificaciones de una en una;
+          ningún cerrojo del índice se mantiene mientras se lee o escribe el archivo.
+        """
+        if modo_lectura not in ("pread", "mmap"):
+            raise ValueError(f"Modo de lectura desconocido: {modo_lectura}")
         self.nombre_tabla = nombre_tabla
-        self.tiempos1_3: List[Tuple[str, float]] = []
-        self.diccionario = {}
+        self.nombre_indice = f"{nombre_tabla}.idx"
+        self.formato = obtener_formato(formato)
+        self.mapa = ArchivoMapeado(nombre_tabla) if modo_lectura == "mmap" else None
+        self.descriptores = descriptores if descriptores is not None else CACHE_DESCRIPTORES
+        self.metricas = Metricas()
+        # clave -> (offset del valor, longitud del valor)
+        self.diccionario: Dict[int, Tuple[int, int]] = {}
+        # Claves del índice ordenadas, para los recorridos por rango. Se crea
+        # con el primer recorrido, así que las tablas que no los usan no la pagan
+        self.claves_ordenadas: Optional[List[int]] = None
+        self.escrituras_pendientes = 0
+        # Final del último registro del log que ya está en el índice
+        self.longitud_indexada = 0
+        # Protege el índice; con "concurrente" a False no sincroniza nada
+        self.cerrojo = crear_cerrojo(concurrente)
+        self.cerrojo_punto_control = threading.Lock()
+        self.hilo_punto_control: Optional[threading.Thread] = None
+        # Resultado de comprobar la cola del log al abrir la tabla
+        self.registros_recuperados = 0
+        self.bytes_truncados = 0
 
         if os.path.exists(self.nombre_tabla):
-            with open(self.nombre_tabla, 'r') as f:
-                registros = f.readlines()
-                offset = f.tell()
-                for registro in registros:
-                    comas = registro.strip().split(',')
-                    clave = comas[0]
-                    self.diccionario[clave] = offset
-                    valor = comas[1]
-                    if len(comas) > 2:
-                        for val in comas[2:]:
-                            valor = valor + ',' + val
-                    offset = f.tell() + len(valor)
+            # Cargamos el último punto de control del índice y solo volvemos a
+            # leer la cola del log escrita después de él, truncando el último
+            # registro si quedó a medias
+            longitud = self._cargar_indice()
+            self.registros_recuperados, self.bytes_truncados = \
+                recuperar_archivo(self.nombre_tabla, self.formato, longitud)
+            self.escritor = EscritorLog(nombre_tabla, durabilidad, self.descriptores)
+            registros = self._reproducir_log(longitud)
+            self.longitud_indexada = os.path.getsize(self.nombre_tabla)
+            if registros > 0:
+                self.guardar_indice()
         else:
             with open(self.nombre_tabla, 'w') as f:
                 pass  # Crea el archivo vacío
+            self.escritor = EscritorLog(nombre_tabla, durabilidad, self.descriptores)
 
+    def _cargar_indice(self) -> int:
+        """
+        Carga el índice guardado junto a la tabla y devuelve la longitud
+        del log que cubre. Si no hay índice o no es válido devuelve 0,
+        de forma que se reconstruye leyendo el log entero.
+        """
+        if not os.path.exists(self.nombre_indice):
+            return 0
+        try:
+            with open(self.nombre_indice, 'r') as f:
+                datos = json.load(f)
+            if datos["formato"] != self.formato.nombre:
+                return 0
+            longitud = datos["longitud"]
+            indice = {int(clave): tuple(posicion) for clave, posicion in datos["indice"].items()}
+        except (ValueError, KeyError, TypeError):
+            return 0
+
+        # Si el log es más corto que lo que cubre el índice, la tabla se
+        # ha truncado o reemplazado y el índice ya no sirve
+        if longitud > os.path.getsize(self.nombre_tabla):
+            return 0
+        self.diccionario = indice
+        return longitud
+
+    def _reproducir_log(self, desde: int) -> int:
+        """
+        Añade al índice los registros del log a partir del byte "desde"
+        (las lápidas quitan la clave). Devuelve el número de registros leídos.
+        """
+        registros = 0
+        with open(self.nombre_tabla, 'rb') as f:
+            for clave, offset, longitud, flags in self.formato.iterar(f, desde):
+                if flags & BORRADO:
+                    self.diccionario.pop(clave, None)
+                else:
+                    self.diccionario[clave] = (offset, longitud)
+                registros += 1
+        return registros
+
+    def _copiar_indice(self) -> Tuple[Dict[int, Tuple[int, int]], int]:
+        # La copia del índice y la longitud que cubre se toman a la vez, y esa
+        # parte del log se pasa al archivo antes de que el índice la dé por buena
+        with self.cerrojo.lectura():
+            indice = dict(self.diccionario)
+            longitud = self.longitud_indexada
+            self.escrituras_pendientes = 0
+        self.escritor.asegurar_legible()
+        return indice, longitud
+
+    def _escribir_indice(self, indice: Dict[int, Tuple[int, int]], longitud: int) -> None:
+        with self.cerrojo_punto_control:
+            with archivo_atomico(self.nombre_indice) as f:
+                json.dump({"formato": self.formato.nombre, "longitud": longitud, "indice": indice}, f)
+
+    def esperar_punto_control(self) -> None:
+        hilo = self.hilo_punto_control
+        if hilo is not None:
+            hilo.join()
+
+    def guardar_indice(self) -> None:
+        """
+        Guarda un punto de control del índice (clave -> posición) junto con la
+        longitud del log que cubre. Se escribe en un archivo temporal que se
+        fuerza a disco y se renombra, para que un fallo a mitad no deje un
+        índice corrupto o vacío.
+        """
+        self.esperar_punto_control()
+        self._escribir_indice(*self._copiar_indice())
+
+    def _punto_control_en_segundo_plano(self) -> None:
+        """
+        Copia el índice y lo guarda en un hilo aparte: la escritura que lo lanza
+        solo paga la copia, no serializarlo ni esperar al disco. Si ya hay uno
+        en curso no se lanza otro.
+        """
+        if self.hilo_punto_control is not None:
+            return
+        indice, longitud = self._copiar_indice()
+
+        def guardar() -> None:
+            try:
+                self._escribir_indice(indice, longitud)
+            finally:
+                self.hilo_punto_control = None
+
+        self.hilo_punto_control = threading.Thread(target=guardar, name=f"punto-control-{self.nombre_tabla}",
+                                                   daemon=True)
+        self.hilo_punto_control.start()
+
+    def cerrar(self) -> None:
+        self.escritor.cerrar()
+        self.guardar_indice()
+        self.descriptores.cerrar(self.nombre_tabla)
+        if self.mapa is not None:
+            self.mapa.cerrar()
+
+    def _leer_posicion(self, posicion: Tuple[int, int]) -> str:
+        if self.mapa is not None:
+            return self.mapa.leer(*posicion)
+        with self.descriptores.usar(self.nombre_tabla) as fd:
+            return self.formato.leer_valor(fd, *posicion)
+
+    def _anyadir(self, datos: bytes, cambios: List[Tuple[int, Optional[Tuple[int, int]]]]) -> None:
+        """
+        Añade "datos" al log y aplica al índice los "cambios": pares (clave, posición
+        del valor dentro de "datos"), con posición None si es una lápida.
+
+        El índice se actualiza en el momento en que se reserva el sitio en el log,
+        así que queda en el mismo orden que los registros aunque escriban varios
+        hilos, y no se espera a que los datos lleguen a disco con el cerrojo cogido.
+        """
+        def anotar(offset: int) -> None:
+            with self.cerrojo.escritura():
+                for clave, posicion in cambios:
+                    if posicion is None:
+                        # La lápida queda en el log para que el borrado sobreviva a
+                        # reconstruir el índice; el índice simplemente olvida la clave
+                        if self.diccionario.pop(clave, None) is not None and self.claves_ordenadas is not None:
+                            del self.claves_ordenadas[bisect.bisect_left(self.claves_ordenadas, clave)]
+                    else:
+                        if self.claves_ordenadas is not None and clave not in self.diccionario:
+                            bisect.insort(self.claves_ordenadas, clave)
+                        self.diccionario[clave] = (offset + posicion[0], posicion[1])
+                self.escrituras_pendientes += len(cambios)
+                self.longitud_indexada = offset + len(datos)
+
+        self.escritor.anyadir(datos, anotar)
+        if self.escrituras_pendientes >= max(self.INTERVALO_PUNTO_CONTROL,
+                                             len(self.diccionario) // self.FRACCION_PUNTO_CONTROL):
+            self._punto_control_en_segundo_plano()
 
     def leer(self, clave: int) -> Optional[str]:
-        inicio = time.time()
+        inicio = time.perf_counter_ns()
         valor = None
-        with open(self.nombre_tabla, 'r') as f:
-            if clave in self.diccionario:
-                offset = self.diccionario[clave]
-                f.seek(offset)
-                comas = f.readline().split(',')  # lee la línea hasta un salto de línea
-                valor = ','.join(comas[1:])
-        fin = time.time()
-        self.tiempos1_3.append(("l", fin - inicio))
+        clave = int(clave)
+        with self.cerrojo.lectura():
+            posicion = self.diccionario.get(clave)
+        if posicion is not None:
+            self.escritor.asegurar_legible()
+            valor = self._leer_posicion(posicion)
+        self.metricas.registrar("l", time.perf_counter_ns() - inicio)
         return valor
 
     def escribir(self, clave: int, valor: str) -> bool:
-        inicio = time.time()
-        with open(self.nombre_tabla, 'a') as f:
-            self.diccionario[clave] = f.tell()
-            f.write(f"{clave},{valor}\n")
-        fin = time.time()
-        self.tiempos1_3.append(("e", fin - inicio))
+        inicio = time.perf_counter_ns()
+        clave = int(clave)
+        registro, inicio_valor, longitud = self.formato.codificar(clave, valor)
+        self._anyadir(registro, [(clave, (inicio_valor, longitud))])
+        self.metricas.registrar("e", time.perf_counter_ns() - inicio)
+        return True
 
-    def procesar_operaciones(self, archivo: str) -> None:
+    def borrar(self, clave: int) -> bool:
+        inicio = time.perf_counter_ns()
+        clave = int(clave)
+        self._anyadir(self.formato.codificar_borrado(clave), [(clave, None)])
+        self.metricas.registrar("e", time.perf_counter_ns() - inicio)
+        return True
 
+    def leer_muchos(self, claves: List[int]) -> List[Optional[str]]:
+        if not claves:
+            return []
+        inicio = time.perf_counter_ns()
+        claves = [int(clave) for clave in claves]
+        with self.cerrojo.lectura():
+            posiciones = {clave: self.diccionario[clave] for clave in claves if clave in self.diccionario}
+        self.escritor.asegurar_legible()
+        # Leemos los valores en orden de offset para recorrer el archivo una vez
+        valores = {clave: self._leer_posicion(posicion)
+                   for clave, posicion in sorted(posiciones.items(), key=lambda par: par[1])}
+        self.metricas.registrar("l", time.perf_counter_ns() - inicio, len(claves))
+        return [valores.get(clave) for clave in claves]
+
+    def escribir_muchos(self, pares: List[Tuple[int, str]]) -> bool:
+        if not pares:
+            return True
+        inicio = time.perf_counter_ns()
+        # Codificamos todos los registros y los añadimos al log de una vez
+        registros = []
+        cambios = []
+        desplazamiento = 0
+        for clave, valor in pares:
+            registro, inicio_valor, longitud = self.formato.codificar(int(clave), valor)
+            registros.append(registro)
+            cambios.append((int(clave), (desplazamiento + inicio_valor, longitud)))
+            desplazamiento += len(registro)
+        self._anyadir(b"".join(registros), cambios)
+        self.metricas.registrar("e", time.perf_counter_ns() - inicio, len(pares))
+        return True
+
+    def rango(self, desde: Optional[int] = None, hasta: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+        if self.claves_ordenadas is None:
+            with self.cerrojo.escritura():
+                if self.claves_ordenadas is None:
+                    self.claves_ordenadas = sorted(self.diccionario)
+        # Solo se leen los valores de las claves del rango
+        with self.cerrojo.lectura():
+            inicio = 0 if desde is None else bisect.bisect_left(self.claves_ordenadas, desde)
+            fin = len(self.claves_ordenadas) if hasta is None else bisect.bisect_right(self.claves_ordenadas, hasta)
+            posiciones = [(clave, self.diccionario[clave]) for clave in self.claves_ordenadas[inicio:fin]]
+        self.escritor.asegurar_legible()
+        for clave, posicion in posiciones:
+            yield clave, self._leer_posicion(posicion)
+
+    def procesar_operaciones(self, archivo: str, salida: Optional[SalidaResultados] = None) -> None:
+        if salida is None:
+            salida = SalidaResultados()
         with open(archivo, 'r') as f:
             for linea in f:
                 partes = linea.strip().split(" ", 2)
                 if partes[0] == "l":
-                    clave = partes[1]
-                    valor = self.leer(clave)
-                    if valor is not None:
-                        print(valor)
-                    else:
-                        print(f"Valor de {clave} no encontrado")
+                    clave = int(partes[1])
+                    salida.escribir(clave, self.leer(clave))
                 elif partes[0] == "e":
-                    clave, valor = partes[1], partes[2]
+                    clave, valor = int(partes[1]), partes[2]
                     self.escribir(clave, valor)
-       
+                elif partes[0] == "b":
+                    self.borrar(int(partes[1]))
+        salida.vaciar()
+        self.guardar_indice()
+
     def tiempos(self) -> List[Tuple[str, float]]:
-        return self.tiempos1_3
+        return self.metricas.tiempos()
 
 
 if __name__ == "__main__":
     tabla1_3 = Tabla1_3("tabla1_3.txt")
-    tabla1_3.procesar_operaciones("archivo.txt")
\ No newline at end of file
+    tabla1_3.procesar_operaciones("archivo.txt")
@@ -1,146 +1,780 @@
+import bisect
+import json
 import os.path
+import threading
 import time
 from abc import ABC
-from typing import Optional, List, Tuple
+from itertools import chain, islice
+from typing import Optional, List, Tuple, Dict, Iterable, Iterator
 from tabla_base import TablaBase
+from metricas import Metricas
+from salida import SalidaResultados
+from formato_registro import BORRADO, obtener_formato, recuperar_archivo
+from filtro_bloom import FiltroBloom
+from archivo_mapeado import ArchivoMapeado
+from cache_descriptores import CacheDescriptores, CACHE_DESCRIPTORES
+from bloques_comprimidos import ArchivoBloques, TAMANO_BLOQUE, escribir_bloques, obtener_compresor, ruta_indice
+from durabilidad import EscritorLog, PoliticaDurabilidad, archivo_atomico
+from mezcla import mezclar
+from cerrojo_rw import CerrojoLectoresEscritor, crear_cerrojo
 from pathlib import Path
 
+# Lista ordenada de los segmentos vivos de una tabla, en su carpeta
+ARCHIVO_MANIFIESTO = "manifiesto.json"
+
 
 class Segmento(TablaBase):
     NUM_REGISTROS = 50
 
-    def __init__(self, nombre_tabla: str):
+    def __init__(self, nombre_tabla: str, formato: str = "texto", modo_lectura: str = "pread",
+                 descriptores: Optional[CacheDescriptores] = None,
+                 durabilidad: Optional[PoliticaDurabilidad] = None, concurrente: bool = False,
+                 compresion: Optional[str] = None, tamano_bloque: int = TAMANO_BLOQUE,
+                 descripcion: Optional[Dict] = None):
+        """
+        "descripcion" es la entrada del segmento en el manifiesto de la tabla, si
+        lo hay: decide si el segmento está sellado y comprimido. Sin ella se
+        deduce de los archivos que haya junto al segmento.
+        """
+        if modo_lectura not in ("pread", "mmap"):
+            raise ValueError(f"Modo de lectura desconocido: {modo_lectura}")
+        if compresion is not None:
+            obtener_compresor(compresion)
         self.nombre_tabla = nombre_tabla
+        self.nombre_filtro = str(Path(nombre_tabla).with_suffix(".bloom"))
+        self.nombre_bloques = ruta_indice(nombre_tabla)
+        self.formato = obtener_formato(formato)
+        self.mapa = ArchivoMapeado(nombre_tabla) if modo_lectura == "mmap" else None
+        self.descriptores = descriptores if descriptores is not None else CACHE_DESCRIPTORES
         self.tiempos: List[Tuple[str, float]] = []
-        self.diccionario = {}
+        # clave -> (offset del valor, longitud del valor), o None si la clave
+        # está borrada en este segmento (su último registro es una lápida)
+        self.diccionario: Dict[int, Optional[Tuple[int, int]]] = {}
         self.claves = []
         self.escrituras = 0
+        # Claves distintas ordenadas; solo se guardan una vez sellado el
+        # segmento, porque el activo sigue recibiendo claves nuevas
+        self.claves_ordenadas: Optional[List[int]] = None
+        # Protege el índice del segmento; con "concurrente" a False no sincroniza nada
+        self.cerrojo = crear_cerrojo(concurrente)
+        # Recorridos por rango en curso que usan el segmento: si la consolidación
+        # lo elimina mientras tanto, sus archivos se borran al terminar el último
+        self.lectores = 0
+        self.por_eliminar = False
+        self.cerrojo_lectores = threading.Lock()
+        # Solo los segmentos sellados (que ya no admiten escrituras) tienen filtro
+        self.filtro: Optional[FiltroBloom] = None
+        self.indice_cargado = True
+        # Resultado de comprobar el segmento al abrirlo
+        self.registros_recuperados = 0
+        self.bytes_truncados = 0
+        # Con "compresion" ("zlib" o "lzma") los segmentos que se escriben de una
+        # vez con "escribir_registros" se guardan en bloques comprimidos
+        self.compresion = compresion
+        self.tamano_bloque = tamano_bloque
+        self.bloques: Optional[ArchivoBloques] = None
+        # Menor y mayor clave de un segmento sellado, para descartarlo sin
+        # consultar el filtro en las lecturas y recorridos fuera de su rango
+        self.minima: Optional[int] = None
+        self.maxima: Optional[int] = None
+
+        if descripcion is not None:
+            # El manifiesto es lo único que cuenta: un filtro o un índice de
+            # bloques que no recoge son restos de un sellado interrumpido
+            sellado = descripcion.get("filtro") is not None
+            comprimido = descripcion.get("bloques") is not None
+            for ruta, usado in ((self.nombre_filtro, sellado), (self.nombre_bloques, comprimido)):
+                if not usado and os.path.exists(ruta):
+                    os.remove(ruta)
+        else:
+            sellado = os.path.exists(self.nombre_filtro)
+            comprimido = os.path.exists(self.nombre_bloques)
+
+        if comprimido:
+            # Segmento comprimido: no tiene índice por clave, solo el de bloques
+            self.bloques = ArchivoBloques(nombre_tabla, self.formato, self.descriptores)
+            self.escrituras = self.bloques.num_registros
+        if sellado:
+            # Segmento sellado: basta con el filtro, el índice se
+            # reconstruye la primera vez que haga falta. El manifiesto guarda
+            # lo que no está en el propio segmento
+            self.filtro = FiltroBloom.cargar(self.nombre_filtro)
+            self.indice_cargado = False
+            if descripcion is not None:
+                self.minima = descripcion.get("minima")
+                self.maxima = descripcion.get("maxima")
+                self.escrituras = descripcion.get("registros", self.escrituras)
+        elif os.path.exists(self.nombre_tabla):
+            # Solo el segmento activo puede haber quedado con un registro a
+            # medias: los sellados se escribieron enteros antes de crear el filtro
+            self.registros_recuperados, self.bytes_truncados = recuperar_archivo(self.nombre_tabla, self.formato)
+        self.escritor = EscritorLog(nombre_tabla, durabilidad, self.descriptores)
+        if os.path.exists(self.nombre_tabla) and self.indice_cargado:
+            self._cargar_indice()
+
+    def _cargar_indice(self) -> None:
+        """
+        Reconstruye el índice del segmento leyendo su archivo
+        """
+        if self.bloques is not None:
+            # Las claves de un segmento comprimido se buscan en sus bloques
+            self.indice_cargado = True
+            return
+        diccionario = {}
+        claves = []
+        with open(self.nombre_tabla, 'rb') as f:
+            for clave, offset, longitud, flags in self.formato.iterar(f):
+                diccionario[clave] = None if flags & BORRADO else (offset, longitud)
+                claves.append(clave)
+        self.diccionario = diccionario
+        self.claves = claves
+        self.escrituras = len(claves)
+        self.indice_cargado = True
+
+    def _asegurar_indice(self) -> None:
+        # El índice de un segmento sellado se carga la primera vez que hace falta
+        if not self.indice_cargado:
+            with self.cerrojo.escritura():
+                if not self.indice_cargado:
+                    self._cargar_indice()
+
+    def sellar(self, tasa_falsos_positivos: float) -> None:
+        """
+        Marca el segmento como completo: crea su filtro de Bloom y lo guarda
+        junto al segmento para poder descartarlo sin abrirlo en las lecturas.
+
+        Otros hilos pueden estar leyendo el segmento mientras tanto, así que el
+        rango de claves se calcula aparte y se publica solo cuando está completo
+        (la máxima antes que la mínima, que es la que mira "fuera_de_rango")
+        """
+        minima: Optional[int] = None
+        maxima: Optional[int] = None
+
+        def anotar_rango(claves: Iterator[int]) -> Iterator[int]:
+            nonlocal minima, maxima
+            for clave in claves:
+                if minima is None or clave < minima:
+                    minima = clave
+                if maxima is None or clave > maxima:
+                    maxima = clave
+                yield clave
+
+        self.escritor.cerrar()
+        if self.bloques is not None:
+            claves = anotar_rango(clave for clave, _ in self.bloques.registros(usar_cache=False))
+            self.filtro = FiltroBloom.crear(claves, tasa_falsos_positivos, self.escrituras)
+        else:
+            with open(self.nombre_tabla, 'rb') as f:
+                claves = anotar_rango(clave for clave, offset, longitud, flags in self.formato.iterar(f))
+                self.filtro = FiltroBloom.crear(claves, tasa_falsos_positivos, self.escrituras)
+        self.maxima = maxima
+        self.minima = minima
+        self.filtro.guardar(self.nombre_filtro)
+
+    def descripcion(self) -> Dict:
+        """
+        Entrada del segmento en el manifiesto de la tabla
+        """
+        return {"archivo": os.path.basename(self.nombre_tabla), "registros": self.escrituras,
+                "minima": self.minima, "maxima": self.maxima,
+                "filtro": os.path.basename(self.nombre_filtro) if self.sellado() else None,
+                "bloques": os.path.basename(self.nombre_bloques) if self.bloques is not None else None}
+
+    def eliminar(self) -> None:
+        with self.cerrojo_lectores:
+            if self.lectores > 0:
+                self.por_eliminar = True
+                return
+        self.escritor.cerrar()
+        if self.mapa is not None:
+            self.mapa.cerrar()
+        if self.bloques is not None:
+            self.bloques.cerrar()
+        self.descriptores.cerrar(self.nombre_tabla)
+        os.remove(self.nombre_tabla)
+        for ruta in (self.nombre_filtro, self.nombre_bloques):
+            if os.path.exists(ruta):
+                os.remove(ruta)
+
+    def retener(self) -> None:
+        with self.cerrojo_lectores:
+            self.lectores += 1
+
+    def liberar(self) -> None:
+        with self.cerrojo_lectores:
+            self.lectores -= 1
+            eliminar = self.lectores == 0 and self.por_eliminar
+            if eliminar:
+                self.por_eliminar = False
+        if eliminar:
+            self.eliminar()
+
+    def sellado(self) -> bool:
+        return self.filtro is not None
+
+    def fuera_de_rango(self, desde: Optional[int], hasta: Optional[int]) -> bool:
+        if self.minima is None:
+            return False
+        return (hasta is not None and hasta < self.minima) or (desde is not None and desde > self.maxima)
+
+    def puede_contener(self, clave: int) -> bool:
+        if self.filtro is None:
+            return True
+        return not self.fuera_de_rango(clave, clave) and clave in self.filtro
+
+    def buscar(self, clave: int) -> Tuple[bool, Optional[str]]:
+        """
+        Busca la clave en el segmento. Devuelve (<encontrada>, <valor>), donde
+        una clave encontrada con valor None es una clave borrada: los segmentos
+        más antiguos ya no se deben consultar.
+        """
+        clave = int(clave)
+        if not self.puede_contener(clave):
+            return False, None
+        if self.bloques is not None:
+            return self.bloques.buscar(clave)
+        self._asegurar_indice()
+        with self.cerrojo.lectura():
+            if clave not in self.diccionario:
+                return False, None
+            posicion = self.diccionario[clave]
+        if posicion is None:
+            return True, None
+        self.escritor.asegurar_legible()
+        return True, self._leer_posicion(posicion)
 
     def leer(self, clave: int) -> Optional[str]:
-        valor = None
-        with open(self.nombre_tabla, 'r') as f:
-            if clave in self.diccionario:
-                offset = self.diccionario[clave]
-                f.seek(offset)
-                comas = f.readline().split(',')  # lee la línea hasta un salto de línea
-                valor = ','.join(comas[1:])
-        return valor
+        return self.buscar(clave)[1]
+
+    def _leer_posicion(self, posicion: Tuple[int, int]) -> str:
+        if self.mapa is not None:
+            return self.mapa.leer(*posicion)
+        with self.descriptores.usar(self.nombre_tabla) as fd:
+            return self.formato.leer_valor(fd, *posicion)
+
+    def buscar_muchos(self, claves: List[int]) -> Dict[int, Optional[str]]:
+        """
+        Busca varias claves en el segmento. Devuelve un diccionario con las
+        claves encontradas y su valor (None si están borradas en el segmento).
+        """
+        candidatas = [clave for clave in claves if self.puede_contener(clave)]
+        if self.bloques is not None:
+            return self.bloques.buscar_muchos(candidatas)
+        valores = {}
+        if candidatas:
+            self._asegurar_indice()
+            posiciones = {}
+            with self.cerrojo.lectura():
+                for clave in candidatas:
+                    if clave in self.diccionario:
+                        if self.diccionario[clave] is None:
+                            valores[clave] = None
+                        else:
+                            posiciones[clave] = self.diccionario[clave]
+            self.escritor.asegurar_legible()
+            # Leemos los valores en orden de offset para recorrer el archivo una vez
+            for clave, posicion in sorted(posiciones.items(), key=lambda par: par[1]):
+                valores[clave] = self._leer_posicion(posicion)
+        return valores
+
+    def leer_muchos(self, claves: List[int]) -> List[Optional[str]]:
+        claves = [int(clave) for clave in claves]
+        valores = self.buscar_muchos(claves)
+        return [valores.get(clave) for clave in claves]
+
+    def _reservar(self, datos: bytes, cambios: List[Tuple[int, Optional[Tuple[int, int]]]]) -> int:
+        """
+        Reserva el sitio de "datos" en el segmento y aplica al índice los "cambios":
+        pares (clave, posición del valor dentro de "datos"), con posición None
+        si es una lápida. Devuelve el número de secuencia con el que esperar
+        a que la escritura cumpla la política de durabilidad.
+        """
+        def anotar(offset: int) -> None:
+            with self.cerrojo.escritura():
+                for clave, posicion in cambios:
+                    self.diccionario[clave] = None if posicion is None else (offset + posicion[0], posicion[1])
+                    self.claves.append(clave)
+                self.escrituras += len(cambios)
+
+        return self.escritor.reservar(datos, anotar)[0]
+
+    def reservar_escritura(self, clave: int, valor: str) -> int:
+        clave = int(clave)
+        registro, inicio_valor, longitud = self.formato.codificar(clave, valor)
+        return self._reservar(registro, [(clave, (inicio_valor, longitud))])
+
+    def reservar_borrado(self, clave: int) -> int:
+        clave = int(clave)
+        return self._reservar(self.formato.codificar_borrado(clave), [(clave, None)])
+
+    def reservar_muchos(self, pares: List[Tuple[int, str]]) -> int:
+        registros = []
+        cambios = []
+        desplazamiento = 0
+        for clave, valor in pares:
+            registro, inicio_valor, longitud = self.formato.codificar(int(clave), valor)
+            registros.append(registro)
+            cambios.append((int(clave), (desplazamiento + inicio_valor, longitud)))
+            desplazamiento += len(registro)
+        return self._reservar(b"".join(registros), cambios)
 
     def escribir(self, clave: int, valor: str) -> bool:
-        with open(self.nombre_tabla, 'a') as f:
-            self.diccionario[clave] = f.tell()
-            f.write(f"{clave},{valor}\n")
-            self.claves.append(clave)
-            self.escrituras += 1
+        self.escritor.esperar(self.reservar_escritura(clave, valor))
         return True
 
-    def procesar_operaciones(self, archivo: str) -> None:
+    def borrar(self, clave: int) -> bool:
+        self.escritor.esperar(self.reservar_borrado(clave))
+        return True
+
+    def escribir_muchos(self, pares: List[Tuple[int, str]]) -> bool:
+        self.escritor.esperar(self.reservar_muchos(pares))
+        return True
+
+    def registros_rango(self, desde: Optional[int] = None,
+                        hasta: Optional[int] = None) -> Iterator[Tuple[int, Optional[str]]]:
+        """
+        Recorre en orden de clave los registros del segmento con desde <= clave <= hasta,
+        con el último valor de cada clave (None si está borrada en el segmento).
+        Solo se leen del archivo los valores del rango (en un segmento
+        comprimido, solo los bloques que lo cubren).
+        """
+        if self.fuera_de_rango(desde, hasta):
+            return
+        if self.bloques is not None:
+            yield from self.bloques.registros(desde, hasta)
+            return
+        self._asegurar_indice()
+        with self.cerrojo.lectura():
+            claves = self.claves_ordenadas
+            if claves is None:
+                claves = sorted(self.diccionario)
+                if self.sellado():
+                    self.claves_ordenadas = claves
+            inicio = 0 if desde is None else bisect.bisect_left(claves, desde)
+            fin = len(claves) if hasta is None else bisect.bisect_right(claves, hasta)
+            posiciones = [(clave, self.diccionario[clave]) for clave in claves[inicio:fin]]
+        self.escritor.asegurar_legible()
+        for clave, posicion in posiciones:
+            yield clave, None if posicion is None else self._leer_posicion(posicion)
+
+    def rango(self, desde: Optional[int] = None, hasta: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+        for clave, valor in self.registros_rango(desde, hasta):
+            if valor is not None:
+                yield clave, valor
+
+    def escribir_registros(self, registros: Iterable[Tuple[int, Optional[str]]]) -> int:
+        """
+        Escribe de una sola pasada los registros en un segmento nuevo, sin
+        construir su índice en memoria (se cargará si se llega a necesitar).
+        Los registros con valor None se escriben como lápidas.
+        Con "compresion" los registros deben venir ordenados por clave y sin
+        claves repetidas, y se escriben en bloques comprimidos.
+        Al terminar el archivo está forzado a disco.
+        Devuelve el número de registros escritos.
+        """
+        if self.compresion is not None:
+            self.escrituras = escribir_bloques(self.nombre_tabla, registros, self.formato,
+                                               self.compresion, self.tamano_bloque)
+            self.bloques = ArchivoBloques(self.nombre_tabla, self.formato, self.descriptores)
+            return self.escrituras
+        with open(self.nombre_tabla, 'ab') as f:
+            for clave, valor in registros:
+                if valor is None:
+                    f.write(self.formato.codificar_borrado(clave))
+                else:
+                    f.write(self.formato.codificar(clave, valor)[0])
+                self.escrituras += 1
+            f.flush()
+            os.fsync(f.fileno())
+        self.diccionario = {}
+        self.claves = []
+        self.indice_cargado = False
+        return self.escrituras
+
+    def registros_ordenados(self) -> Iterator[Tuple[int, Optional[str]]]:
+        """
+        Recorre el segmento en orden de clave, con el último valor de cada clave
+        (None si el último registro de la clave es una lápida).
+
+        Un segmento escrito con "escribir" tiene como mucho NUM_REGISTROS
+        registros, así que se ordena en memoria. Solo la consolidación crea
+        segmentos más grandes y los escribe ya ordenados y sin claves
+        repetidas, así que esos se leen secuencialmente sin cargarlos
+        (los comprimidos, bloque a bloque sin pasar por la caché).
+        """
+        if self.bloques is not None:
+            yield from self.bloques.registros(usar_cache=False)
+            return
+        with open(self.nombre_tabla, 'rb') as f:
+            registros = self.formato.registros(f)
+            primeros = list(islice(registros, self.NUM_REGISTROS + 1))
+            if len(primeros) <= self.NUM_REGISTROS:
+                ultimos = {clave: None if flags & BORRADO else valor for clave, valor, flags in primeros}
+                for clave in sorted(ultimos):
+                    yield clave, ultimos[clave]
+            else:
+                anterior = None
+                for clave, valor, flags in chain(primeros, registros):
+                    if anterior is not None and clave <= anterior:
+                        raise ValueError(f"El segmento {self.nombre_tabla} no está ordenado")
+                    anterior = clave
+                    yield clave, None if flags & BORRADO else valor
+
+    def procesar_operaciones(self, archivo: str, salida: Optional[SalidaResultados] = None) -> None:
         pass
 
     def tiempos(self) -> List[Tuple[str, float]]:
         pass
 
     def claves_almacenadas(self) -> List[int]:
+        if self.bloques is not None:
+            return [clave for clave, _ in self.bloques.registros(usar_cache=False)]
+        self._asegurar_indice()
         return self.claves
 
     def escrituras_realizadas(self) -> int:
+        self._asegurar_indice()
         return self.escrituras
 
 
 class Tabla1_4(TablaBase):
 
-    def __init__(self, nombre_tabla: str):
+    # Número de segmentos nuevos tras los que se lanza una consolidación
+    SEGMENTOS_CONSOLIDACION = 10
+
+    def __init__(self, nombre_tabla: str, formato: str = "texto", directorio: Optional[str] = None,
+                 tasa_falsos_positivos: float = 0.01, segundo_plano: bool = True,
+                 limite_consolidacion: Optional[float] = None, modo_lectura: str = "pread",
+                 descriptores: Optional[CacheDescriptores] = None,
+                 durabilidad: Optional[PoliticaDurabilidad] = None, concurrente: bool = False,
+                 compresion: Optional[str] = None, tamano_bloque: int = TAMANO_BLOQUE):
+        """
+        - "segundo_plano": si es True la consolidación se hace en un hilo aparte
+          y las escrituras siguen en un segmento nuevo mientras tanto.
+        - "limite_consolidacion": máximo de registros por segundo que escribe
+          la consolidación (None para no limitarla).
+        - "modo_lectura": "pread" o "mmap", el modo de lectura de los segmentos.
+        - "descriptores": caché de descriptores abiertos que usan los segmentos
+          (por defecto la compartida CACHE_DESCRIPTORES).
+        - "durabilidad": cuándo se fuerzan a disco las escrituras (ver PoliticaDurabilidad).
+        - "concurrente": si es True la tabla se puede usar desde varios hilos: las
+          lecturas van en paralelo y las escrituras se ordenan de una en una, pero
+          sin esperar dentro del cerrojo a que lleguen a disco.
+        - "compresion": None, "zlib" o "lzma". Con compresión los segmentos que
+          escribe la consolidación se guardan en bloques comprimidos de unos
+          "tamano_bloque" bytes; una lectura solo descomprime el bloque de su
+          clave. Los segmentos pequeños que reciben las escrituras no se comprimen.
+        """
         self.nombre_tabla = nombre_tabla
-        self.tiempos1_4: List[Tuple[str, float]] = []
+        self.formato = formato
+        self.tasa_falsos_positivos = tasa_falsos_positivos
+        self.segundo_plano = segundo_plano
+        self.limite_consolidacion = limite_consolidacion
+        self.modo_lectura = modo_lectura
+        self.descriptores = descriptores if descriptores is not None else CACHE_DESCRIPTORES
+        self.durabilidad = durabilidad
+        self.concurrente = concurrente
+        self.compresion = compresion
+        self.tamano_bloque = tamano_bloque
+        self.metricas = Metricas()
 
-        self.dir = Path('C:/Users/Ricardo/Documents/GitHub/PracticasABD/Practica1/dir')
-        self.dir.mkdir(exist_ok=True)
+        # Por defecto los segmentos se guardan en la carpeta "dir" junto a este archivo
+        self.dir = Path(directorio) if directorio is not None else Path(__file__).parent / 'dir'
+        self.dir.mkdir(parents=True, exist_ok=True)
 
-        self.segmentos = self._cargar_segmentos()
-        self.nSegmentos = len(self.segmentos)
+        # Número de cambios guardados en el manifiesto
+        self.version = 0
+        self.segmentos, self.nSegmentos = self._cargar_segmentos()
         self.consolidacion = 0
 
-        for segemento in self.segmentos:
-            for clave in segemento.claves_almacenadas():
-                self.diccionario[clave] = None
+        # Protege la lista de segmentos, que el hilo de consolidación reemplaza al
+        # terminar. Las lecturas la recorren a la vez; solo se cambia en exclusiva.
+        self.cerrojo = CerrojoLectoresEscritor()
+        # Ordena las escrituras entre sí, incluido el cambio de segmento activo
+        self.cerrojo_escritura = threading.Lock()
+        self.hilo_consolidacion: Optional[threading.Thread] = None
+        self.error_consolidacion: Optional[BaseException] = None
+
+    def _abrir_segmento(self, numero: int, descripcion: Optional[Dict] = None) -> Segmento:
+        return Segmento(f"{self.dir}/{numero}.txt", self.formato, self.modo_lectura,
+                        self.descriptores, self.durabilidad, self.concurrente,
+                        self.compresion, self.tamano_bloque, descripcion)
+
+    def _cargar_segmentos(self) -> Tuple[List[Segmento], int]:
+        """
+        Abre los segmentos vivos en el orden en que se crearon, según el
+        manifiesto, y devuelve también el último número de segmento usado.
 
-    def _cargar_segmentos(self) -> List[Segmento]:
+        Los archivos de segmentos que no están en el manifiesto son restos de
+        una consolidación que no llegó a terminar, o de segmentos consolidados
+        que no se llegaron a borrar, y se eliminan. Una carpeta sin manifiesto
+        (de antes de que existiera) se carga ordenando los archivos por número
+        y se le crea uno.
+        """
+        ruta = self.dir / ARCHIVO_MANIFIESTO
+        if not ruta.exists():
+            numeros = sorted(int(archivo.stem) for archivo in self.dir.glob("*.txt") if archivo.stem.isdigit())
+            segmentos = [self._abrir_segmento(numero) for numero in numeros]
+            if segmentos:
+                self._guardar_manifiesto(segmentos, numeros[-1])
+            return segmentos, numeros[-1] if numeros else 0
+
+        with open(ruta, 'r') as f:
+            manifiesto = json.load(f)
+        self.version = manifiesto["version"]
         segmentos = []
-        for archivo in self.dir.glob("*.txt"):
-            segmentos.append(Segmento(str(archivo)))
-        return segmentos
+        vivos = set()
+        for descripcion in manifiesto["segmentos"]:
+            numero = int(Path(descripcion["archivo"]).stem)
+            segmentos.append(self._abrir_segmento(numero, descripcion))
+            vivos.add(numero)
+        for archivo in self.dir.iterdir():
+            huerfano = archivo.stem.isdigit() and int(archivo.stem) not in vivos \
+                and archivo.suffix in (".txt", ".bloom", ".bloques")
+            # Los temporales son de escrituras atómicas que no llegaron a renombrarse
+            if huerfano or archivo.suffix == ".tmp":
+                archivo.unlink()
+        return segmentos, max([manifiesto["siguiente"], *vivos])
+
+    def _guardar_manifiesto(self, segmentos: List[Segmento], siguiente: int) -> None:
+        """
+        Guarda la lista ordenada de segmentos vivos con su rango de claves, su
+        número de registros y sus archivos de filtro y de bloques. Se escribe
+        con archivo_atomico, así que el manifiesto siempre es el anterior o el
+        nuevo completo. Se llama con "cerrojo" adquirido en exclusiva (o antes
+        de que la tabla esté en uso).
+        """
+        self.version += 1
+        with archivo_atomico(str(self.dir / ARCHIVO_MANIFIESTO)) as f:
+            json.dump({"version": self.version, "formato": self.formato, "siguiente": siguiente,
+                       "segmentos": [segmento.descripcion() for segmento in segmentos]}, f)
 
     def _nuevo_segmento(self) -> Segmento:
-        self.nSegmentos += 1
-        segmento = Segmento(f"{self.dir}/{self.nSegmentos}.txt")
         self.consolidacion += 1
-        if self.consolidacion >= 10:
-            self._consolidacion()
-        return segmento
+        if self.consolidacion >= self.SEGMENTOS_CONSOLIDACION and self.hilo_consolidacion is None:
+            self._iniciar_consolidacion()
+        self.nSegmentos += 1
+        return self._abrir_segmento(self.nSegmentos)
 
-    def _consolidacion(self):
+    def _iniciar_consolidacion(self) -> None:
+        """
+        Consolida los segmentos actuales (todos sellados) en uno nuevo. El número
+        del segmento consolidado se reserva antes que el del siguiente segmento
+        activo para que el orden de los archivos siga siendo el de creación.
+        """
         self.consolidacion = 0
-        segmento_consolidado = self._nuevo_segmento()  # Segmento de consolidación
+        self.nSegmentos += 1
+        segmento_consolidado = self._abrir_segmento(self.nSegmentos)
+        segmentos = list(self.segmentos)
+
+        if self.segundo_plano:
+            self.hilo_consolidacion = threading.Thread(target=self._consolidacion,
+                                                       args=(segmentos, segmento_consolidado),
+                                                       name=f"consolidacion-{self.nombre_tabla}")
+            self.hilo_consolidacion.start()
+        else:
+            self._consolidacion(segmentos, segmento_consolidado)
+            self.esperar_consolidacion()
+
+    def _consolidacion(self, segmentos: List[Segmento], segmento_consolidado: Segmento) -> None:
+        """
+        Mezcla los segmentos en una sola pasada secuencial (mezcla de k vías en
+        orden de clave, ganando el segmento más nuevo) y escribe el resultado
+        de una vez, sin guardar en memoria el conjunto de claves.
 
-        claves_almacenadas = {}
-        for segmento in reversed(self.segmentos):
-            for clave in segmento.claves_almacenadas():
-                if clave not in claves_almacenadas:
-                    valor = segmento.leer(clave)
-                    if valor is not None:
-                        segmento_consolidado.escribir(clave, valor.strip())
-                        claves_almacenadas[clave] = None
+        Los segmentos consolidados son siempre los más antiguos de la tabla, así
+        que ningún segmento anterior puede tener ya las claves borradas: las
+        lápidas que ganan la mezcla se descartan en lugar de copiarse.
+        """
+        publicado = False
+        try:
+            registros = mezclar([segmento.registros_ordenados() for segmento in reversed(segmentos)])
+            registros = ((clave, valor) for clave, valor in registros if valor is not None)
+            if self.limite_consolidacion:
+                registros = self._limitar(registros, 1 / self.limite_consolidacion)
+            # Los datos, el filtro y el índice de bloques del consolidado quedan
+            # en disco antes de que el manifiesto lo nombre
+            segmento_consolidado.escribir_registros(registros)
+            segmento_consolidado.sellar(self.tasa_falsos_positivos)
 
-        # Eliminar los segmentos antiguos menos el consolidado
-        for segmento in self.segmentos:
-            os.remove(segmento.nombre_tabla)
+            # Sustituimos de golpe los segmentos consolidados por el resultado,
+            # conservando los que se han creado mientras tanto: primero se guarda
+            # el manifiesto nuevo, después se cambia la lista y por último se
+            # borran los antiguos. Si se interrumpe antes de guardar el
+            # manifiesto, se vuelve a abrir con los antiguos y el consolidado
+            # se descarta como huérfano.
+            with self.cerrojo.escritura():
+                nuevos = [segmento_consolidado] + self.segmentos[len(segmentos):]
+                # A partir de aquí el manifiesto en disco puede nombrar el
+                # consolidado, así que ya no se borra aunque algo falle
+                publicado = True
+                self._guardar_manifiesto(nuevos, self.nSegmentos)
+                self.segmentos = nuevos
+                for segmento in segmentos:
+                    segmento.eliminar()
+        except BaseException as e:
+            if not publicado and os.path.exists(segmento_consolidado.nombre_tabla):
+                segmento_consolidado.eliminar()
+            self.error_consolidacion = e
+        finally:
+            self.hilo_consolidacion = None
 
-        self.segmentos = [segmento_consolidado]
+    @staticmethod
+    def _limitar(registros: Iterator[Tuple[int, str]], pausa: float) -> Iterator[Tuple[int, str]]:
+        for registro in registros:
+            yield registro
+            time.sleep(pausa)
+
+    def esperar_consolidacion(self, timeout: Optional[float] = None) -> bool:
+        """
+        Espera a que termine la consolidación en curso, si la hay.
+        Devuelve False si se agota el "timeout" antes de que termine.
+        """
+        hilo = self.hilo_consolidacion
+        if hilo is not None:
+            hilo.join(timeout)
+            if hilo.is_alive():
+                return False
+        if self.error_consolidacion is not None:
+            error, self.error_consolidacion = self.error_consolidacion, None
+            raise error
+        return True
+
+    def cerrar(self) -> None:
+        self.esperar_consolidacion()
+        with self.cerrojo_escritura:
+            if self.segmentos:
+                self.segmentos[-1].escritor.cerrar()
+                with self.cerrojo.escritura():
+                    self._guardar_manifiesto(self.segmentos, self.nSegmentos)
 
     def leer(self, clave: int) -> Optional[str]:
-        inicio = time.time()
+        inicio = time.perf_counter_ns()
         valor = None
-        if len(self.segmentos) > 0:
-            i = len(self.segmentos) - 1
-            aux = self.segmentos[i].leer(clave)
-            while i >= 0 and aux is None:
-                i -= 1
-                aux = self.segmentos[i].leer(clave)
-            if i >= 0:
-                valor = aux
-        fin = time.time()
-        self.tiempos1_4.append(("l", fin - inicio))
+        clave = int(clave)
+        # Recorremos los segmentos del más nuevo al más antiguo; los que según
+        # su filtro no tienen la clave se saltan sin abrir el archivo
+        # (una lápida también detiene la búsqueda: la clave está borrada)
+        with self.cerrojo.lectura():
+            for segmento in reversed(self.segmentos):
+                encontrada, valor = segmento.buscar(clave)
+                if encontrada:
+                    break
+        self.metricas.registrar("l", time.perf_counter_ns() - inicio)
         return valor
 
+    def _segmento_activo(self) -> Segmento:
+        """
+        Devuelve el segmento en el que se escribe, creando uno nuevo si el actual está lleno.
+        Se llama con "cerrojo_escritura" adquirido.
+        """
+        # Un segmento sellado ya no admite escrituras: su filtro dejaría de ser válido
+        if not self.segmentos or self.segmentos[-1].sellado() \
+                or self.segmentos[-1].escrituras_realizadas() >= Segmento.NUM_REGISTROS:
+            if self.segmentos and not self.segmentos[-1].sellado():
+                self.segmentos[-1].sellar(self.tasa_falsos_positivos)
+            segmento = self._nuevo_segmento()
+            # El segmento entra en el manifiesto antes de recibir su primera escritura
+            with self.cerrojo.escritura():
+                self.segmentos.append(segmento)
+                self._guardar_manifiesto(self.segmentos, self.nSegmentos)
+        return self.segmentos[-1]
+
     def escribir(self, clave: int, valor: str) -> bool:
-        inicio = time.time()
-        if not self.segmentos or self.segmentos[-1].escrituras_realizadas() >= Segmento.NUM_REGISTROS:
-            self.segmentos.append(self._nuevo_segmento())
+        inicio = time.perf_counter_ns()
+        # Solo la reserva del sitio en el segmento va dentro del cerrojo; la espera
+        # a que llegue a disco se hace fuera para que se agrupe con otras escrituras
+        with self.cerrojo_escritura:
+            segmento = self._segmento_activo()
+            secuencia = segmento.reservar_escritura(clave, valor)
+        segmento.escritor.esperar(secuencia)
+        self.metricas.registrar("e", time.perf_counter_ns() - inicio)
+        return True
+
+    def borrar(self, clave: int) -> bool:
+        inicio = time.perf_counter_ns()
+        with self.cerrojo_escritura:
+            segmento = self._segmento_activo()
+            secuencia = segmento.reservar_borrado(clave)
+        segmento.escritor.esperar(secuencia)
+        self.metricas.registrar("e", time.perf_counter_ns() - inicio)
+        return True
 
-        self.segmentos[-1].escribir(clave, valor)
+    def leer_muchos(self, claves: List[int]) -> List[Optional[str]]:
+        if not claves:
+            return []
+        inicio = time.perf_counter_ns()
+        claves = [int(clave) for clave in claves]
+        valores = {}
+        pendientes = list(dict.fromkeys(claves))
+        # Cada segmento se visita una sola vez, del más nuevo al más antiguo,
+        # preguntándole solo por las claves que aún no se han encontrado
+        # (las borradas se encuentran con valor None)
+        with self.cerrojo.lectura():
+            for segmento in reversed(self.segmentos):
+                if not pendientes:
+                    break
+                valores.update(segmento.buscar_muchos(pendientes))
+                pendientes = [clave for clave in pendientes if clave not in valores]
+        self.metricas.registrar("l", time.perf_counter_ns() - inicio, len(claves))
+        return [valores.get(clave) for clave in claves]
 
-        fin = time.time()
-        self.tiempos1_4.append(("e", fin - inicio))
+    def escribir_muchos(self, pares: List[Tuple[int, str]]) -> bool:
+        if not pares:
+            return True
+        inicio = time.perf_counter_ns()
+        # Se escribe en bloques que caben en el segmento activo, un solo append por bloque
+        reservas = []
+        with self.cerrojo_escritura:
+            i = 0
+            while i < len(pares):
+                segmento = self._segmento_activo()
+                hueco = Segmento.NUM_REGISTROS - segmento.escrituras_realizadas()
+                reservas.append((segmento, segmento.reservar_muchos(pares[i:i + hueco])))
+                i += hueco
+        for segmento, secuencia in reservas:
+            segmento.escritor.esperar(secuencia)
+        self.metricas.registrar("e", time.perf_counter_ns() - inicio, len(pares))
         return True
 
-    def procesar_operaciones(self, archivo: str) -> None:
+    def rango(self, desde: Optional[int] = None, hasta: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+        """
+        Mezcla sobre la marcha los recorridos ordenados de todos los segmentos
+        (del más nuevo al más antiguo), manteniendo en memoria un registro por
+        segmento. Los segmentos se retienen mientras dura el recorrido para que
+        una consolidación que termine entretanto no borre sus archivos.
+        """
+        with self.cerrojo.lectura():
+            segmentos = list(self.segmentos)
+            for segmento in segmentos:
+                segmento.retener()
+        try:
+            for clave, valor in mezclar([segmento.registros_rango(desde, hasta)
+                                         for segmento in reversed(segmentos)]):
+                if valor is not None:
+                    yield clave, valor
+        finally:
+            for segmento in segmentos:
+                segmento.liberar()
 
+    def procesar_operaciones(self, archivo: str, salida: Optional[SalidaResultados] = None) -> None:
+        if salida is None:
+            salida = SalidaResultados()
         with open(archivo, 'r') as f:
             for linea in f:
                 partes = linea.strip().split(" ", 2)
                 if partes[0] == "l":
-                    clave = partes[1]
-                    valor = self.leer(clave)
-                    if valor is not None:
-                        print(valor)
-                    else:
-                        print(f"Valor de {clave} no encontrado")
+                    clave = int(partes[1])
+                    salida.escribir(clave, self.leer(clave))
                 elif partes[0] == "e":
-                    clave, valor = partes[1], partes[2]
+                    clave, valor = int(partes[1]), partes[2]
                     self.escribir(clave, valor)
+                elif partes[0] == "b":
+                    self.borrar(int(partes[1]))
+        salida.vaciar()
 
     def tiempos(self) -> List[Tuple[str, float]]:
-        return self.tiempos1_4
+        return self.metricas.tiempos()
 
 
 if __name__ == "__main__":
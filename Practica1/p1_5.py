@@ -1,43 +1,342 @@
+"""
+Banco de pruebas de las implementaciones de TablaBase.
+
+Ejecuta cargas de trabajo con nombre (lectura, escritura, mixta, recorrido)
+con claves elegidas según una distribución (uniforme, zipf, reciente) sobre
+cada motor, varias repeticiones, y da para cada ejecución el rendimiento
+(operaciones por segundo), las latencias p50/p95/p99/máxima y los bytes
+leídos y escritos. Los resultados se pueden guardar en JSON o CSV y
+compararse con los de una ejecución anterior para detectar regresiones.
+
+Ejemplo:
+    python p1_5.py --motores 1_3,1_4 --cargas lectura,mixta --json actual.json
+    python p1_5.py --base actual.json
+"""
+import argparse
+import bisect
+import csv
+import json
+import random
+import shutil
+import string
+import sys
+import tempfile
 import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+from tabla_base import TablaBase
 from p1_2 import Tabla1_2
 from p1_3 import Tabla1_3
 from p1_4 import Tabla1_4
+from tabla_lsm import TablaLSM
+from tabla_arbol_b import TablaArbolB
+from cache_valores import TablaCacheada
+
+# Motor -> función que crea la tabla dentro de la carpeta indicada
+MOTORES: Dict[str, Callable[[Path], TablaBase]] = {
+    "1_2": lambda carpeta: Tabla1_2(str(carpeta / "tabla1_2.txt")),
+    "1_3": lambda carpeta: Tabla1_3(str(carpeta / "tabla1_3.txt")),
+    "1_4": lambda carpeta: Tabla1_4("tabla1_4", directorio=str(carpeta / "segmentos")),
+    "1_4_zlib": lambda carpeta: Tabla1_4("tabla1_4", directorio=str(carpeta / "segmentos"), compresion="zlib"),
+    "lsm": lambda carpeta: TablaLSM(str(carpeta / "lsm")),
+    "arbol_b": lambda carpeta: TablaArbolB(str(carpeta / "tabla_arbol_b.db")),
+    "1_3_cache": lambda carpeta: TablaCacheada(Tabla1_3(str(carpeta / "tabla1_3.txt"))),
+}
+# Tabla1_2 recorre el archivo en cada lectura, así que no se ejecuta por defecto
+MOTORES_POR_DEFECTO = ["1_3", "1_4", "lsm", "arbol_b"]
+
+# Carga -> proporción de lecturas, escrituras y recorridos
+CARGAS: Dict[str, Dict[str, float]] = {
+    "lectura": {"l": 0.95, "e": 0.05, "r": 0.0},
+    "escritura": {"l": 0.05, "e": 0.95, "r": 0.0},
+    "mixta": {"l": 0.5, "e": 0.5, "r": 0.0},
+    "recorrido": {"l": 0.0, "e": 0.05, "r": 0.95},
+}
+DISTRIBUCIONES = ["uniforme", "zipf", "reciente"]
+
+# Métricas en las que un valor más alto es mejor; en el resto es peor
+MAYOR_ES_MEJOR = {"ops_por_segundo"}
+
+
+class GeneradorZipf:
+    """
+    Devuelve rangos 0..n-1 con probabilidad proporcional a 1 / (rango + 1)^theta,
+    buscando en la distribución acumulada precalculada
+    """
+
+    def __init__(self, n: int, theta: float, aleatorio: random.Random):
+        self.aleatorio = aleatorio
+        self.acumulada: List[float] = []
+        total = 0.0
+        for rango in range(1, n + 1):
+            total += 1 / rango ** theta
+            self.acumulada.append(total)
+
+    def siguiente(self) -> int:
+        return bisect.bisect_left(self.acumulada, self.aleatorio.random() * self.acumulada[-1])
+
+
+class GeneradorOperaciones:
+    """
+    Genera operaciones ("l", clave), ("e", clave, valor) o ("r", desde, hasta)
+    de una carga sobre una tabla precargada con las claves 0..num_claves-1.
+
+    - "uniforme": todas las claves con la misma probabilidad.
+    - "zipf": unas pocas claves (repartidas al azar) concentran la mayoría de los accesos.
+    - "reciente": las escrituras añaden claves nuevas y las lecturas prefieren las
+      últimas añadidas.
+    """
+
+    def __init__(self, carga: str, distribucion: str, num_claves: int, tamano_valor: int,
+                 longitud_recorrido: int, theta: float, semilla: int):
+        self.proporciones = CARGAS[carga]
+        self.distribucion = distribucion
+        self.num_claves = num_claves
+        self.longitud_recorrido = longitud_recorrido
+        self.aleatorio = random.Random(semilla)
+        self.ultima_clave = num_claves - 1
+        if distribucion != "uniforme":
+            self.zipf = GeneradorZipf(num_claves, theta, self.aleatorio)
+            self.permutacion = list(range(num_claves))
+            self.aleatorio.shuffle(self.permutacion)
+        # Los valores se generan de antemano para no medir su creación
+        letras = string.ascii_letters + string.digits
+        self.valores = ["".join(self.aleatorio.choices(letras, k=tamano_valor)) for _ in range(256)]
+
+    def _clave(self) -> int:
+        if self.distribucion == "uniforme":
+            return self.aleatorio.randrange(self.num_claves)
+        if self.distribucion == "zipf":
+            return self.permutacion[self.zipf.siguiente()]
+        return max(0, self.ultima_clave - self.zipf.siguiente())
+
+    def siguiente(self) -> tuple:
+        tirada = self.aleatorio.random()
+        if tirada < self.proporciones["l"]:
+            return "l", self._clave()
+        if tirada < self.proporciones["l"] + self.proporciones["e"]:
+            if self.distribucion == "reciente":
+                self.ultima_clave += 1
+                clave = self.ultima_clave
+            else:
+                clave = self._clave()
+            return "e", clave, self.aleatorio.choice(self.valores)
+        desde = self._clave()
+        return "r", desde, desde + self.longitud_recorrido - 1
+
+    def precarga(self) -> List[Tuple[int, str]]:
+        return [(clave, self.valores[clave % len(self.valores)]) for clave in range(self.num_claves)]
+
+
+def bytes_io() -> Optional[Tuple[int, int]]:
+    """
+    Bytes leídos y escritos por el proceso mediante llamadas al sistema (rchar y
+    wchar de /proc/self/io), o None si el sistema no lo ofrece. Las lecturas
+    de archivos mapeados en memoria no cuentan.
+    """
+    try:
+        with open("/proc/self/io", 'r') as f:
+            campos = dict(linea.split(": ") for linea in f.read().splitlines())
+        return int(campos["rchar"]), int(campos["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def percentil(ordenadas: List[float], p: float) -> float:
+    if not ordenadas:
+        return 0.0
+    return ordenadas[min(len(ordenadas) - 1, int(p / 100 * len(ordenadas)))]
+
+
+def ejecutar_operacion(tabla: TablaBase, operacion: tuple) -> None:
+    if operacion[0] == "l":
+        tabla.leer(operacion[1])
+    elif operacion[0] == "e":
+        tabla.escribir(operacion[1], operacion[2])
+    else:
+        for _ in tabla.rango(operacion[1], operacion[2]):
+            pass
+
+
+def ejecutar(motor: str, carga: str, distribucion: str, repeticion: int, args) -> List[dict]:
+    """
+    Ejecuta una repetición de la carga sobre una tabla nueva del motor y devuelve
+    una fila de resultados para todas las operaciones y otra para cada tipo
+    """
+    generador = GeneradorOperaciones(carga, distribucion, args.claves, args.tamano_valor,
+                                     args.longitud_recorrido, args.theta, args.semilla + repeticion)
+    # Las operaciones se generan antes de medir
+    calentamiento = [generador.siguiente() for _ in range(args.calentamiento)]
+    operaciones = [generador.siguiente() for _ in range(args.operaciones)]
+
+    carpeta = Path(tempfile.mkdtemp(prefix=f"banco-{motor}-", dir=args.directorio))
+    try:
+        tabla = MOTORES[motor](carpeta)
+        tabla.escribir_muchos(generador.precarga())
+        for operacion in calentamiento:
+            ejecutar_operacion(tabla, operacion)
+        # Aciertos y fallos de la caché antes de medir, para contar solo los de la medición
+        cache_inicio = tabla.estadisticas() if isinstance(tabla, TablaCacheada) else None
+
+        latencias: Dict[str, List[float]] = {"l": [], "e": [], "r": []}
+        io_inicio = bytes_io()
+        inicio = time.perf_counter()
+        for operacion in operaciones:
+            antes = time.perf_counter()
+            ejecutar_operacion(tabla, operacion)
+            latencias[operacion[0]].append(time.perf_counter() - antes)
+        segundos = time.perf_counter() - inicio
+        io_fin = bytes_io()
+        cache_fin = tabla.estadisticas() if cache_inicio is not None else None
+
+        cerrar = getattr(tabla, "cerrar", None)
+        if cerrar is not None:
+            cerrar()
+    finally:
+        shutil.rmtree(carpeta, ignore_errors=True)
+
+    comunes = {"motor": motor, "carga": carga, "distribucion": distribucion, "repeticion": repeticion}
+    if io_inicio is not None and io_fin is not None:
+        comunes["bytes_leidos"] = io_fin[0] - io_inicio[0]
+        comunes["bytes_escritos"] = io_fin[1] - io_inicio[1]
+    else:
+        comunes["bytes_leidos"] = comunes["bytes_escritos"] = None
+    if cache_inicio is not None and cache_fin is not None:
+        aciertos = cache_fin["aciertos"] - cache_inicio["aciertos"]
+        fallos = cache_fin["fallos"] - cache_inicio["fallos"]
+        comunes["aciertos_cache"] = aciertos
+        comunes["fallos_cache"] = fallos
+        comunes["tasa_aciertos"] = aciertos / (aciertos + fallos) if aciertos + fallos else 0.0
+    else:
+        # Motores sin caché de valores
+        comunes["aciertos_cache"] = comunes["fallos_cache"] = comunes["tasa_aciertos"] = None
+
+    filas = []
+    grupos = [("todas", [latencia for lista in latencias.values() for latencia in lista])]
+    grupos += [(tipo, lista) for tipo, lista in latencias.items() if lista]
+    for tipo, lista in grupos:
+        ordenadas = sorted(lista)
+        filas.append(dict(comunes, operacion=tipo, operaciones=len(ordenadas),
+                          ops_por_segundo=len(ordenadas) / segundos if segundos > 0 else 0.0,
+                          p50_us=percentil(ordenadas, 50) * 1e6, p95_us=percentil(ordenadas, 95) * 1e6,
+                          p99_us=percentil(ordenadas, 99) * 1e6,
+                          max_us=(ordenadas[-1] if ordenadas else 0.0) * 1e6))
+    return filas
+
+
+def resumir(filas: List[dict]) -> Dict[Tuple[str, str, str, str], dict]:
+    """
+    Agrupa las repeticiones de cada (motor, carga, distribución, operación)
+    quedándose con la mediana de cada métrica. La tasa de aciertos de la
+    caché es None en los motores sin caché (y en resultados anteriores a ella).
+    """
+    grupos: Dict[Tuple[str, str, str, str], List[dict]] = {}
+    for fila in filas:
+        grupos.setdefault((fila["motor"], fila["carga"], fila["distribucion"], fila["operacion"]), []).append(fila)
+    resumen = {}
+    for clave, repeticiones in grupos.items():
+        resumen[clave] = {metrica: sorted(fila[metrica] for fila in repeticiones)[len(repeticiones) // 2]
+                          for metrica in ("ops_por_segundo", "p50_us", "p95_us", "p99_us", "max_us")}
+        tasas = sorted(fila["tasa_aciertos"] for fila in repeticiones if fila.get("tasa_aciertos") is not None)
+        resumen[clave]["tasa_aciertos"] = tasas[len(tasas) // 2] if tasas else None
+    return resumen
+
+
+def comparar(filas: List[dict], base: List[dict], tolerancia: float) -> List[str]:
+    """
+    Compara las medianas de las filas con las de "base" y devuelve una línea
+    por cada métrica que ha empeorado más de "tolerancia" (por ejemplo 0.1 = 10 %).
+    El máximo se ignora porque es demasiado ruidoso.
+    """
+    actual = resumir(filas)
+    anterior = resumir(base)
+    regresiones = []
+    for clave in sorted(actual.keys() & anterior.keys()):
+        for metrica in ("ops_por_segundo", "p50_us", "p95_us", "p99_us"):
+            nuevo, viejo = actual[clave][metrica], anterior[clave][metrica]
+            if viejo <= 0:
+                continue
+            cambio = (nuevo - viejo) / viejo
+            if (cambio < -tolerancia) if metrica in MAYOR_ES_MEJOR else (cambio > tolerancia):
+                regresiones.append(f"{'/'.join(clave)} {metrica}: {viejo:.1f} -> {nuevo:.1f} ({cambio:+.0%})")
+    return regresiones
+
+
+def imprimir(filas: List[dict]) -> None:
+    print(f"{'motor':<10}{'carga':<11}{'distribucion':<13}{'op':<6}{'ops/s':>11}"
+          f"{'p50 us':>10}{'p95 us':>10}{'p99 us':>10}{'max us':>11}{'aciertos':>10}")
+    for (motor, carga, distribucion, operacion), metricas in resumir(filas).items():
+        tasa = metricas["tasa_aciertos"]
+        print(f"{motor:<10}{carga:<11}{distribucion:<13}{operacion:<6}{metricas['ops_por_segundo']:>11.0f}"
+              f"{metricas['p50_us']:>10.1f}{metricas['p95_us']:>10.1f}{metricas['p99_us']:>10.1f}"
+              f"{metricas['max_us']:>11.1f}{'-' if tasa is None else f'{tasa:.1%}':>10}")
+
+
+def guardar_csv(filas: List[dict], ruta: str) -> None:
+    with open(ruta, 'w', newline='') as f:
+        escritor = csv.DictWriter(f, fieldnames=list(filas[0].keys()))
+        escritor.writeheader()
+        escritor.writerows(filas)
+
+
+def lista(texto: str) -> List[str]:
+    return [elemento for elemento in texto.split(",") if elemento]
+
+
+def main(argumentos: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Banco de pruebas de las implementaciones de TablaBase")
+    parser.add_argument("--motores", type=lista, default=MOTORES_POR_DEFECTO,
+                        help=f"motores separados por comas: {', '.join(MOTORES)}")
+    parser.add_argument("--cargas", type=lista, default=list(CARGAS),
+                        help=f"cargas separadas por comas: {', '.join(CARGAS)}")
+    parser.add_argument("--distribuciones", type=lista, default=DISTRIBUCIONES,
+                        help=f"distribuciones separadas por comas: {', '.join(DISTRIBUCIONES)}")
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--claves", type=int, default=10000, help="claves precargadas")
+    parser.add_argument("--operaciones", type=int, default=10000, help="operaciones medidas por repetición")
+    parser.add_argument("--calentamiento", type=int, default=1000, help="operaciones sin medir antes de medir")
+    parser.add_argument("--tamano-valor", type=int, default=100, help="bytes de cada valor")
+    parser.add_argument("--longitud-recorrido", type=int, default=100, help="claves de cada recorrido")
+    parser.add_argument("--theta", type=float, default=0.99, help="sesgo de las distribuciones zipf y reciente")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--directorio", default=None, help="carpeta para las tablas temporales")
+    parser.add_argument("--json", help="guarda los resultados en este archivo JSON")
+    parser.add_argument("--csv", help="guarda los resultados en este archivo CSV")
+    parser.add_argument("--base", help="JSON de una ejecución anterior con el que comparar")
+    parser.add_argument("--tolerancia", type=float, default=0.1,
+                        help="empeoramiento relativo a partir del cual se considera regresión")
+    args = parser.parse_args(argumentos)
+
+    for nombre, elegidos, validos in (("motor", args.motores, MOTORES), ("carga", args.cargas, CARGAS),
+                                      ("distribución", args.distribuciones, DISTRIBUCIONES)):
+        for elegido in elegidos:
+            if elegido not in validos:
+                parser.error(f"{nombre} desconocido: {elegido}")
+
+    filas = []
+    for motor in args.motores:
+        for carga in args.cargas:
+            for distribucion in args.distribuciones:
+                for repeticion in range(args.repeticiones):
+                    filas.extend(ejecutar(motor, carga, distribucion, repeticion, args))
+    imprimir(filas)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(filas, f, indent=1)
+    if args.csv:
+        guardar_csv(filas, args.csv)
+    if args.base:
+        with open(args.base, 'r') as f:
+            regresiones = comparar(filas, json.load(f), args.tolerancia)
+        if regresiones:
+            print(f"\n{len(regresiones)} regresiones respecto a {args.base}:")
+            for regresion in regresiones:
+                print(f"  {regresion}")
+            return 1
+        print(f"\nSin regresiones respecto a {args.base}")
+    return 0
+
 
 if __name__ == "__main__":
-    tabla1_2 = Tabla1_2("tabla1_2.txt")
-    tabla1_3 = Tabla1_3("tabla1_3.txt")
-    tabla1_4 = Tabla1_4("tabla1_4.txt")
-
-    tabla1_2.procesar_operaciones("lecturas.txt")
-    tiempos1_2 = tabla1_2.tiempos()
-    t1_2e = 0
-    t1_2l = 0
-    for tiempo in tiempos1_2:
-        if tiempo[0] == "e":
-            t1_2e += tiempo[1]
-        elif tiempo[0] == "l":
-            t1_2l += tiempo[1]
-
-    tabla1_3.procesar_operaciones("lecturas.txt")
-    tiempos1_3 = tabla1_3.tiempos()
-    t1_3e = 0
-    t1_3l = 0
-    for tiempo in tiempos1_3:
-        if tiempo[0] == "e":
-            t1_3e += tiempo[1]
-        elif tiempo[0] == "l":
-            t1_3l += tiempo[1]
-
-    tabla1_4.procesar_operaciones("lecturas.txt")
-    tiempos1_4 = tabla1_4.tiempos()
-    t1_4e = 0
-    t1_4l = 0
-    for tiempo in tiempos1_4:
-        if tiempo[0] == "e":
-            t1_4e += tiempo[1]
-        else:
-            t1_4l += tiempo[1]
-
-    print(f"Tiempo 1_2(escritura): {t1_2e}\n Tiempo1_2(lectura): {t1_2l}\n")
-    print(f"Tiempo 1_3(escritura): {t1_3e}\n Tiempo1_3(lectura): {t1_3l}\n")
-    print(f"Tiempo 1_4(escritura): {t1_4e}\n Tiempo1_4(lectura): {t1_4l}\n")
\ No newline at end of file
+    sys.exit(main())
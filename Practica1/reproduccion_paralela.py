@@ -0,0 +1,115 @@
+import heapq
+import os
+import sys
+import tempfile
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable, Iterator, List, Optional, Tuple
+from tabla_base import TablaBase
+from salida import SalidaResultados
+from tabla_fragmentada import ARCHIVO_CONFIGURACION, configurar_fragmentos, crear_tabla1_4, fragmento_de
+
+
+def _repartir(archivo: str, num_fragmentos: int, rutas: List[str]) -> None:
+    """
+    Recorre "archivo" una sola vez y escribe cada operación en el archivo de
+    "rutas" de su fragmento, precedida de su número de línea, para que cada
+    proceso lea solo sus operaciones en lugar de interpretar el archivo entero
+    """
+    with ExitStack() as pila:
+        destinos = [pila.enter_context(open(ruta, 'w')) for ruta in rutas]
+        with open(archivo, 'r') as f:
+            for numero, linea in enumerate(f):
+                partes = linea.strip().split(" ", 2)
+                if partes[0] not in ("l", "e", "b"):
+                    continue
+                clave = int(partes[1])
+                operacion = f"e {clave} {partes[2]}" if partes[0] == "e" else f"{partes[0]} {clave}"
+                destinos[fragmento_de(clave, num_fragmentos)].write(f"{numero} {operacion}\n")
+
+
+def _reproducir_fragmento(ruta_operaciones: str, carpeta: str,
+                          fabrica: Callable[[str], TablaBase], ruta_salida: str) -> int:
+    """
+    Proceso trabajador: ejecuta en orden las operaciones de "ruta_operaciones"
+    (las de un fragmento, escritas por "_repartir") sobre la tabla de ese
+    fragmento y escribe en "ruta_salida" el resultado de cada lectura precedido
+    de su número de línea. Devuelve el número de operaciones ejecutadas.
+    """
+    tabla = fabrica(carpeta)
+    operaciones = 0
+    with open(ruta_operaciones, 'r') as f, open(ruta_salida, 'w') as salida:
+        for linea in f:
+            partes = linea.rstrip("\n").split(" ", 3)
+            numero, operacion, clave = partes[0], partes[1], int(partes[2])
+            if operacion == "l":
+                valor = tabla.leer(clave)
+                # Un valor no puede contener saltos de línea, pero se distingue
+                # la clave no encontrada de un valor vacío
+                salida.write(f"{numero}\t{clave}\t{'' if valor is None else '=' + valor}\n")
+            elif operacion == "e":
+                tabla.escribir(clave, partes[3])
+            else:
+                tabla.borrar(clave)
+            operaciones += 1
+    cerrar = getattr(tabla, "cerrar", None)
+    if cerrar is not None:
+        cerrar()
+    return operaciones
+
+
+def _leer_salida(ruta: str) -> Iterator[Tuple[int, int, Optional[str]]]:
+    with open(ruta, 'r') as f:
+        for linea in f:
+            numero, clave, valor = linea.rstrip("\n").split("\t", 2)
+            yield int(numero), int(clave), valor[1:] if valor else None
+
+
+def reproducir_en_paralelo(archivo: str, directorio: str, num_fragmentos: Optional[int] = None,
+                           fabrica: Callable[[str], TablaBase] = crear_tabla1_4,
+                           salida: Optional[SalidaResultados] = None) -> int:
+    """
+    Equivalente a "procesar_operaciones" repartiendo las operaciones de "archivo"
+    entre varios procesos. Cada proceso se ocupa de las claves de un fragmento
+    (las mismas carpetas y el mismo reparto por hash que TablaFragmentada, que
+    puede abrir "directorio" después), así que las operaciones de una misma
+    clave se ejecutan en el orden del archivo.
+
+    Los resultados de las lecturas se escriben en "salida" (por defecto por
+    pantalla) en el orden de las líneas del archivo, igual que si se procesara
+    de forma secuencial. "fabrica" se pasa a los procesos, así que debe ser
+    una función de módulo.
+    Devuelve el número de operaciones ejecutadas.
+    """
+    if salida is None:
+        salida = SalidaResultados()
+    directorio = Path(directorio)
+    directorio.mkdir(parents=True, exist_ok=True)
+    if num_fragmentos is None and not (directorio / ARCHIVO_CONFIGURACION).exists():
+        num_fragmentos = os.cpu_count() or 1
+    num_fragmentos = configurar_fragmentos(directorio, num_fragmentos)
+
+    with tempfile.TemporaryDirectory(prefix="reproduccion-") as temporal:
+        entradas = [os.path.join(temporal, f"{i}.operaciones") for i in range(num_fragmentos)]
+        salidas = [os.path.join(temporal, f"{i}.txt") for i in range(num_fragmentos)]
+        _repartir(archivo, num_fragmentos, entradas)
+        with ProcessPoolExecutor(max_workers=num_fragmentos) as ejecutor:
+            futuros = []
+            for i in range(num_fragmentos):
+                carpeta = directorio / str(i)
+                carpeta.mkdir(exist_ok=True)
+                futuros.append(ejecutor.submit(_reproducir_fragmento, entradas[i], str(carpeta),
+                                               fabrica, salidas[i]))
+            operaciones = sum(futuro.result() for futuro in futuros)
+
+        # Cada salida ya está en orden de línea, así que basta con intercalarlas
+        for _, clave, valor in heapq.merge(*(_leer_salida(ruta) for ruta in salidas)):
+            salida.escribir(clave, valor)
+        salida.vaciar()
+    return operaciones
+
+
+if __name__ == "__main__":
+    # Uso: python reproduccion_paralela.py <archivo> <directorio> [<procesos>]
+    reproducir_en_paralelo(sys.argv[1], sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else None)
@@ -0,0 +1,81 @@
+import struct
+import sys
+from typing import BinaryIO, List, Optional, TextIO, Union
+
+
+class SalidaResultados:
+    """
+    Destino de los resultados de las lecturas de procesar_operaciones.
+
+    En lugar de un print por lectura, los resultados se acumulan en un buffer
+    de como mucho "tamano_buffer" bytes y se escriben de una vez en "destino"
+    (por defecto la salida estándar), así que la memoria no depende del
+    tamaño del archivo de operaciones.
+
+    - Texto (por defecto): una línea por lectura, igual que con print: el valor
+      o `Valor de <clave> no encontrado`.
+    - "binario": cada resultado es una cabecera con la clave (int64) y la
+      longitud del valor (int32, -1 si no se encuentra) seguida de los bytes
+      del valor. "destino" tiene que ser un archivo binario.
+    """
+    # clave (int64), longitud del valor (int32, -1 si no hay clave)
+    CABECERA = struct.Struct("<qi")
+
+    def __init__(self, destino: Optional[Union[TextIO, BinaryIO]] = None, binario: bool = False,
+                 tamano_buffer: int = 1 << 16):
+        if destino is None:
+            destino = sys.stdout.buffer if binario else sys.stdout
+        self.destino = destino
+        self.binario = binario
+        self.tamano_buffer = tamano_buffer
+        self.partes: List[str] = []
+        self.datos = bytearray()
+        self.ocupado = 0
+        self.resultados = 0
+
+    def escribir(self, clave: int, valor: Optional[str]) -> None:
+        """
+        Añade el resultado de leer la clave "clave" (None si no se encontró)
+        """
+        self.resultados += 1
+        if self.binario:
+            if valor is None:
+                self.datos += self.CABECERA.pack(clave, -1)
+            else:
+                datos = valor.encode()
+                self.datos += self.CABECERA.pack(clave, len(datos))
+                self.datos += datos
+            if len(self.datos) >= self.tamano_buffer:
+                self.vaciar()
+            return
+        linea = f"{valor}\n" if valor is not None else f"Valor de {clave} no encontrado\n"
+        self.partes.append(linea)
+        self.ocupado += len(linea)
+        if self.ocupado >= self.tamano_buffer:
+            self.vaciar()
+
+    def vaciar(self) -> None:
+        if self.datos:
+            self.destino.write(self.datos)
+            self.datos = bytearray()
+        if self.partes:
+            self.destino.write("".join(self.partes))
+            self.partes = []
+            self.ocupado = 0
+        self.destino.flush()
+
+
+class SalidaNula(SalidaResultados):
+    """
+    Descarta los resultados (solo los cuenta), para medir el rendimiento de
+    la tabla sin el coste de escribir la salida
+    """
+
+    def __init__(self):
+        super().__init__(destino=sys.stdout)
+
+    def escribir(self, clave: int, valor: Optional[str]) -> None:
+        self.resultados += 1
+
+    def vaciar(self) -> None:
+        pass
@@ -0,0 +1,406 @@
+import bisect
+import itertools
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional, Tuple
+from tabla_base import TablaBase
+from metricas import Metricas
+from salida import SalidaResultados
+
+TAMANO_PAGINA = 4096
+# Página 0: identificador, tamaño de página, página raíz, número de páginas
+META = struct.Struct("<8sIII")
+IDENTIFICADOR = b"ARBOLB+1"
+# Cabecera de cada nodo: tipo, número de claves, siguiente hoja (0 si no hay)
+CABECERA = struct.Struct("<BHI")
+HOJA = 1
+INTERNO = 2
+# Entrada de una hoja: clave y longitud del valor, seguidas de los bytes del valor
+ENTRADA = struct.Struct("<qH")
+CLAVE = struct.Struct("<q")
+HIJO = struct.Struct("<I")
+
+
+class Nodo:
+    """
+    Copia en memoria de una página del árbol. Las hojas guardan las claves
+    ordenadas con sus valores (en bytes) y la página de la hoja siguiente; los
+    nodos internos guardan las claves separadoras y una página hija más que claves.
+    """
+
+    def __init__(self, pagina: int, hoja: bool):
+        self.pagina = pagina
+        self.hoja = hoja
+        self.claves: List[int] = []
+        self.valores: List[bytes] = []
+        self.hijos: List[int] = []
+        self.siguiente = 0
+        self.sucio = True
+        # Bytes que ocupa la página serializada (solo se lleva la cuenta en las hojas)
+        self.tamano = CABECERA.size
+
+    @classmethod
+    def leer(cls, pagina: int, datos: bytes) -> "Nodo":
+        tipo, num_claves, siguiente = CABECERA.unpack_from(datos)
+        nodo = cls(pagina, tipo == HOJA)
+        nodo.siguiente = siguiente
+        nodo.sucio = False
+        offset = CABECERA.size
+        if nodo.hoja:
+            for _ in range(num_claves):
+                clave, longitud = ENTRADA.unpack_from(datos, offset)
+                offset += ENTRADA.size
+                nodo.claves.append(clave)
+                nodo.valores.append(bytes(datos[offset:offset + longitud]))
+                offset += longitud
+            nodo.tamano = offset
+        else:
+            nodo.claves = list(struct.unpack_from(f"<{num_claves}q", datos, offset))
+            offset += num_claves * CLAVE.size
+            nodo.hijos = list(struct.unpack_from(f"<{num_claves + 1}I", datos, offset))
+        return nodo
+
+    def serializar(self, tamano_pagina: int) -> bytes:
+        partes = [CABECERA.pack(HOJA if self.hoja else INTERNO, len(self.claves), self.siguiente)]
+        if self.hoja:
+            for clave, valor in zip(self.claves, self.valores):
+                partes.append(ENTRADA.pack(clave, len(valor)))
+                partes.append(valor)
+        else:
+            partes.append(struct.pack(f"<{len(self.claves)}q", *self.claves))
+            partes.append(struct.pack(f"<{len(self.hijos)}I", *self.hijos))
+        datos = b"".join(partes)
+        return datos + bytes(tamano_pagina - len(datos))
+
+
+class TablaArbolB(TablaBase):
+    """
+    Tabla guardada en un árbol B+ en disco con páginas de tamaño fijo.
+
+    A diferencia del resto de tablas, que solo añaden registros al final de
+    un log, aquí una escritura modifica la hoja de la clave en su sitio, así
+    que no hay versiones antiguas que consolidar. Una lectura recorre una
+    página por nivel (O(log n)) y las hojas están encadenadas en orden de
+    clave, de forma que un recorrido por rango baja una vez y después avanza
+    de hoja en hoja.
+
+    Las páginas se leen a través de un buffer pool de "paginas_cache" páginas
+    que desaloja la menos usada recientemente. Las páginas modificadas se
+    escriben en el archivo al desalojar alguna, con vaciar() o al cerrar la tabla;
+    con "escritura_inmediata" se escriben al terminar cada operación. La
+    página 0 (raíz y número de páginas) solo se escribe después de todas las
+    demás, así que el archivo siempre se puede abrir, aunque sin las
+    escrituras posteriores al último vaciado. No hay log de escritura
+    anticipada: una caída a mitad de una división de páginas puede dejar el
+    árbol inconsistente.
+
+    Los borrados quitan la clave de su hoja pero no fusionan hojas vacías.
+    Cada valor tiene que caber en una cuarta parte de una página.
+    """
+
+    def __init__(self, nombre_tabla: str, paginas_cache: int = 256, escritura_inmediata: bool = False,
+                 tamano_pagina: int = TAMANO_PAGINA):
+        self.nombre_tabla = nombre_tabla
+        self.paginas_cache = paginas_cache
+        self.escritura_inmediata = escritura_inmediata
+        self.metricas = Metricas()
+        self.cache: "OrderedDict[int, Nodo]" = OrderedDict()
+        # Nodos del pool modificados y aún no escritos en el archivo
+        self.sucios: Dict[int, Nodo] = {}
+        self.cerrojo = threading.RLock()
+        # Páginas leídas del archivo y escritas en él, para comprobar el coste de cada operación
+        self.paginas_leidas = 0
+        self.paginas_escritas = 0
+
+        existe = os.path.exists(nombre_tabla) and os.path.getsize(nombre_tabla) > 0
+        self.fd = os.open(nombre_tabla, os.O_RDWR | os.O_CREAT, 0o644)
+        if existe:
+            identificador, self.tamano_pagina, self.raiz, self.num_paginas = \
+                META.unpack(os.pread(self.fd, META.size, 0))
+            if identificador != IDENTIFICADOR:
+                os.close(self.fd)
+                raise ValueError(f"{nombre_tabla} no es un árbol B+")
+            self.meta_guardada = (self.raiz, self.num_paginas)
+        else:
+            self.tamano_pagina = tamano_pagina
+            self.num_paginas = 1
+            raiz = self._nueva_pagina(hoja=True)
+            self.raiz = raiz.pagina
+            self._escribir_nodo(raiz)
+            self._guardar_meta()
+        self.max_valor = (self.tamano_pagina - CABECERA.size) // 4 - ENTRADA.size
+        self.max_claves_interno = (self.tamano_pagina - CABECERA.size - HIJO.size) // (CLAVE.size + HIJO.size)
+
+    def _guardar_meta(self) -> None:
+        """
+        Escribe la página 0 con la raíz y el número de páginas. Solo se llama
+        cuando todas las páginas modificadas ya están escritas, para que nunca
+        apunte a páginas que aún no existen en el archivo
+        """
+        meta = META.pack(IDENTIFICADOR, self.tamano_pagina, self.raiz, self.num_paginas)
+        os.pwrite(self.fd, meta + bytes(self.tamano_pagina - len(meta)), 0)
+        self.meta_guardada = (self.raiz, self.num_paginas)
+
+    def _nueva_pagina(self, hoja: bool) -> Nodo:
+        nodo = Nodo(self.num_paginas, hoja)
+        self.num_paginas += 1
+        self.cache[nodo.pagina] = nodo
+        self.sucios[nodo.pagina] = nodo
+        return nodo
+
+    def _marcar(self, nodo: Nodo) -> None:
+        nodo.sucio = True
+        self.sucios[nodo.pagina] = nodo
+
+    def _nodo(self, pagina: int) -> Nodo:
+        nodo = self.cache.get(pagina)
+        if nodo is not None:
+            self.cache.move_to_end(pagina)
+            return nodo
+        nodo = Nodo.leer(pagina, os.pread(self.fd, self.tamano_pagina, pagina * self.tamano_pagina))
+        self.paginas_leidas += 1
+        self.cache[pagina] = nodo
+        return nodo
+
+    def _escribir_nodo(self, nodo: Nodo) -> None:
+        os.pwrite(self.fd, nodo.serializar(self.tamano_pagina), nodo.pagina * self.tamano_pagina)
+        nodo.sucio = False
+        self.sucios.pop(nodo.pagina, None)
+        self.paginas_escritas += 1
+
+    def _escribir_sucios(self) -> None:
+        """
+        Escribe todas las páginas modificadas y después, si ha cambiado, la página 0
+        """
+        for nodo in list(self.sucios.values()):
+            self._escribir_nodo(nodo)
+        if self.meta_guardada != (self.raiz, self.num_paginas):
+            self._guardar_meta()
+
+    def _terminar_operacion(self) -> None:
+        """
+        Desaloja las páginas que sobran del buffer pool. Se hace al final de cada
+        operación y no durante ella, para que ningún nodo que la operación está
+        modificando salga del pool a medias.
+
+        Si hay que desalojar una página modificada se escriben todas (y la
+        página 0), no solo esa: una página suelta podría apuntar a otras que
+        aún no están en el archivo, por ejemplo la mitad nueva de una hoja
+        dividida. Así el archivo queda siempre como al final de una operación.
+        """
+        sobran = len(self.cache) - self.paginas_cache
+        if self.escritura_inmediata or \
+                (sobran > 0 and any(nodo.sucio for nodo in itertools.islice(self.cache.values(), sobran))):
+            self._escribir_sucios()
+        while len(self.cache) > self.paginas_cache:
+            self.cache.popitem(last=False)
+
+    def vaciar(self) -> None:
+        """
+        Escribe en el archivo todas las páginas modificadas y lo fuerza a disco
+        """
+        with self.cerrojo:
+            self._escribir_sucios()
+            os.fsync(self.fd)
+
+    def cerrar(self) -> None:
+        with self.cerrojo:
+            if self.fd < 0:
+                return
+            self.vaciar()
+            os.close(self.fd)
+            self.fd = -1
+            self.cache.clear()
+
+    def _hoja(self, clave: int) -> Tuple[Nodo, List[Nodo]]:
+        """
+        Baja desde la raíz hasta la hoja que corresponde a "clave".
+        Devuelve la hoja y los nodos internos recorridos
+        """
+        camino = []
+        nodo = self._nodo(self.raiz)
+        while not nodo.hoja:
+            camino.append(nodo)
+            nodo = self._nodo(nodo.hijos[bisect.bisect_right(nodo.claves, clave)])
+        return nodo, camino
+
+    def _buscar(self, clave: int) -> Optional[str]:
+        hoja, _ = self._hoja(clave)
+        i = bisect.bisect_left(hoja.claves, clave)
+        if i < len(hoja.claves) and hoja.claves[i] == clave:
+            return hoja.valores[i].decode()
+        return None
+
+    def _insertar(self, clave: int, valor: str) -> None:
+        datos = valor.encode()
+        if len(datos) > self.max_valor:
+            raise ValueError(f"El valor ocupa {len(datos)} bytes y el máximo es {self.max_valor}")
+        hoja, camino = self._hoja(clave)
+        i = bisect.bisect_left(hoja.claves, clave)
+        if i < len(hoja.claves) and hoja.claves[i] == clave:
+            # Actualización en el sitio
+            hoja.tamano += len(datos) - len(hoja.valores[i])
+            hoja.valores[i] = datos
+        else:
+            hoja.claves.insert(i, clave)
+            hoja.valores.insert(i, datos)
+            hoja.tamano += ENTRADA.size + len(datos)
+        self._marcar(hoja)
+        if hoja.tamano > self.tamano_pagina:
+            self._dividir_hoja(hoja, camino)
+
+    def _dividir_hoja(self, hoja: Nodo, camino: List[Nodo]) -> None:
+        # Se corta por la mitad de los bytes, no de las claves, porque los valores
+        # pueden tener tamaños muy distintos
+        acumulado = CABECERA.size
+        corte = 0
+        while acumulado + ENTRADA.size + len(hoja.valores[corte]) <= hoja.tamano // 2 or corte == 0:
+            acumulado += ENTRADA.size + len(hoja.valores[corte])
+            corte += 1
+        nueva = self._nueva_pagina(hoja=True)
+        nueva.claves, hoja.claves = hoja.claves[corte:], hoja.claves[:corte]
+        nueva.valores, hoja.valores = hoja.valores[corte:], hoja.valores[:corte]
+        nueva.tamano = hoja.tamano - acumulado + CABECERA.size
+        hoja.tamano = acumulado
+        nueva.siguiente, hoja.siguiente = hoja.siguiente, nueva.pagina
+        self._insertar_en_padre(hoja, nueva.claves[0], nueva, camino)
+
+    def _insertar_en_padre(self, izquierdo: Nodo, separador: int, derecho: Nodo, camino: List[Nodo]) -> None:
+        if not camino:
+            # Se ha dividido la raíz: el árbol crece un nivel
+            raiz = self._nueva_pagina(hoja=False)
+            raiz.claves = [separador]
+            raiz.hijos = [izquierdo.pagina, derecho.pagina]
+            # La página 0 se actualiza cuando la raíz nueva esté escrita
+            self.raiz = raiz.pagina
+            return
+        padre = camino.pop()
+        i = padre.hijos.index(izquierdo.pagina)
+        padre.claves.insert(i, separador)
+        padre.hijos.insert(i + 1, derecho.pagina)
+        self._marcar(padre)
+        if len(padre.claves) > self.max_claves_interno:
+            mitad = len(padre.claves) // 2
+            nuevo = self._nueva_pagina(hoja=False)
+            # La clave central sube al padre y no se queda en ninguno de los dos
+            subida = padre.claves[mitad]
+            nuevo.claves, padre.claves = padre.claves[mitad + 1:], padre.claves[:mitad]
+            nuevo.hijos, padre.hijos = padre.hijos[mitad + 1:], padre.hijos[:mitad + 1]
+            self._insertar_en_padre(padre, subida, nuevo, camino)
+
+    def _quitar(self, clave: int) -> None:
+        hoja, _ = self._hoja(clave)
+        i = bisect.bisect_left(hoja.claves, clave)
+        if i < len(hoja.claves) and hoja.claves[i] == clave:
+            hoja.tamano -= ENTRADA.size + len(hoja.valores[i])
+            del hoja.claves[i]
+            del hoja.valores[i]
+            self._marcar(hoja)
+
+    def leer(self, clave: int) -> Optional[str]:
+        inicio = time.perf_counter_ns()
+        with self.cerrojo:
+            valor = self._buscar(int(clave))
+            self._terminar_operacion()
+        self.metricas.registrar("l", time.perf_counter_ns() - inicio)
+        return valor
+
+    def escribir(self, clave: int, valor: str) -> bool:
+        inicio = time.perf_counter_ns()
+        with self.cerrojo:
+            self._insertar(int(clave), valor)
+            self._terminar_operacion()
+        self.metricas.registrar("e", time.perf_counter_ns() - inicio)
+        return True
+
+    def borrar(self, clave: int) -> bool:
+        inicio = time.perf_counter_ns()
+        with self.cerrojo:
+            self._quitar(int(clave))
+            self._terminar_operacion()
+        self.metricas.registrar("e", time.perf_counter_ns() - inicio)
+        return True
+
+    def leer_muchos(self, claves: List[int]) -> List[Optional[str]]:
+        if not claves:
+            return []
+        inicio = time.perf_counter_ns()
+        claves = [int(clave) for clave in claves]
+        valores: Dict[int, Optional[str]] = {}
+        with self.cerrojo:
+            # En orden de clave las búsquedas consecutivas comparten casi todo el camino
+            for clave in sorted(set(claves)):
+                valores[clave] = self._buscar(clave)
+            self._terminar_operacion()
+        self.metricas.registrar("l", time.perf_counter_ns() - inicio, len(claves))
+        return [valores[clave] for clave in claves]
+
+    def escribir_muchos(self, pares: List[Tuple[int, str]]) -> bool:
+        if not pares:
+            return True
+        inicio = time.perf_counter_ns()
+        with self.cerrojo:
+            for clave, valor in pares:
+                self._insertar(int(clave), valor)
+            self._terminar_operacion()
+        self.metricas.registrar("e", time.perf_counter_ns() - inicio, len(pares))
+        return True
+
+    def rango(self, desde: Optional[int] = None, hasta: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+        # Se copia cada hoja antes de devolver sus pares, así que el recorrido
+        # no sujeta el cerrojo mientras el que lo consume hace otras cosas
+        ultima = None
+        with self.cerrojo:
+            if desde is None:
+                hoja = self._nodo(self.raiz)
+                while not hoja.hoja:
+                    hoja = self._nodo(hoja.hijos[0])
+            else:
+                hoja, _ = self._hoja(desde)
+            pares = list(zip(hoja.claves, hoja.valores))
+            siguiente = hoja.siguiente
+            self._terminar_operacion()
+        while True:
+            for clave, valor in pares:
+                if (desde is not None and clave < desde) or (ultima is not None and clave <= ultima):
+                    continue
+                if hasta is not None and clave > hasta:
+                    return
+                ultima = clave
+                yield clave, valor.decode()
+            if siguiente == 0:
+                return
+            with self.cerrojo:
+                hoja = self._nodo(siguiente)
+                pares = list(zip(hoja.claves, hoja.valores))
+                siguiente = hoja.siguiente
+                self._terminar_operacion()
+
+    def procesar_operaciones(self, archivo: str, salida: Optional[SalidaResultados] = None) -> None:
+        if salida is None:
+            salida = SalidaResultados()
+        with open(archivo, 'r') as f:
+            for linea in f:
+                partes = linea.strip().split(" ", 2)
+                if partes[0] == "l":
+                    clave = int(partes[1])
+                    salida.escribir(clave, self.leer(clave))
+                elif partes[0] == "e":
+                    clave, valor = int(partes[1]), partes[2]
+                    self.escribir(clave, valor)
+                elif partes[0] == "b":
+                    self.borrar(int(partes[1]))
+        salida.vaciar()
+
+    def tiempos(self) -> List[Tuple[str, float]]:
+        return self.metricas.tiempos()
+
+
+if __name__ == "__main__":
+    tabla_arbol_b = TablaArbolB("tabla_arbol_b.db")
+    tabla_arbol_b.procesar_operaciones("escrituras.txt")
+    tabla_arbol_b.procesar_operaciones("lecturas.txt")
+    tabla_arbol_b.cerrar()
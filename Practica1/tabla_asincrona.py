@@ -0,0 +1,213 @@
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterable, Deque, Dict, Iterable, List, Optional, Tuple, Union
+from tabla_base import TablaBase
+from salida import SalidaResultados
+
+
+class TablaAsincrona:
+    """
+    Fachada asyncio sobre cualquier TablaBase: `await tabla.leer(clave)`,
+    `await tabla.escribir(clave, valor)`, etc. El trabajo de disco se hace en un
+    conjunto limitado de "max_hilos" hilos para no bloquear el bucle de eventos.
+
+    - Las escrituras y borrados se encolan y un único volcador los aplica por
+      lotes de hasta "max_lote" operaciones con escribir_muchos: las que llegan
+      mientras se está guardando un lote van juntas en el siguiente, así que
+      comparten una sola escritura al log (y un solo fsync según la durabilidad).
+    - Si se pide leer una clave que ya se está leyendo, se espera a esa misma
+      lectura en lugar de lanzar otra. Una escritura de la clave hace que las
+      lecturas siguientes no se unan a las que empezaron antes.
+
+    Por defecto hay un solo hilo, así que las operaciones llegan a la tabla
+    de una en una y sirve cualquier TablaBase. Solo se deben pedir más hilos
+    con tablas que se pueden usar desde varios hilos a la vez (Tabla1_2, y
+    Tabla1_3 o Tabla1_4 con concurrente=True); TablaLSM o TablaCacheada, por
+    ejemplo, no tienen cerrojos.
+    """
+
+    def __init__(self, tabla: TablaBase, max_hilos: int = 1, max_lote: int = 1000):
+        if max_hilos < 1 or max_lote < 1:
+            raise ValueError("max_hilos y max_lote deben ser al menos 1")
+        self.tabla = tabla
+        self.max_lote = max_lote
+        self.ejecutor = ThreadPoolExecutor(max_workers=max_hilos, thread_name_prefix="tabla-asincrona")
+        # clave -> lectura en curso de esa clave
+        self.lecturas_en_curso: Dict[int, asyncio.Future] = {}
+        # Operaciones pendientes de guardar: ("e", clave, valor) o ("b", clave, None)
+        self.cola_escrituras: Deque[Tuple[Tuple[str, int, Optional[str]], asyncio.Future]] = deque()
+        self.volcador: Optional[asyncio.Task] = None
+        self.lecturas_compartidas = 0
+        self.lotes_escritos = 0
+
+    async def _en_ejecutor(self, funcion, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.ejecutor, funcion, *args)
+
+    async def leer(self, clave: int) -> Optional[str]:
+        clave = int(clave)
+        lectura = self.lecturas_en_curso.get(clave)
+        if lectura is not None:
+            self.lecturas_compartidas += 1
+        else:
+            lectura = asyncio.ensure_future(self._en_ejecutor(self.tabla.leer, clave))
+            self.lecturas_en_curso[clave] = lectura
+            lectura.add_done_callback(lambda _: self._terminar_lectura(clave, lectura))
+        # shield: si se cancela un lector no se cancela la lectura de los demás
+        return await asyncio.shield(lectura)
+
+    def _terminar_lectura(self, clave: int, lectura: asyncio.Future) -> None:
+        if self.lecturas_en_curso.get(clave) is lectura:
+            del self.lecturas_en_curso[clave]
+
+    def _encolar(self, operacion: str, clave: int, valor: Optional[str]) -> asyncio.Future:
+        # Una lectura que ya estaba en curso puede devolver el valor anterior,
+        # así que las siguientes no deben unirse a ella
+        self.lecturas_en_curso.pop(clave, None)
+        futuro = asyncio.get_running_loop().create_future()
+        self.cola_escrituras.append(((operacion, clave, valor), futuro))
+        if self.volcador is None:
+            self.volcador = asyncio.ensure_future(self._volcar())
+        return futuro
+
+    async def _volcar(self) -> None:
+        """
+        Guarda las operaciones de la cola por lotes hasta vaciarla
+        """
+        try:
+            while self.cola_escrituras:
+                lote = [self.cola_escrituras.popleft()
+                        for _ in range(min(self.max_lote, len(self.cola_escrituras)))]
+                try:
+                    await self._en_ejecutor(self._aplicar_lote, [operacion for operacion, _ in lote])
+                except Exception as e:
+                    for _, futuro in lote:
+                        if not futuro.done():
+                            futuro.set_exception(e)
+                    continue
+                self.lotes_escritos += 1
+                for (_, clave, _), futuro in lote:
+                    self.lecturas_en_curso.pop(clave, None)
+                    if not futuro.done():
+                        futuro.set_result(True)
+        finally:
+            self.volcador = None
+
+    def _aplicar_lote(self, operaciones: List[Tuple[str, int, Optional[str]]]) -> None:
+        # Las escrituras seguidas van en un solo escribir_muchos; los borrados
+        # se aplican en su sitio para respetar el orden
+        pares: List[Tuple[int, str]] = []
+        for operacion, clave, valor in operaciones:
+            if operacion == "e":
+                pares.append((clave, valor))
+                continue
+            if pares:
+                self.tabla.escribir_muchos(pares)
+                pares = []
+            self.tabla.borrar(clave)
+        if pares:
+            self.tabla.escribir_muchos(pares)
+
+    async def escribir(self, clave: int, valor: str) -> bool:
+        return await self._encolar("e", int(clave), valor)
+
+    async def borrar(self, clave: int) -> bool:
+        return await self._encolar("b", int(clave), None)
+
+    async def leer_muchos(self, claves: List[int]) -> List[Optional[str]]:
+        return await self._en_ejecutor(self.tabla.leer_muchos, [int(clave) for clave in claves])
+
+    async def escribir_muchos(self, pares: List[Tuple[int, str]]) -> bool:
+        futuros = [self._encolar("e", int(clave), valor) for clave, valor in pares]
+        await asyncio.gather(*futuros)
+        return True
+
+    async def esperar_escrituras(self) -> None:
+        """
+        Espera a que se guarden todas las escrituras encoladas
+        """
+        while self.volcador is not None:
+            await asyncio.shield(self.volcador)
+
+    async def cerrar(self) -> None:
+        await self.esperar_escrituras()
+        cerrar = getattr(self.tabla, "cerrar", None)
+        if cerrar is not None:
+            await self._en_ejecutor(cerrar)
+        self.ejecutor.shutdown()
+
+    async def _leer_tras(self, clave: int, escritura: Optional[asyncio.Future]) -> Optional[str]:
+        if escritura is not None:
+            await escritura
+        return await self.leer(clave)
+
+    @staticmethod
+    async def _lineas(fuente: Union[str, Iterable[str], AsyncIterable[str]]):
+        if isinstance(fuente, str):
+            with open(fuente, 'r') as f:
+                for linea in f:
+                    yield linea
+        elif hasattr(fuente, "__aiter__"):
+            async for linea in fuente:
+                yield linea
+        else:
+            for linea in fuente:
+                yield linea
+
+    async def procesar_operaciones(self, fuente: Union[str, Iterable[str], AsyncIterable[str]],
+                                   ventana: int = 1000, salida: Optional[SalidaResultados] = None) -> None:
+        """
+        Procesa las operaciones (`l <clave>`, `e <clave> <valor>`, `b <clave>`) del
+        archivo de nombre "fuente" o de cualquier secuencia, síncrona o asíncrona,
+        de líneas. Hasta "ventana" operaciones están en curso a la vez, así que las
+        escrituras seguidas se agrupan en lotes; una lectura espera a la última
+        escritura anterior de su clave y los resultados se escriben en "salida"
+        en el orden de las operaciones.
+        """
+        if salida is None:
+            salida = SalidaResultados()
+        # (operación, clave, futuro) de las operaciones en curso, en orden
+        en_curso: Deque[Tuple[str, int, asyncio.Future]] = deque()
+        # Para cada clave, su última escritura sin terminar y las lecturas en curso
+        # posteriores: una lectura espera a la escritura anterior y una escritura
+        # espera a las lecturas anteriores, así que cada clave mantiene su orden
+        ultima_escritura: Dict[int, asyncio.Future] = {}
+        lecturas: Dict[int, List[asyncio.Future]] = {}
+
+        async def terminar_primera() -> None:
+            operacion, clave, futuro = en_curso.popleft()
+            resultado = await futuro
+            if operacion == "l":
+                salida.escribir(clave, resultado)
+                if futuro in lecturas.get(clave, ()):
+                    lecturas[clave].remove(futuro)
+                    if not lecturas[clave]:
+                        del lecturas[clave]
+            elif ultima_escritura.get(clave) is futuro:
+                # Ya está guardada, las lecturas siguientes no tienen que esperarla
+                del ultima_escritura[clave]
+
+        async for linea in self._lineas(fuente):
+            partes = linea.strip().split(" ", 2)
+            if partes[0] == "l":
+                clave = int(partes[1])
+                futuro = asyncio.ensure_future(self._leer_tras(clave, ultima_escritura.get(clave)))
+                lecturas.setdefault(clave, []).append(futuro)
+            elif partes[0] in ("e", "b"):
+                clave = int(partes[1])
+                anteriores = lecturas.pop(clave, None)
+                if anteriores:
+                    await asyncio.wait(anteriores)
+                futuro = self._encolar(partes[0], clave, partes[2] if partes[0] == "e" else None)
+                ultima_escritura[clave] = futuro
+            else:
+                continue
+            en_curso.append((partes[0], clave, futuro))
+            while len(en_curso) > ventana or (en_curso and en_curso[0][2].done()):
+                await terminar_primera()
+        while en_curso:
+            await terminar_primera()
+        salida.vaciar()
+
+    def tiempos(self) -> List[Tuple[str, float]]:
+        return self.tabla.tiempos()
@@ -1,5 +1,6 @@
-from typing import List, Tuple, Optional
+from typing import Iterator, List, Tuple, Optional
 from abc import abstractmethod, ABC
+from salida import SalidaResultados
 
 
 class TablaBase(ABC):
@@ -24,15 +25,54 @@ class TablaBase(ABC):
         raise NotImplementedError
 
     @abstractmethod
-    def procesar_operaciones(self, archivo: str) -> None:
+    def borrar(self, clave: int) -> bool:
+        """
+        Borra de la tabla la clave "clave" escribiendo una lápida: a partir
+        de ese momento leer la clave devuelve None
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def leer_muchos(self, claves: List[int]) -> List[Optional[str]]:
+        """
+        Lee de la tabla el último valor de cada una de las claves de "claves".
+        Devuelve una lista con los valores en el mismo orden (None si no hay clave)
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def escribir_muchos(self, pares: List[Tuple[int, str]]) -> bool:
+        """
+        Escribe en la tabla todos los pares (clave, valor) de "pares", en orden
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def rango(self, desde: Optional[int] = None, hasta: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+        """
+        Devuelve en orden de clave los pares (<clave>, <último valor>) con
+        desde <= clave <= hasta (sin límite si es None), sin las claves borradas
+        """
+        raise NotImplementedError
+
+    def iterar(self) -> Iterator[Tuple[int, str]]:
+        """
+        Recorre toda la tabla en orden de clave
+        """
+        return self.rango()
+
+    @abstractmethod
+    def procesar_operaciones(self, archivo: str, salida: Optional[SalidaResultados] = None) -> None:
         """
         Procesa la secuencia de operaciones de lectura y escritura
         en el archivo con nombre "archivo", donde cada línea es de la forma:
 
         - `l <clave>`: devuelve de la tabla el valor asociado a la clave "<clave>"
-           y lo imprime por pantalla.
+           y lo escribe en "salida" (por defecto se imprime por pantalla; ver
+           SalidaResultados y SalidaNula).
         - `e <clave> <valor>`: introduce en la tabla el valor "<valor>" asociado
            a la clave "<clave>".
+        - `b <clave>`: borra de la tabla la clave "<clave>".
         """
         raise NotImplementedError
 
@@ -41,6 +81,8 @@ class TablaBase(ABC):
         """
         devuelve una lista con todas las operaciones realizadas y el tiempo que tomaron.
         Cada elemento de la lista es de la forma (<operacion>, <tiempo>),
-        donde "<operacion>" es el tipo ("l" o "e") y "<tiempo>" es el tiempo en segundos
+        donde "<operacion>" es el tipo ("l" o "e", que incluye los borrados) y "<tiempo>" es el tiempo en segundos.
+        Las tablas guardan los tiempos en histogramas (ver Metricas), así que la lista
+        se construye a partir de ellos y no conserva el orden de las operaciones
         """
         raise NotImplementedError
@@ -0,0 +1,182 @@
+import json
+import os
+import struct
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from tabla_base import TablaBase
+from metricas import Metricas
+from salida import SalidaResultados
+from mezcla import mezclar
+from p1_4 import Tabla1_4
+
+CLAVE = struct.Struct("<q")
+ARCHIVO_CONFIGURACION = "fragmentos.json"
+
+
+def fragmento_de(clave: int, num_fragmentos: int) -> int:
+    """
+    Fragmento al que pertenece la clave "clave". Se usa el CRC32 de la clave
+    en lugar de hash() para que el reparto sea el mismo en todos los procesos
+    y las claves consecutivas no caigan siempre en el mismo fragmento.
+    """
+    return zlib.crc32(CLAVE.pack(int(clave))) % num_fragmentos
+
+
+def configurar_fragmentos(directorio: Path, num_fragmentos: Optional[int]) -> int:
+    """
+    Devuelve el número de fragmentos guardado en "directorio", o guarda
+    "num_fragmentos" si la tabla es nueva
+    """
+    ruta = directorio / ARCHIVO_CONFIGURACION
+    if ruta.exists():
+        with open(ruta, 'r') as f:
+            guardado = json.load(f)["fragmentos"]
+        if num_fragmentos is not None and num_fragmentos != guardado:
+            raise ValueError(f"La tabla {directorio} se creó con {guardado} fragmentos, no {num_fragmentos}")
+        return guardado
+
+    if num_fragmentos is None or num_fragmentos < 1:
+        raise ValueError("Hay que indicar un número de fragmentos de al menos 1 al crear la tabla")
+    temporal = ruta.with_suffix(".tmp")
+    with open(temporal, 'w') as f:
+        json.dump({"fragmentos": num_fragmentos}, f)
+    os.replace(temporal, ruta)
+    return num_fragmentos
+
+
+def crear_tabla1_4(carpeta: str) -> TablaBase:
+    """
+    Fábrica por defecto de los fragmentos: un Tabla1_4 con los segmentos en
+    "carpeta". Es una función de módulo para que se pueda pasar a otros procesos.
+    """
+    return Tabla1_4(carpeta, directorio=carpeta)
+
+
+class TablaFragmentada(TablaBase):
+    """
+    Tabla que reparte las claves por hash entre "num_fragmentos" tablas
+    independientes, cada una en su propia carpeta dentro de "directorio".
+    Cada fragmento tiene su propio log y su propia consolidación, así que las
+    escrituras, los fsync y las consolidaciones de fragmentos distintos se
+    hacen en paralelo (y en discos distintos si las carpetas lo están).
+
+    El número de fragmentos se fija al crear la tabla y se guarda en el
+    directorio: cambiarlo movería las claves de fragmento, así que abrir la
+    tabla con otro número es un error.
+
+    - "fabrica": crea la tabla de un fragmento a partir de su carpeta. Por
+      defecto un Tabla1_4 que guarda sus segmentos en esa carpeta.
+    - "paralelo": si es True las operaciones por lotes se reparten entre los
+      fragmentos y se ejecutan a la vez, cada fragmento en un hilo.
+    """
+    def __init__(self, directorio: str, num_fragmentos: Optional[int] = None,
+                 fabrica: Optional[Callable[[str], TablaBase]] = None, paralelo: bool = True):
+        self.dir = Path(directorio)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.num_fragmentos = configurar_fragmentos(self.dir, num_fragmentos)
+        self.metricas = Metricas()
+
+        if fabrica is None:
+            fabrica = crear_tabla1_4
+        self.fragmentos: List[TablaBase] = []
+        for i in range(self.num_fragmentos):
+            carpeta = self.dir / str(i)
+            carpeta.mkdir(exist_ok=True)
+            self.fragmentos.append(fabrica(str(carpeta)))
+
+        self.ejecutor = ThreadPoolExecutor(max_workers=self.num_fragmentos,
+                                           thread_name_prefix=f"fragmentos-{self.dir.name}") \
+            if paralelo and self.num_fragmentos > 1 else None
+
+    def fragmento(self, clave: int) -> TablaBase:
+        return self.fragmentos[fragmento_de(clave, self.num_fragmentos)]
+
+    def _repartir(self, funcion: Callable, lotes: Dict[int, list]) -> Dict[int, object]:
+        """
+        Llama a "funcion(fragmento, lote)" para cada lote y devuelve los resultados
+        por número de fragmento. Con el ejecutor los lotes se procesan a la vez.
+        """
+        if self.ejecutor is None or len(lotes) == 1:
+            return {i: funcion(self.fragmentos[i], lote) for i, lote in lotes.items()}
+        futuros = {i: self.ejecutor.submit(funcion, self.fragmentos[i], lote) for i, lote in lotes.items()}
+        return {i: futuro.result() for i, futuro in futuros.items()}
+
+    def leer(self, clave: int) -> Optional[str]:
+        inicio = time.perf_counter_ns()
+        valor = self.fragmento(clave).leer(int(clave))
+        self.metricas.registrar("l", time.perf_counter_ns() - inicio)
+        return valor
+
+    def escribir(self, clave: int, valor: str) -> bool:
+        inicio = time.perf_counter_ns()
+        resultado = self.fragmento(clave).escribir(int(clave), valor)
+        self.metricas.registrar("e", time.perf_counter_ns() - inicio)
+        return resultado
+
+    def borrar(self, clave: int) -> bool:
+        inicio = time.perf_counter_ns()
+        resultado = self.fragmento(clave).borrar(int(clave))
+        self.metricas.registrar("e", time.perf_counter_ns() - inicio)
+        return resultado
+
+    def leer_muchos(self, claves: List[int]) -> List[Optional[str]]:
+        if not claves:
+            return []
+        inicio = time.perf_counter_ns()
+        claves = [int(clave) for clave in claves]
+        lotes: Dict[int, List[int]] = {}
+        for clave in dict.fromkeys(claves):
+            lotes.setdefault(fragmento_de(clave, self.num_fragmentos), []).append(clave)
+        resultados = self._repartir(lambda fragmento, lote: fragmento.leer_muchos(lote), lotes)
+        valores = {}
+        for i, lote in lotes.items():
+            valores.update(zip(lote, resultados[i]))
+        self.metricas.registrar("l", time.perf_counter_ns() - inicio, len(claves))
+        return [valores[clave] for clave in claves]
+
+    def escribir_muchos(self, pares: List[Tuple[int, str]]) -> bool:
+        if not pares:
+            return True
+        inicio = time.perf_counter_ns()
+        # Cada clave va siempre al mismo fragmento, así que basta con conservar
+        # el orden dentro de cada lote para que gane la última escritura
+        lotes: Dict[int, List[Tuple[int, str]]] = {}
+        for clave, valor in pares:
+            lotes.setdefault(fragmento_de(clave, self.num_fragmentos), []).append((int(clave), valor))
+        resultados = self._repartir(lambda fragmento, lote: fragmento.escribir_muchos(lote), lotes)
+        self.metricas.registrar("e", time.perf_counter_ns() - inicio, len(pares))
+        return all(resultados.values())
+
+    def rango(self, desde: Optional[int] = None, hasta: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+        # Los fragmentos no comparten claves, así que la mezcla solo los intercala
+        return mezclar([fragmento.rango(desde, hasta) for fragmento in self.fragmentos])
+
+    def cerrar(self) -> None:
+        for fragmento in self.fragmentos:
+            cerrar = getattr(fragmento, "cerrar", None)
+            if cerrar is not None:
+                cerrar()
+        if self.ejecutor is not None:
+            self.ejecutor.shutdown()
+
+    def procesar_operaciones(self, archivo: str, salida: Optional[SalidaResultados] = None) -> None:
+        if salida is None:
+            salida = SalidaResultados()
+        with open(archivo, 'r') as f:
+            for linea in f:
+                partes = linea.strip().split(" ", 2)
+                if partes[0] == "l":
+                    clave = int(partes[1])
+                    salida.escribir(clave, self.leer(clave))
+                elif partes[0] == "e":
+                    clave, valor = int(partes[1]), partes[2]
+                    self.escribir(clave, valor)
+                elif partes[0] == "b":
+                    self.borrar(int(partes[1]))
+        salida.vaciar()
+
+    def tiempos(self) -> List[Tuple[str, float]]:
+        return self.metricas.tiempos()
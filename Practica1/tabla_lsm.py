@@ -0,0 +1,469 @@
+import bisect
+import json
+import os
+import struct
+import time
+from pathlib import Path
+from typing import Optional, List, Tuple, Dict, Iterator, Iterable
+from tabla_base import TablaBase
+from metricas import Metricas
+from salida import SalidaResultados
+from formato_registro import BORRADO, FormatoBinario, recuperar_archivo
+from filtro_bloom import FiltroBloom
+from mezcla import mezclar
+from durabilidad import sincronizar_directorio, archivo_atomico
+
+# Lista ordenada de los SSTables vivos de la tabla
+ARCHIVO_MANIFIESTO = "manifiesto.json"
+
+
+class SSTable:
+    """
+    Segmento inmutable con los registros ordenados por clave.
+
+    El archivo se divide en bloques de unos TAMANO_BLOQUE bytes con los
+    registros en formato binario. Al final se guarda un índice disperso con
+    la primera clave, el offset y la longitud de cada bloque, seguido de un
+    pie de tamaño fijo que indica dónde empieza ese índice. Las claves
+    borradas se guardan como lápidas (registros con el flag BORRADO).
+
+    Junto a cada SSTable se guarda un filtro de Bloom con sus claves
+    (archivo ".bloom"), de forma que buscar una clave que no tiene casi
+    nunca lee el archivo.
+    """
+    TAMANO_BLOQUE = 4096
+    # primera clave del bloque (int64), offset (uint64), longitud (uint32)
+    ENTRADA_INDICE = struct.Struct("<qQI")
+    # offset del índice (uint64), número de bloques (uint32)
+    PIE = struct.Struct("<QI")
+    CABECERA = FormatoBinario.CABECERA
+
+    def __init__(self, ruta: str):
+        self.ruta = ruta
+        self.ruta_filtro = str(Path(ruta).with_suffix(".bloom"))
+        self.primeras_claves: List[int] = []
+        self.bloques: List[Tuple[int, int]] = []
+        self.tamano = os.path.getsize(ruta)
+        # Los SSTables escritos antes de que existieran los filtros no tienen
+        self.filtro = FiltroBloom.cargar(self.ruta_filtro) if os.path.exists(self.ruta_filtro) else None
+
+        with open(self.ruta, 'rb') as f:
+            f.seek(-self.PIE.size, os.SEEK_END)
+            offset_indice, num_bloques = self.PIE.unpack(f.read(self.PIE.size))
+            f.seek(offset_indice)
+            indice = f.read(num_bloques * self.ENTRADA_INDICE.size)
+        for primera_clave, offset, longitud in self.ENTRADA_INDICE.iter_unpack(indice):
+            self.primeras_claves.append(primera_clave)
+            self.bloques.append((offset, longitud))
+
+    @classmethod
+    def escribir(cls, ruta: str, registros: Iterable[Tuple[int, Optional[str]]],
+                 tasa_falsos_positivos: float = 0.01) -> "SSTable":
+        """
+        Escribe en "ruta" los registros (clave, valor), que deben venir ordenados
+        por clave y sin repetir, y devuelve el SSTable resultante. Los registros
+        con valor None se escriben como lápidas.
+
+        El SSTable y su filtro quedan forzados a disco al terminar, pero la
+        tabla solo los usa tras abrirse si están en su manifiesto.
+        """
+        temporal = f"{ruta}.tmp"
+        indice = bytearray()
+        num_bloques = 0
+        claves = []
+        with open(temporal, 'wb') as f:
+            bloque = bytearray()
+            primera_clave = None
+            for clave, valor in registros:
+                claves.append(clave)
+                if primera_clave is None:
+                    primera_clave = clave
+                if valor is None:
+                    bloque += FormatoBinario.empaquetar(clave, b"", BORRADO)
+                else:
+                    bloque += FormatoBinario.empaquetar(clave, valor.encode())
+                if len(bloque) >= cls.TAMANO_BLOQUE:
+                    indice += cls.ENTRADA_INDICE.pack(primera_clave, f.tell(), len(bloque))
+                    num_bloques += 1
+                    f.write(bloque)
+                    bloque = bytearray()
+                    primera_clave = None
+            if bloque:
+                indice += cls.ENTRADA_INDICE.pack(primera_clave, f.tell(), len(bloque))
+                num_bloques += 1
+                f.write(bloque)
+            offset_indice = f.tell()
+            f.write(indice)
+            f.write(cls.PIE.pack(offset_indice, num_bloques))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporal, ruta)
+        sincronizar_directorio(os.path.dirname(os.path.abspath(ruta)))
+        FiltroBloom.crear(claves, tasa_falsos_positivos, len(claves)).guardar(str(Path(ruta).with_suffix(".bloom")))
+        return cls(ruta)
+
+    def puede_contener(self, clave: int) -> bool:
+        return self.filtro is None or clave in self.filtro
+
+    def eliminar(self) -> None:
+        os.remove(self.ruta)
+        if os.path.exists(self.ruta_filtro):
+            os.remove(self.ruta_filtro)
+
+    def _leer_bloque(self, fd: int, i: int) -> Iterator[Tuple[int, Optional[str]]]:
+        offset, longitud = self.bloques[i]
+        datos = os.pread(fd, longitud, offset)
+        posicion = 0
+        while posicion < len(datos):
+            clave, longitud_valor, flags, crc = self.CABECERA.unpack_from(datos, posicion)
+            posicion += self.CABECERA.size
+            if flags & BORRADO:
+                yield clave, None
+            else:
+                yield clave, datos[posicion:posicion + longitud_valor].decode()
+            posicion += longitud_valor
+
+    def buscar(self, clave: int) -> Tuple[bool, Optional[str]]:
+        """
+        Devuelve (<encontrada>, <valor>); una clave encontrada con valor
+        None está borrada y no hay que buscarla en SSTables más antiguos
+        """
+        if not self.puede_contener(clave):
+            return False, None
+        # El índice disperso nos dice el único bloque que puede tener la clave
+        i = bisect.bisect_right(self.primeras_claves, clave) - 1
+        if i < 0:
+            return False, None
+        fd = os.open(self.ruta, os.O_RDONLY)
+        try:
+            for clave_actual, valor in self._leer_bloque(fd, i):
+                if clave_actual == clave:
+                    return True, valor
+                if clave_actual > clave:
+                    break
+        finally:
+            os.close(fd)
+        return False, None
+
+    def leer(self, clave: int) -> Optional[str]:
+        return self.buscar(clave)[1]
+
+    def leer_muchos(self, claves: List[int]) -> Dict[int, Optional[str]]:
+        """
+        Busca varias claves leyendo cada bloque necesario una sola vez.
+        Devuelve un diccionario con las claves encontradas y su valor
+        (None si están borradas).
+        """
+        por_bloque: Dict[int, set] = {}
+        for clave in claves:
+            if not self.puede_contener(clave):
+                continue
+            i = bisect.bisect_right(self.primeras_claves, clave) - 1
+            if i >= 0:
+                por_bloque.setdefault(i, set()).add(clave)
+        valores = {}
+        if not por_bloque:
+            return valores
+        fd = os.open(self.ruta, os.O_RDONLY)
+        try:
+            for i in sorted(por_bloque):
+                buscadas = por_bloque[i]
+                for clave, valor in self._leer_bloque(fd, i):
+                    if clave in buscadas:
+                        valores[clave] = valor
+        finally:
+            os.close(fd)
+        return valores
+
+    def rango(self, desde: Optional[int] = None, hasta: Optional[int] = None) -> Iterator[Tuple[int, Optional[str]]]:
+        """
+        Devuelve en orden los registros con desde <= clave <= hasta (incluidas
+        las lápidas, con valor None), leyendo solo los bloques que pueden contenerlos
+        """
+        i = 0
+        if desde is not None:
+            i = max(bisect.bisect_right(self.primeras_claves, desde) - 1, 0)
+        fd = os.open(self.ruta, os.O_RDONLY)
+        try:
+            while i < len(self.bloques):
+                for clave, valor in self._leer_bloque(fd, i):
+                    if hasta is not None and clave > hasta:
+                        return
+                    if desde is None or clave >= desde:
+                        yield clave, valor
+                i += 1
+        finally:
+            os.close(fd)
+
+
+class TablaLSM(TablaBase):
+    """
+    Tabla basada en un árbol LSM: las escrituras van a una memtable ordenada
+    en memoria (respaldada por un log de escritura anticipada) que se vuelca
+    a un SSTable inmutable cuando se llena. Las lecturas consultan la memtable
+    y después los SSTables del más nuevo al más antiguo.
+
+    El orden de los SSTables vivos se guarda en un manifiesto que se reescribe
+    de forma atómica: un SSTable nuevo (de un volcado o de una compactación)
+    solo cuenta cuando está en disco y el manifiesto lo incluye, y los que
+    reemplaza se borran después. Al abrir la tabla se borran los SSTables que
+    no están en el manifiesto.
+
+    La compactación es por tamaños: cuando hay SSTABLES_POR_FUSION SSTables
+    consecutivos de tamaño parecido (el mayor no supera FACTOR_TAMANO veces
+    al menor) se fusionan en uno, que tendrá el tamaño de los del siguiente
+    escalón. Cada registro se reescribe así unas log(n) veces en total, en
+    lugar de en cada compactación como al fusionarlos todos.
+    """
+    # Número de claves de la memtable antes de volcarla a disco
+    TAMANO_MEMTABLE = 1000
+    # Número de SSTables de tamaño parecido que se fusionan de una vez
+    SSTABLES_POR_FUSION = 4
+    FACTOR_TAMANO = 2
+
+    def __init__(self, nombre_tabla: str):
+        self.nombre_tabla = nombre_tabla
+        self.metricas = Metricas()
+
+        self.dir = Path(nombre_tabla)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.ruta_log = self.dir / "memtable.log"
+        self.formato_log = FormatoBinario()
+
+        # clave -> último valor escrito, o None si se ha borrado
+        self.memtable: Dict[int, Optional[str]] = {}
+        self.claves_memtable: List[int] = []
+        # Resultado de comprobar la cola del log al abrir la tabla
+        self.registros_recuperados = 0
+        self.bytes_truncados = 0
+
+        # Del más antiguo al más nuevo, según el manifiesto
+        self.sstables, self.nSSTables = self._cargar_sstables()
+
+        self._recuperar_memtable()
+
+    def _cargar_sstables(self) -> Tuple[List[SSTable], int]:
+        """
+        Abre los SSTables vivos en el orden del manifiesto y devuelve también el
+        último número de SSTable usado. Los archivos que no están en el
+        manifiesto son restos de un volcado o una compactación que no llegó a
+        publicarse, o entradas de una compactación que no se llegaron a borrar,
+        y se eliminan. Una carpeta sin manifiesto (de antes de que existiera)
+        se carga ordenando los SSTables por número y se le crea uno.
+        """
+        ruta = self.dir / ARCHIVO_MANIFIESTO
+        if not ruta.exists():
+            numeros = sorted(int(archivo.stem) for archivo in self.dir.glob("*.sst") if archivo.stem.isdigit())
+            sstables = [SSTable(str(self.dir / f"{numero}.sst")) for numero in numeros]
+            siguiente = numeros[-1] if numeros else 0
+            if sstables:
+                self._guardar_manifiesto(sstables, siguiente)
+            return sstables, siguiente
+
+        with open(ruta, 'r') as f:
+            manifiesto = json.load(f)
+        sstables = [SSTable(str(self.dir / archivo)) for archivo in manifiesto["sstables"]]
+        vivos = {Path(sstable.ruta).stem for sstable in sstables}
+        for archivo in self.dir.iterdir():
+            huerfano = archivo.suffix in (".sst", ".bloom") and archivo.stem not in vivos
+            # Los temporales son de escrituras que no llegaron a renombrarse
+            if huerfano or archivo.suffix == ".tmp":
+                archivo.unlink()
+        return sstables, manifiesto["siguiente"]
+
+    def _guardar_manifiesto(self, sstables: List[SSTable], siguiente: int) -> None:
+        """
+        Guarda la lista ordenada de SSTables vivos con archivo_atomico, así que
+        el manifiesto siempre es el anterior o el nuevo completo
+        """
+        with archivo_atomico(str(self.dir / ARCHIVO_MANIFIESTO)) as f:
+            json.dump({"siguiente": siguiente,
+                       "sstables": [Path(sstable.ruta).name for sstable in sstables]}, f)
+
+    def _recuperar_memtable(self) -> None:
+        """
+        Reconstruye la memtable a partir del log con las escrituras
+        que aún no se habían volcado a un SSTable
+        """
+        if not self.ruta_log.exists():
+            return
+        # Si el proceso cayó a mitad de una escritura, descartamos el registro incompleto
+        self.registros_recuperados, self.bytes_truncados = recuperar_archivo(str(self.ruta_log), self.formato_log)
+        with open(self.ruta_log, 'rb') as f:
+            for clave, offset, longitud, flags in self.formato_log.iterar(f):
+                if flags & BORRADO:
+                    self._insertar_memtable(clave, None)
+                else:
+                    self._insertar_memtable(clave, self.formato_log.leer_valor(f.fileno(), offset, longitud))
+
+    def _insertar_memtable(self, clave: int, valor: Optional[str]) -> None:
+        if clave not in self.memtable:
+            bisect.insort(self.claves_memtable, clave)
+        self.memtable[clave] = valor
+
+    def _nuevo_sstable(self, registros: Iterable[Tuple[int, Optional[str]]]) -> SSTable:
+        self.nSSTables += 1
+        return SSTable.escribir(str(self.dir / f"{self.nSSTables}.sst"), registros)
+
+    def _volcar_memtable(self) -> None:
+        if not self.memtable:
+            return
+        sstable = self._nuevo_sstable((clave, self.memtable[clave]) for clave in self.claves_memtable)
+        self._guardar_manifiesto(self.sstables + [sstable], self.nSSTables)
+        self.sstables.append(sstable)
+        self.memtable = {}
+        self.claves_memtable = []
+        # Los datos ya están en disco en un SSTable publicado, así que el log
+        # ya no hace falta. Si se cae antes de borrarlo, al abrir se vuelven a
+        # cargar en la memtable unas escrituras que el SSTable también tiene.
+        os.remove(self.ruta_log)
+
+        tramo = self._elegir_fusion()
+        while tramo is not None:
+            self._compactar(*tramo)
+            tramo = self._elegir_fusion()
+
+    def _elegir_fusion(self) -> Optional[Tuple[int, int]]:
+        """
+        Devuelve (inicio, fin) de SSTABLES_POR_FUSION SSTables consecutivos de
+        tamaño parecido, buscando desde los más nuevos, o None si no hay
+        """
+        tamanos = [sstable.tamano for sstable in self.sstables]
+        for fin in range(len(tamanos), self.SSTABLES_POR_FUSION - 1, -1):
+            inicio = fin - self.SSTABLES_POR_FUSION
+            if max(tamanos[inicio:fin]) <= self.FACTOR_TAMANO * min(tamanos[inicio:fin]):
+                return inicio, fin
+        return None
+
+    def _compactar(self, inicio: int, fin: int) -> None:
+        """
+        Fusiona los SSTables sstables[inicio:fin] recorriéndolos a la vez en
+        orden de clave; si una clave aparece en varios se queda el valor más
+        nuevo. Las lápidas solo se descartan si entre los fusionados está el
+        más antiguo, porque entonces no queda otro que pueda tener las claves.
+
+        El resultado es un SSTable nuevo que ocupa el sitio de los fusionados en
+        el manifiesto; los fusionados solo se borran después de guardarlo. Si se
+        interrumpe antes, el manifiesto sigue siendo el anterior y al abrir la
+        tabla se borra el resultado a medias, así que las lápidas descartadas
+        nunca dejan a la vista los valores que ocultaban.
+        """
+        antiguos = self.sstables[inicio:fin]
+        registros = mezclar([sstable.rango() for sstable in reversed(antiguos)])
+        if inicio == 0:
+            registros = ((clave, valor) for clave, valor in registros if valor is not None)
+        consolidado = self._nuevo_sstable(registros)
+        nuevos = self.sstables[:inicio] + [consolidado] + self.sstables[fin:]
+        self._guardar_manifiesto(nuevos, self.nSSTables)
+        self.sstables = nuevos
+        for sstable in antiguos:
+            sstable.eliminar()
+
+    def leer(self, clave: int) -> Optional[str]:
+        inicio = time.perf_counter_ns()
+        clave = int(clave)
+        valor = self.memtable.get(clave)
+        if clave not in self.memtable:
+            # Los filtros de Bloom evitan leer los SSTables que no tienen la clave
+            for sstable in reversed(self.sstables):
+                encontrada, valor = sstable.buscar(clave)
+                if encontrada:
+                    break
+        self.metricas.registrar("l", time.perf_counter_ns() - inicio)
+        return valor
+
+    def escribir(self, clave: int, valor: str) -> bool:
+        inicio = time.perf_counter_ns()
+        clave = int(clave)
+        registro, _, _ = self.formato_log.codificar(clave, valor)
+        with open(self.ruta_log, 'ab') as f:
+            f.write(registro)
+        self._insertar_memtable(clave, valor)
+        if len(self.memtable) >= self.TAMANO_MEMTABLE:
+            self._volcar_memtable()
+        self.metricas.registrar("e", time.perf_counter_ns() - inicio)
+        return True
+
+    def borrar(self, clave: int) -> bool:
+        inicio = time.perf_counter_ns()
+        clave = int(clave)
+        with open(self.ruta_log, 'ab') as f:
+            f.write(self.formato_log.codificar_borrado(clave))
+        # La lápida ocupa su sitio en la memtable y se vuelca al SSTable
+        # como cualquier otro registro
+        self._insertar_memtable(clave, None)
+        if len(self.memtable) >= self.TAMANO_MEMTABLE:
+            self._volcar_memtable()
+        self.metricas.registrar("e", time.perf_counter_ns() - inicio)
+        return True
+
+    def leer_muchos(self, claves: List[int]) -> List[Optional[str]]:
+        if not claves:
+            return []
+        inicio = time.perf_counter_ns()
+        claves = [int(clave) for clave in claves]
+        valores = {clave: self.memtable[clave] for clave in claves if clave in self.memtable}
+        pendientes = sorted(set(claves) - valores.keys())
+        for sstable in reversed(self.sstables):
+            if not pendientes:
+                break
+            valores.update(sstable.leer_muchos(pendientes))
+            pendientes = [clave for clave in pendientes if clave not in valores]
+        self.metricas.registrar("l", time.perf_counter_ns() - inicio, len(claves))
+        return [valores.get(clave) for clave in claves]
+
+    def escribir_muchos(self, pares: List[Tuple[int, str]]) -> bool:
+        if not pares:
+            return True
+        inicio = time.perf_counter_ns()
+        pares = [(int(clave), valor) for clave, valor in pares]
+        # Un solo append al log para todo el lote
+        with open(self.ruta_log, 'ab') as f:
+            f.write(b"".join(self.formato_log.codificar(clave, valor)[0] for clave, valor in pares))
+        for clave, valor in pares:
+            self._insertar_memtable(clave, valor)
+        if len(self.memtable) >= self.TAMANO_MEMTABLE:
+            self._volcar_memtable()
+        self.metricas.registrar("e", time.perf_counter_ns() - inicio, len(pares))
+        return True
+
+    def rango(self, desde: Optional[int] = None, hasta: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+        """
+        Devuelve en orden de clave los pares (clave, valor más nuevo)
+        con desde <= clave <= hasta, sin las claves borradas
+        """
+        inicio = 0 if desde is None else bisect.bisect_left(self.claves_memtable, desde)
+        fin = len(self.claves_memtable) if hasta is None else bisect.bisect_right(self.claves_memtable, hasta)
+        memtable = [(clave, self.memtable[clave]) for clave in self.claves_memtable[inicio:fin]]
+        fuentes = [iter(memtable)] + [sstable.rango(desde, hasta) for sstable in reversed(self.sstables)]
+        for clave, valor in mezclar(fuentes):
+            if valor is not None:
+                yield clave, valor
+
+    def cerrar(self) -> None:
+        self._volcar_memtable()
+
+    def procesar_operaciones(self, archivo: str, salida: Optional[SalidaResultados] = None) -> None:
+        if salida is None:
+            salida = SalidaResultados()
+        with open(archivo, 'r') as f:
+            for linea in f:
+                partes = linea.strip().split(" ", 2)
+                if partes[0] == "l":
+                    clave = int(partes[1])
+                    salida.escribir(clave, self.leer(clave))
+                elif partes[0] == "e":
+                    clave, valor = int(partes[1]), partes[2]
+                    self.escribir(clave, valor)
+                elif partes[0] == "b":
+                    self.borrar(int(partes[1]))
+        salida.vaciar()
+
+    def tiempos(self) -> List[Tuple[str, float]]:
+        return self.metricas.tiempos()
+
+
+if __name__ == "__main__":
+    tabla_lsm = TablaLSM("tabla_lsm")
+    tabla_lsm.procesar_operaciones("escrituras.txt")
+    tabla_lsm.procesar_operaciones("lecturas.txt")
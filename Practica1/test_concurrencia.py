@@ -0,0 +1,175 @@
+"""
+Prueba de estrés de las tablas compartidas entre hilos: varios hilos escriben
+y borran a la vez (en claves propias y en claves comunes) mientras otros leen,
+y al terminar se comprueba que no se ha perdido ninguna escritura, tanto con
+la tabla abierta como al volver a abrirla.
+
+Se ejecuta con: python -m pytest Practica1/test_concurrencia.py
+"""
+import random
+import sys
+import threading
+
+import pytest
+
+from durabilidad import PoliticaDurabilidad
+from p1_2 import Tabla1_2
+from p1_3 import Tabla1_3
+from p1_4 import Tabla1_4
+
+ESCRITORES = 6
+LECTORES = 3
+ESCRITURAS_POR_HILO = 300
+# Claves que escriben todos los hilos, además de las suyas propias
+CLAVES_COMUNES = 4
+
+
+def clave_propia(hilo: int, i: int) -> int:
+    return hilo * 100000 + i
+
+
+def valor(hilo: int, i: int) -> str:
+    return f"h{hilo}-e{i}"
+
+
+# Nombre -> función que abre la tabla en la carpeta dada
+FABRICAS = {
+    "Tabla1_2": lambda carpeta: Tabla1_2(str(carpeta / "tabla1_2.txt")),
+    "Tabla1_2-siempre": lambda carpeta: Tabla1_2(str(carpeta / "tabla1_2.txt"),
+                                                  durabilidad=PoliticaDurabilidad.siempre()),
+    "Tabla1_3": lambda carpeta: Tabla1_3(str(carpeta / "tabla1_3.txt"), concurrente=True),
+    "Tabla1_3-binario-mmap": lambda carpeta: Tabla1_3(str(carpeta / "tabla1_3.txt"), formato="binario",
+                                                      modo_lectura="mmap", concurrente=True),
+    "Tabla1_3-siempre": lambda carpeta: Tabla1_3(str(carpeta / "tabla1_3.txt"), concurrente=True,
+                                                  durabilidad=PoliticaDurabilidad.siempre()),
+    "Tabla1_4": lambda carpeta: Tabla1_4("tabla1_4", directorio=str(carpeta / "segmentos"), concurrente=True),
+    "Tabla1_4-zlib": lambda carpeta: Tabla1_4("tabla1_4", directorio=str(carpeta / "segmentos"),
+                                              concurrente=True, compresion="zlib"),
+}
+
+
+@pytest.fixture(autouse=True)
+def cambios_de_hilo_frecuentes():
+    # Cambiar de hilo mucho más a menudo que por defecto hace que salgan
+    # entrelazados que con el intervalo normal casi nunca se dan
+    anterior = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)
+    yield
+    sys.setswitchinterval(anterior)
+
+
+def ejecutar_hilos(objetivos) -> None:
+    """
+    Lanza un hilo por función y espera a todos; si alguno falla, relanza su error
+    """
+    errores = []
+
+    def envolver(objetivo):
+        def ejecutar():
+            try:
+                objetivo()
+            except BaseException as e:
+                errores.append(e)
+        return ejecutar
+
+    hilos = [threading.Thread(target=envolver(objetivo)) for objetivo in objetivos]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    if errores:
+        raise errores[0]
+
+
+def comprobar(tabla, esperados, comunes) -> None:
+    for clave, esperado in esperados.items():
+        assert tabla.leer(clave) == esperado, f"clave {clave}"
+    claves = sorted(esperados)
+    assert tabla.leer_muchos(claves) == [esperados[clave] for clave in claves]
+    for clave, posibles in comunes.items():
+        assert tabla.leer(clave) in posibles, f"clave común {clave}"
+
+
+@pytest.mark.parametrize("nombre", sorted(FABRICAS))
+def test_escrituras_concurrentes_no_se_pierden(tmp_path, nombre):
+    tabla = FABRICAS[nombre](tmp_path)
+    # Lo último que ha hecho cada hilo con sus claves propias (None si la borró)
+    esperados = {}
+    # Valores que ha podido dejar cualquiera de los hilos en cada clave común
+    comunes = {clave: set() for clave in range(-CLAVES_COMUNES, 0)}
+    cerrojo = threading.Lock()
+    terminado = threading.Event()
+    # Al final todos los escritores escriben a la vez en las claves comunes,
+    # que es cuando un índice en distinto orden que el log se notaría al reabrir
+    barrera = threading.Barrier(ESCRITORES)
+
+    def escritor(hilo: int):
+        try:
+            escribir(hilo)
+        except BaseException:
+            # Que los demás no se queden esperando en la barrera
+            barrera.abort()
+            raise
+
+    def escribir(hilo: int):
+        aleatorio = random.Random(hilo)
+        propios = {}
+        for i in range(ESCRITURAS_POR_HILO):
+            operacion = aleatorio.random()
+            if operacion < 0.1 and propios:
+                clave = aleatorio.choice(list(propios))
+                tabla.borrar(clave)
+                propios[clave] = None
+            elif operacion < 0.2:
+                pares = [(clave_propia(hilo, i * 10 + j), valor(hilo, i * 10 + j)) for j in range(5)]
+                tabla.escribir_muchos(pares)
+                propios.update(pares)
+            elif operacion < 0.5:
+                clave = -aleatorio.randint(1, CLAVES_COMUNES)
+                with cerrojo:
+                    comunes[clave].add(valor(hilo, i))
+                tabla.escribir(clave, valor(hilo, i))
+            else:
+                # A veces sobrescribe una clave suya anterior
+                clave = clave_propia(hilo, aleatorio.randrange(i + 1) * 10)
+                tabla.escribir(clave, valor(hilo, i))
+                propios[clave] = valor(hilo, i)
+        barrera.wait()
+        for clave in range(-CLAVES_COMUNES, 0):
+            with cerrojo:
+                comunes[clave].add(valor(hilo, ESCRITURAS_POR_HILO))
+            tabla.escribir(clave, valor(hilo, ESCRITURAS_POR_HILO))
+        with cerrojo:
+            esperados.update(propios)
+
+    def lector(hilo: int):
+        aleatorio = random.Random(-hilo)
+        while not terminado.is_set():
+            escritor_leido = aleatorio.randrange(ESCRITORES)
+            clave = clave_propia(escritor_leido, aleatorio.randrange(ESCRITURAS_POR_HILO * 10))
+            leido = tabla.leer(clave)
+            # Un lector puede no ver aún una escritura, pero nunca un valor ajeno o a medias
+            assert leido is None or leido.startswith(f"h{escritor_leido}-e"), (clave, leido)
+
+    def escritores():
+        try:
+            ejecutar_hilos([lambda hilo=hilo: escritor(hilo) for hilo in range(ESCRITORES)])
+        finally:
+            terminado.set()
+
+    ejecutar_hilos([escritores] + [lambda hilo=hilo: lector(hilo) for hilo in range(LECTORES)])
+    comunes = {clave: posibles for clave, posibles in comunes.items() if posibles}
+
+    if isinstance(tabla, Tabla1_4):
+        tabla.esperar_consolidacion()
+    comprobar(tabla, esperados, comunes)
+    # Las claves comunes deben verse igual antes y después de reabrir la tabla
+    finales = {clave: tabla.leer(clave) for clave in comunes}
+    tabla.cerrar()
+
+    reabierta = FABRICAS[nombre](tmp_path)
+    try:
+        comprobar(reabierta, esperados, comunes)
+        assert {clave: reabierta.leer(clave) for clave in comunes} == finales
+    finally:
+        reabierta.cerrar()